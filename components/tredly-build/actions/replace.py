@@ -16,6 +16,7 @@ from objects.tredly.tredlyfile import *
 from objects.tredly.unboundfile import *
 from objects.layer4proxy.layer4proxyfile import *
 from objects.tredly.tredlyhost import TredlyHost
+from objects.tredly.servicereload import ServiceReload
 
 class ActionReplace:
     def __init__(self, subject, target, identifier, actionArgs):
@@ -170,6 +171,9 @@ class ActionReplace:
         # start the container
         newContainer.start(containerInterface, containerIp4, containerCidr)
 
+        # the proxies and DNS must point at the new container before the old one goes away
+        ServiceReload().reloadPending()
+
         # the new container has been created so we're no longer interested incapturing sigint
         signal.signal(signal.SIGINT, signal.SIG_DFL)
 
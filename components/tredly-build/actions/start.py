@@ -4,6 +4,7 @@ from subprocess import Popen, PIPE
 import urllib.request
 import os.path
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 from includes.util import *
 from includes.defines import *
@@ -12,11 +13,15 @@ from objects.tredly.tredlyhost import TredlyHost
 from objects.tredly.container import *
 from objects.tredly.tredlyfile import *
 from objects.tredly.unboundfile import *
+from objects.tredly.servicereload import ServiceReload
 
 class ActionStart():
     def __init__(self, subject, target, identifier, actionArgs):
         if (subject == "container"):
             self.startContainer(target, actionArgs['ip4Addr'])
+        elif (subject == "containers"):
+            # target can be a partition name or None (all containers on host)
+            self.startContainers(target)
         else:
             e_error("No command " + subject + " found.")
             exit(1)
@@ -129,3 +134,109 @@ class ActionStart():
             timeTaken = 1
 
         e_success("Total time taken: " + str(timeTaken) + " seconds")
+
+    # start all stopped containers on a partition or the host
+    def startContainers(self, partitionName):
+        startTime = time.time()
+        tredlyHost = TredlyHost()
+
+        containers = []
+
+        # if partitionName was set then get that partitions containers
+        if (partitionName is not None):
+            if (partitionName not in tredlyHost.getPartitionNames()):
+                e_error("Partition " + partitionName + " does not exist.")
+                exit(1)
+
+            # get a list of containers on this partition
+            containers = tredlyHost.getPartitionContainerUUIDs(partitionName)
+        else:
+            # get a list of all containers on host
+            containers = tredlyHost.getAllContainerUUIDs()
+
+        # load the stopped containers, grouping them by their start order
+        startOrders = {}
+        for uuid in containers:
+            container = Container()
+
+            # set up the dataset name that contains this containers data
+            containerDataset = ZFS_TREDLY_PARTITIONS_DATASET + "/" + tredlyHost.getContainerPartition(uuid) + "/" + TREDLY_CONTAINER_DIR_NAME + "/" + uuid
+
+            # load the containers properties from ZFS
+            container.loadFromZFS(containerDataset)
+            if (container.uuid is None):
+                container.uuid = uuid
+
+            if (container.isRunning()):
+                continue
+
+            # containers without a start order use the default from the tredlyfile schema
+            if (container.startOrder is None):
+                startOrder = 1
+            else:
+                startOrder = container.startOrder
+
+            startOrders.setdefault(startOrder, []).append(container)
+
+        if (len(startOrders) == 0):
+            e_note("No containers to start.")
+            exit(0)
+
+        workers = builtins.tredlyCommonConfig.startWorkers
+
+        failed = []
+
+        # each start order must have finished before the next one begins
+        for startOrder in sorted(startOrders.keys()):
+            e_header("Starting containers with start order " + str(startOrder))
+
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = executor.map(self.startLoadedContainer, startOrders[startOrder])
+
+                for container, result in zip(startOrders[startOrder], results):
+                    if (not result):
+                        failed.append(container)
+
+        # reload nginx, unbound and the layer 4 proxy once now that all containers are up
+        ServiceReload().reloadPending()
+
+        endTime = time.time()
+
+        if (len(failed) > 0):
+            e_error("The following containers failed to start:")
+            for container in failed:
+                print("  " + container.name + " (" + container.uuid + ")")
+
+        e_success("Start containers completed at " + time.strftime('%Y-%m-%d %H:%M:%S %z', time.localtime(endTime)))
+
+        timeTaken = int(endTime) - int(startTime)
+
+        # 0 seconds doesnt sound right
+        if (timeTaken == 0):
+            timeTaken = 1
+
+        e_success("Total time taken: " + str(timeTaken) + " seconds")
+
+        if (len(failed) > 0):
+            exit(1)
+
+    # start a container that has been loaded from ZFS, prefixing its output with its name.
+    # runs in a worker thread
+    def startLoadedContainer(self, container):
+        setOutputPrefix(container.name)
+
+        try:
+            e_note("Starting container " + container.name + " in partition " + container.partitionName)
+
+            if (container.start()):
+                e_success("Success")
+                return True
+            else:
+                e_error("Failed")
+                return False
+        except BaseException as e:
+            # dont let one container (or a call to exit()) take the others down with it
+            e_error("Failed: " + str(e))
+            return False
+        finally:
+            setOutputPrefix(None)
@@ -7,6 +7,7 @@ from includes.util import *
 import time
 from datetime import datetime, timedelta
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 
 from includes.defines import *
 from includes.output import *
@@ -15,6 +16,7 @@ from objects.tredly.tredlyfile import *
 from objects.tredly.unboundfile import *
 from objects.tredly.tredlyhost import TredlyHost
 from objects.layer4proxy.layer4proxyfile import *
+from objects.tredly.servicereload import ServiceReload
 
 class ActionStop():
     def __init__(self, subject, target, identifier, actionArgs):
@@ -88,7 +90,7 @@ class ActionStop():
 
 
 
-    # stop a container
+    # stop all running containers on a partition or the host
     def stopContainers(self, partitionName):
         startTime = time.time()
         tredlyHost = TredlyHost()
@@ -96,6 +98,9 @@ class ActionStop():
         ###############################
         # Start Pre flight checks
 
+        if (partitionName is not None) and (partitionName not in tredlyHost.getPartitionNames()):
+            e_error("Partition " + partitionName + " does not exist.")
+            exit(1)
 
         # End pre flight checks
         ###############################
@@ -110,13 +115,15 @@ class ActionStop():
             # get a list of all containers on host
             containers = tredlyHost.getAllContainerUUIDs()
 
+        # get the running containers from one jls call rather than one per container
+        runningUUIDs = tredlyHost.getRunningContainerUUIDs()
+
+        if (runningUUIDs is None):
+            e_error("Failed to get a list of running containers.")
+            exit(1)
+
         # form a list of running containers
-        runningContainers = []
-        for uuid in containers:
-            # check if its running
-            if (tredlyHost.containerIsRunning(uuid)):
-                # append it to the running containers list
-                runningContainers.append(uuid);
+        runningContainers = [uuid for uuid in containers if (uuid in runningUUIDs)]
 
         if (len(runningContainers) == 0):
             e_note("No containers to stop.")
@@ -130,49 +137,70 @@ class ActionStop():
         userInput = input("Are you sure you wish to stop these containers? (y/n) ")
 
         # if the user said yes then stop all containers
-        if (userInput.lower() == 'y'):
-            # loop over and stop the containers
-            for uuid in runningContainers:
+        if (userInput.lower() != 'y'):
+            return
+
+        # load the containers from ZFS before handing them to the workers
+        loadedContainers = []
+        for uuid in runningContainers:
+            container = Container()
+
+            # set up the dataset name that contains this containers data
+            containerDataset = ZFS_TREDLY_PARTITIONS_DATASET + "/" + tredlyHost.getContainerPartition(uuid) + "/" + TREDLY_CONTAINER_DIR_NAME + "/" + uuid
 
-                # load the container from ZFS
-                container = Container()
+            # make the container populate itself from zfs
+            container.loadFromZFS(containerDataset)
 
-                # if partitionName was none then find this containers partitionName
-                if (partitionName is None):
-                    containerPartitionName = tredlyHost.getContainerPartition(uuid)
-                else:
-                    containerPartitionName = partitionName
+            if (container.uuid is None):
+                container.uuid = uuid
 
-                # set up the dataset name that contains this containers data
-                containerDataset = ZFS_TREDLY_PARTITIONS_DATASET + "/" + containerPartitionName + "/" + TREDLY_CONTAINER_DIR_NAME + "/" + uuid
+            loadedContainers.append(container)
 
-                # make the container populate itself from zfs
-                container.loadFromZFS(containerDataset)
+        failed = []
 
-                if (container.uuid is None):
-                    container.uuid = uuid
+        with ThreadPoolExecutor(max_workers=builtins.tredlyCommonConfig.stopWorkers) as executor:
+            results = executor.map(self.stopLoadedContainer, loadedContainers)
 
-                zfsContainer = ZFSDataset(container.dataset, container.mountPoint)
+            for container, result in zip(loadedContainers, results):
+                if (not result):
+                    failed.append(container)
 
-                e_header("Stopping Container - " + container.name)
+        # reload nginx, unbound and the layer 4 proxy once now that all containers are down
+        ServiceReload().reloadPending()
 
-                # check if its already running
-                if (not container.isRunning()):
-                    e_error("Container already stopped")
-                    exit(1)
+        # show the user how long this took
+        endTime = time.time()
+
+        if (len(failed) > 0):
+            e_error("The following containers failed to stop:")
+            for container in failed:
+                print("  " + container.name + " (" + container.uuid + ")")
 
-                # run through the stop process
-                container.stop()
+        e_success("Stop containers completed at " + time.strftime('%Y-%m-%d %H:%M:%S %z', time.localtime(endTime)))
 
-            # show the user how long this took
-            endTime = time.time()
+        timeTaken = int(endTime) - int(startTime)
 
-            e_success("Stop containers completed at " + time.strftime('%Y-%m-%d %H:%M:%S %z', time.localtime(endTime)))
+        # 0 seconds doesnt sound right
+        if (timeTaken == 0):
+            timeTaken = 1
 
-            timeTaken = int(endTime) - int(startTime)
+        e_success("Total time taken: " + str(timeTaken) + " seconds")
 
-            # 0 seconds doesnt sound right
-            if (timeTaken == 0):
-                timeTaken = 1
+        if (len(failed) > 0):
+            exit(1)
 
-            e_success("Total time taken: " + str(timeTaken) + " seconds")
+    # stop a container that has been loaded from ZFS, prefixing its output with its name.
+    # runs in a worker thread
+    def stopLoadedContainer(self, container):
+        setOutputPrefix(container.name)
+
+        try:
+            e_header("Stopping Container - " + container.name)
+
+            return container.stop()
+        except BaseException as e:
+            # dont let one container (or a call to exit()) take the others down with it
+            e_error("Failed: " + str(e))
+            return False
+        finally:
+            setOutputPrefix(None)
@@ -0,0 +1,47 @@
+# Performs actions requested by the user
+import builtins
+
+from objects.tredly.tredlyhost import *
+from objects.tredly.containermeta import ContainerMeta
+from objects.zfs.zfs import ZFSDataset
+from includes.util import *
+from includes.defines import *
+from includes.output import *
+
+
+# migrate metadata to the current format
+class ActionMigrate:
+    def __init__(self, subject, target, identifier, actionArgs):
+        # check the subject of this action
+        if (subject == "containers"):
+            self.migrateContainers()
+        else:
+            e_error("No command " + str(subject) + " found.")
+            exit(1)
+
+    # write the json metadata record for every container that doesnt have one
+    def migrateContainers(self):
+        tredlyHost = TredlyHost()
+
+        e_header("Migrating container metadata")
+
+        exitCode = 0
+
+        for uuid in tredlyHost.getAllContainerUUIDs():
+            partitionName = tredlyHost.getContainerPartition(uuid)
+            dataset = ZFS_TREDLY_PARTITIONS_DATASET + '/' + partitionName + '/' + TREDLY_CONTAINER_DIR_NAME + '/' + uuid
+
+            meta = ContainerMeta(ZFSDataset(dataset, None, True))
+
+            # nothing to do if it already has a record
+            if (meta.load()):
+                continue
+
+            e_note("Migrating " + uuid)
+            if (meta.migrate()):
+                e_success("Success")
+            else:
+                e_error("Failed")
+                exitCode = 1
+
+        exit(exitCode)
@@ -479,6 +479,10 @@ mkdir -p /usr/local/etc/nginx/server_name
 _exitCode=$(( ${_exitCode} & $? ))
 mkdir -p /usr/local/etc/nginx/proxy_pass
 _exitCode=$(( ${_exitCode} & $? ))
+mkdir -p /usr/local/etc/nginx/proxy_cache
+_exitCode=$(( ${_exitCode} & $? ))
+mkdir -p /usr/local/etc/nginx/geo
+_exitCode=$(( ${_exitCode} & $? ))
 mkdir -p /usr/local/etc/nginx/ssl
 _exitCode=$(( ${_exitCode} & $? ))
 mkdir -p /usr/local/etc/nginx/upstream
@@ -9,6 +9,8 @@ global ZFS_TREDLY_LOG_DATASET
 global ZFS_TREDLY_PARTITIONS_DATASET
 global ZFS_TREDLY_PERSISTENT_DATASET
 global ZFS_TREDLY_RELEASES_DATASET
+global ZFS_TREDLY_TEMPLATES_DATASET
+global ZFS_TREDLY_BUILDCACHE_DATASET
 global TREDLY_MOUNT
 global TREDLY_CONTAINER_MOUNT
 global TREDLY_DOWNLOADS_MOUNT
@@ -16,21 +18,40 @@ global TREDLY_LOG_MOUNT
 global TREDLY_PARTITIONS_MOUNT
 global TREDLY_PERSISTENT_MOUNT
 global TREDLY_RELEASES_MOUNT
+global TREDLY_TEMPLATES_MOUNT
+global CONTAINER_TEMPLATE_VERSION
+global CONTAINER_TEMPLATE_SNAPSHOT
+global CONTAINER_TEMPLATE_LOCK
+global BUILD_CACHE_LOCK
 global ZFS_PROP_ROOT
+global ZFS_PROP_META
+global CONTAINER_META_VERSION
+global ZFS_META_CHUNK_SIZE
 global TREDLY_DEFAULT_PARTITION
 global TREDLY_CONTAINER_DIR_NAME
 global TREDLY_PTN_DATA_DIR_NAME
 global TREDLY_PTN_REMOTECONTAINERS_DIR_NAME
+global CONTAINER_COMMAND_LOG
 global NGINX_BASE_DIR
 global NGINX_UPSTREAM_DIR
 global NGINX_SERVERNAME_DIR
 global NGINX_SSLCONFIG_DIR
 global NGINX_ACCESSFILE_DIR
+global NGINX_PROXYCACHE_DIR
+global NGINX_CACHE_DATA_DIR
+global NGINX_GEO_DIR
 global UNBOUND_ETC_DIR
 global UNBOUND_CONFIG_DIR
+global UNBOUND_CONTROL
 global TREDLY_ONSTOP_SCRIPT
 global IPFW_SCRIPT
 global IPFW_FORWARDS
+global IP4_RESERVATION_DIR
+global EPAIR_POOL_DESCRIPTION
+global EPAIR_POOL_LOCK
+global PKG_CACHE_DIR
+global PKG_CATALOGUE
+global PKG_UPDATE_STAMP
 global IPFW_TABLE_PUBLIC_IPS
 global IPFW_TABLE_PUBLIC_EPAIRS
 global CONTAINER_IPFW_SCRIPT
@@ -59,6 +80,8 @@ ZFS_TREDLY_DOWNLOADS_DATASET = ZFS_TREDLY_DATASET + "/downloads"
 ZFS_TREDLY_LOG_DATASET = ZFS_TREDLY_DATASET + "/log"
 ZFS_TREDLY_PARTITIONS_DATASET = ZFS_TREDLY_DATASET + "/ptn"
 ZFS_TREDLY_RELEASES_DATASET = ZFS_TREDLY_DATASET + "/releases"
+ZFS_TREDLY_TEMPLATES_DATASET = ZFS_TREDLY_DATASET + "/templates"
+ZFS_TREDLY_BUILDCACHE_DATASET = ZFS_TREDLY_DATASET + "/buildcache"
 
 # ZFS Mount locations
 TREDLY_MOUNT = "/tredly"
@@ -66,16 +89,25 @@ TREDLY_DOWNLOADS_MOUNT = TREDLY_MOUNT + "/downloads"
 TREDLY_LOG_MOUNT = TREDLY_MOUNT + "/log"
 TREDLY_PARTITIONS_MOUNT = TREDLY_MOUNT + "/ptn"
 TREDLY_RELEASES_MOUNT = TREDLY_MOUNT + "/releases"
+TREDLY_TEMPLATES_MOUNT = TREDLY_MOUNT + "/templates"
 
 # zfs properties
 ZFS_PROP_ROOT = "com.tredly"
 
+# compact container metadata - the whole container record as json in a single property
+ZFS_PROP_META = ZFS_PROP_ROOT + ":meta"
+CONTAINER_META_VERSION = 1
+# zfs user property values are limited to 8192 bytes, larger records are split into chunks
+ZFS_META_CHUNK_SIZE = 8000
+
 # name of the default partition within ZFS_TREDLY_PARTITIONS_DATASET/ TREDLY_PARTITIONS_MOUNT
 TREDLY_DEFAULT_PARTITION = "default"
 TREDLY_CONTAINER_DIR_NAME = "cntr"
 TREDLY_PTN_DATA_DIR_NAME = "data"
 TREDLY_PERSISTENT_STORAGE_DIR_NAME = "psnt"
 TREDLY_CONTAINER_LOG_DIR = "log"
+# output of commands run within the container, inside TREDLY_CONTAINER_LOG_DIR
+CONTAINER_COMMAND_LOG = "commands"
 TREDLY_PTN_REMOTECONTAINERS_DIR_NAME="containers"
 
 # Nginx Proxy
@@ -84,10 +116,17 @@ NGINX_UPSTREAM_DIR = NGINX_BASE_DIR + "/upstream"
 NGINX_SERVERNAME_DIR = NGINX_BASE_DIR + "/server_name"
 NGINX_SSL_DIR = NGINX_BASE_DIR + "/ssl"
 NGINX_ACCESSFILE_DIR = NGINX_BASE_DIR + "/access"
+# proxy_cache_path definitions, one file per partition
+NGINX_PROXYCACHE_DIR = NGINX_BASE_DIR + "/proxy_cache"
+# cached responses, one directory per partition and url
+NGINX_CACHE_DATA_DIR = "/var/cache/nginx"
+# geo maps of whitelisted addresses, one file per partition
+NGINX_GEO_DIR = NGINX_BASE_DIR + "/geo"
 
 # Unbound
 UNBOUND_ETC_DIR = "/usr/local/etc/unbound"
 UNBOUND_CONFIG_DIR = "/usr/local/etc/unbound/configs"
+UNBOUND_CONTROL = "/usr/local/sbin/unbound-control"
 
 # Tredly onstop script
 TREDLY_ONSTOP_SCRIPT = "/etc/rc.onstop"
@@ -96,6 +135,28 @@ TREDLY_ONSTOP_SCRIPT = "/etc/rc.onstop"
 IPFW_SCRIPT = "/usr/local/etc/ipfw.rules"
 IPFW_FORWARDS = "/usr/local/etc/ipfw.layer4"
 
+# per release container templates, which new containers are cloned from.
+# bump the version whenever the container skeleton changes so that new templates are built
+CONTAINER_TEMPLATE_VERSION = 1
+CONTAINER_TEMPLATE_SNAPSHOT = "template"
+CONTAINER_TEMPLATE_LOCK = "/var/run/tredly/template.lock"
+
+# snapshots of containers part way through their onCreate commands, which later builds are cloned from
+BUILD_CACHE_LOCK = "/var/run/tredly/buildcache.lock"
+
+# ip addresses handed out but not yet registered in ZFS. /var/run is cleared on boot
+IP4_RESERVATION_DIR = "/var/run/tredly/ip4reservations"
+
+# pre-created epairs waiting to be used by a container are marked with this description
+EPAIR_POOL_DESCRIPTION = "tredly epair pool"
+EPAIR_POOL_LOCK = "/var/run/tredly/epairpool.lock"
+
+# the host's package cache, mounted into containers while installing, and its copy of the remote catalogue
+PKG_CACHE_DIR = "/var/cache/pkg"
+PKG_CATALOGUE = "/var/db/pkg/repo-FreeBSD.sqlite"
+# touched whenever "pkg update" succeeds on the host, to decide whether the catalogue needs updating again
+PKG_UPDATE_STAMP = "/var/run/tredly/pkgupdate"
+
 # The table numbers within the host
 IPFW_TABLE_PUBLIC_IPS = "1"
 IPFW_TABLE_PUBLIC_EPAIRS = "2"
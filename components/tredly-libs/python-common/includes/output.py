@@ -1,4 +1,6 @@
 # Output functions for colouring messages to CLI
+import sys
+import threading
 
 # all codes as per http://misc.flogisoft.com/bash/tipcolorsandformatting
 # Backgrounds
@@ -86,4 +88,86 @@ def e_warning(string):
 # print an error message and exit
 def exit_with_error(string, exitCode = 1):
     e_error(string)
-    exit(exitCode)
\ No newline at end of file
+    exit(exitCode)
+
+# Writes whole lines to the real stdout, prefixed with the name of the container the current thread is working on.
+# Used when containers are worked on in parallel so that their output can be told apart
+class PrefixedOutput:
+
+    # Constructor
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    # pass anything else (encoding, isatty etc) through to the real stream
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    # Action: set the prefix for the current thread
+    #
+    # Pre:
+    # Post: lines written by this thread are prefixed with prefix
+    #
+    # Params: prefix - the prefix to use, or None for no prefix
+    #
+    # Return:
+    def setPrefix(self, prefix):
+        self.flush()
+        self.local.prefix = prefix
+
+    # Action: buffer text, writing out any completed lines
+    #
+    # Pre:
+    # Post:
+    #
+    # Params: text - the text to write
+    #
+    # Return: number of characters written
+    def write(self, text):
+        buffer = getattr(self.local, 'buffer', '') + text
+        lines = buffer.split("\n")
+
+        # keep the incomplete last line until the rest of it arrives
+        self.local.buffer = lines.pop()
+
+        if (len(lines) > 0):
+            prefix = getattr(self.local, 'prefix', None)
+
+            with self.lock:
+                for line in lines:
+                    if (prefix is not None):
+                        self.stream.write("[" + prefix + "] " + line + "\n")
+                    else:
+                        self.stream.write(line + "\n")
+                self.stream.flush()
+
+        return len(text)
+
+    # Action: write out any incomplete line for this thread
+    #
+    # Pre:
+    # Post:
+    #
+    # Params:
+    #
+    # Return:
+    def flush(self):
+        buffer = getattr(self.local, 'buffer', '')
+
+        if (len(buffer) > 0):
+            self.write("\n")
+
+# Action: prefix all output from the current thread
+#
+# Pre:
+# Post: sys.stdout has been wrapped in a PrefixedOutput if it wasnt already
+#
+# Params: prefix - the prefix to use, or None for no prefix
+#
+# Return:
+def setOutputPrefix(prefix):
+    if (not isinstance(sys.stdout, PrefixedOutput)):
+        sys.stdout = PrefixedOutput(sys.stdout)
+
+    sys.stdout.setPrefix(prefix)
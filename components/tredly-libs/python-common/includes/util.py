@@ -9,8 +9,14 @@ from objects.zfs.zfs import ZFSDataset
 import __main__
 import builtins
 import re
+import threading
 from urllib.request import urlopen
 from subprocess import Popen, PIPE
+from objects.ip4.ip4allocator import IP4Allocator, IP4_ADDR_REGEX, reserveIP4, releaseIP4, ip4ReservedByOther
+
+# allocators for the networks used by this process, keyed by network/cidr
+ip4Allocators = {}
+ip4AllocatorsLock = threading.Lock()
 
 # looks for a tredlyfile at the given path and returns the full path to the tredlyfile
 # if none found, None is returned
@@ -69,64 +75,63 @@ def copyFromContainerOrPartition(src, dest, partitionName, chmod = None):
 def generateShortUUID(size=8, chars=string.ascii_lowercase + string.ascii_uppercase + string.digits):
     return ''.join(random.choice(chars) for _ in range(size))
 
+# gets a free ip address on the given network and reserves it for this process.
+# call releaseIP4() once the address has been registered in ZFS
 def getAvailableIP4Address(networkAddr, cidr):
     # if cidr == 32 then the host is the network
-    if (cidr == 32):
+    if (str(cidr) == '32'):
         return networkAddr
 
-    # get an ipnetwork object
-    network = ip_network(networkAddr + "/" + cidr)
+    key = networkAddr + "/" + str(cidr)
 
-    # get a list of hosts and select one at random
-    hosts = list(network.hosts())
+    # build the allocator once per process, it tracks what it has handed out itself
+    with ip4AllocatorsLock:
+        if (key not in ip4Allocators):
+            allocator = IP4Allocator(networkAddr, cidr)
 
-    foundIP = ''
-    # loop until we find one thats not in use
-    while (len(foundIP) == 0):
-        endRand = len(list(hosts)) -1
+            # dont hand out the host's own address on the container network
+            hostIp4 = None
+            if (hasattr(builtins, 'tredlyCommonConfig')) and (builtins.tredlyCommonConfig.lif is not None):
+                hostIp4 = getInterfaceIP4(builtins.tredlyCommonConfig.lif)
 
-        index = random.randint(0, endRand)
+            if (not allocator.build(hostIp4)):
+                return None
 
-        # assign it
-        ipAddress = str(hosts[index])
+            ip4Allocators[key] = allocator
 
-        # now make sure its actually unique
-        if (not ip4InUse(ipAddress)):
-            foundIP = ipAddress
+    ip4 = ip4Allocators[key].allocate()
 
+    if (ip4 is None):
+        e_error("No free ip addresses left in " + key)
 
-    return foundIP
+    return ip4
 
 def ip4InUse(ip4):
+    # check whether another build has it reserved
+    if (ip4ReservedByOther(ip4)):
+        return True
+
     # now make sure its actually unique
-    inUse = getIP4AddressesInUse()
+    inUse = set(str(usedIp4) for usedIp4 in getIP4AddressesInUse())
 
     # check if its in use and return result
-    for usedIp4 in inUse:
-        if (ip4 == str(usedIp4)):
-            return True
-
-    return False
-
-
+    return (ip4 in inUse)
 
 # get a list of ip addresses that are actually in use
 def getIP4AddressesInUse():
     # get a list of ip4_addrs
     zfsPartitions = ZFSDataset(ZFS_TREDLY_DATASET)
 
-    # get a list of ip addresses for this interface
-    ip4Addrs = zfsPartitions.getPropertyRecursive(ZFS_PROP_ROOT + ':ip4_addr')
-
     # a list to return
     ip4s = []
 
-    # loop over results
-    for ip4Addr in ip4Addrs:
+    # stream the ip addresses, only asking zfs for the one property
+    for dataset, property, ip4Addr in zfsPartitions.iterPropertiesRecursive([ZFS_PROP_ROOT + ':ip4_addr'], ['local', 'received']):
         #match bridge0|192.168.0.1/24
-        regex = '^(\w+)\|([\w.]+)\/(\d+)$'
+        m = IP4_ADDR_REGEX.match(ip4Addr)
+        if (m is None):
+            continue
 
-        m = re.match(regex, ip4Addr)
         ip4 = m.group(2)
         # make sure its a valid ip
         if (isValidIp4(ip4)):
@@ -27,6 +27,19 @@ class ConfigFile:
         self.tld = None
         self.vnetDefaultRoute = None
         self.firewallEnableLogging = None
+        self.startWorkers = 4
+        self.stopWorkers = 4
+        self.copyWorkers = 4
+        self.commandTimeout = 0
+        self.epairPoolSize = 0
+        self.pkgUpdateTTL = 3600
+        self.buildCacheQuota = 0
+        self.httpProxyHttp2 = "no"
+        self.httpProxySslSessionCache = "10m"
+        self.httpProxySslSessionTimeout = "5m"
+        self.httpProxySslSessionTickets = "no"
+        self.httpProxyOcspStapling = "no"
+        self.httpProxyAccessMode = "allow"
 
         # for YAML
         self.json = None
@@ -95,6 +108,84 @@ class ConfigFile:
 
                         elif (key == "firewallEnableLogging"):
                             self.firewallEnableLogging = value
+
+                        elif (key == "startWorkers"):
+                            # make sure its a positive number
+                            if (value.isdigit()) and (int(value) > 0):
+                                self.startWorkers = int(value)
+                            else:
+                                e_warning("Invalid startWorkers value " + value + ", using " + str(self.startWorkers))
+
+                        elif (key == "stopWorkers"):
+                            # make sure its a positive number
+                            if (value.isdigit()) and (int(value) > 0):
+                                self.stopWorkers = int(value)
+                            else:
+                                e_warning("Invalid stopWorkers value " + value + ", using " + str(self.stopWorkers))
+
+                        elif (key == "copyWorkers"):
+                            # make sure its a positive number
+                            if (value.isdigit()) and (int(value) > 0):
+                                self.copyWorkers = int(value)
+                            else:
+                                e_warning("Invalid copyWorkers value " + value + ", using " + str(self.copyWorkers))
+
+                        elif (key == "commandTimeout"):
+                            # make sure its a number, 0 disables the timeout
+                            if (value.isdigit()):
+                                self.commandTimeout = int(value)
+                            else:
+                                e_warning("Invalid commandTimeout value " + value + ", using " + str(self.commandTimeout))
+
+                        elif (key == "epairPoolSize"):
+                            # make sure its a number, 0 disables the pool
+                            if (value.isdigit()):
+                                self.epairPoolSize = int(value)
+                            else:
+                                e_warning("Invalid epairPoolSize value " + value + ", using " + str(self.epairPoolSize))
+
+                        elif (key == "pkgUpdateTTL"):
+                            # make sure its a number, 0 updates every time
+                            if (value.isdigit()):
+                                self.pkgUpdateTTL = int(value)
+                            else:
+                                e_warning("Invalid pkgUpdateTTL value " + value + ", using " + str(self.pkgUpdateTTL))
+
+                        elif (key == "buildCacheQuota"):
+                            # make sure its a number, 0 disables the cache
+                            if (value.isdigit()):
+                                self.buildCacheQuota = int(value)
+                            else:
+                                e_warning("Invalid buildCacheQuota value " + value + ", using " + str(self.buildCacheQuota))
+
+                        elif (key == "httpProxyHttp2"):
+                            self.httpProxyHttp2 = value
+
+                        elif (key == "httpProxySslSessionCache"):
+                            # make sure its an nginx size, 0 disables the cache
+                            if (re.match('^[0-9]+[km]?$', value)):
+                                self.httpProxySslSessionCache = value
+                            else:
+                                e_warning("Invalid httpProxySslSessionCache value " + value + ", using " + self.httpProxySslSessionCache)
+
+                        elif (key == "httpProxySslSessionTimeout"):
+                            # make sure its an nginx time
+                            if (re.match('^[0-9]+(s|m|h|d)?$', value)):
+                                self.httpProxySslSessionTimeout = value
+                            else:
+                                e_warning("Invalid httpProxySslSessionTimeout value " + value + ", using " + self.httpProxySslSessionTimeout)
+
+                        elif (key == "httpProxySslSessionTickets"):
+                            self.httpProxySslSessionTickets = value
+
+                        elif (key == "httpProxyOcspStapling"):
+                            self.httpProxyOcspStapling = value
+
+                        elif (key == "httpProxyAccessMode"):
+                            if (value in ['allow', 'geo']):
+                                self.httpProxyAccessMode = value
+                            else:
+                                e_warning("Invalid httpProxyAccessMode value " + value + ", using " + self.httpProxyAccessMode)
                         else:
                             e_warning("Unrecognised config definition: " + line)
 
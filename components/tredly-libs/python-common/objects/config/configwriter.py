@@ -0,0 +1,172 @@
+# A class to write generated config files atomically, and only when their content has changed
+#
+# The config is written to a temporary file in the same directory, which is then compared with the current file. If
+# they differ the temporary file is renamed over the current one, so that anything reading the file (eg a service
+# reloading) sees either the old or the new config and never a partially written one. If they are the same the
+# temporary file is removed and the current file is left untouched. self.changed tells the caller which happened, so
+# that reloads can be skipped when nothing changed.
+import os
+import stat
+import errno
+import hashlib
+import binascii
+
+# bytes read at a time when comparing files
+CONFIG_HASH_READ_SIZE = 65536
+
+# names tried for the temporary file before giving up
+CONFIG_TEMP_ATTEMPTS = 100
+
+class ConfigWriter:
+
+    # Constructor
+    def __init__(self, filePath, mode = None):
+        self.filePath = filePath
+        self.mode = mode            # permissions for the file. None keeps the current file's, or the default for new files
+        self.changed = False        # whether the last write changed the file
+        self.tempPath = None
+        self.tempFile = None
+
+    # Action: start writing the file
+    #
+    # Pre:
+    # Post: a temporary file has been opened in the same directory as self.filePath
+    #
+    # Params:
+    #
+    # Return: the temporary file, to be written to as if it were self.filePath
+    def __enter__(self):
+        self.tempFile = os.fdopen(self.__createTemp(), 'w')
+
+        return self.tempFile
+
+    # Action: finish writing the file
+    #
+    # Pre: __enter__ has been called
+    # Post: self.filePath has been replaced if its content changed, and the temporary file has been removed otherwise.
+    #       if an exception was raised nothing has been changed
+    #
+    # Params:
+    #
+    # Return: False so that exceptions are not suppressed
+    def __exit__(self, excType, excValue, traceback):
+        self.tempFile.close()
+        self.changed = False
+
+        try:
+            if (excType is None) and (self.__contentDiffers()):
+                mode = self.__getMode()
+
+                if (mode is not None):
+                    os.chmod(self.tempPath, mode)
+
+                os.replace(self.tempPath, self.filePath)
+                self.changed = True
+        finally:
+            if (not self.changed):
+                os.remove(self.tempPath)
+
+        return False
+
+    # Action: remove the file
+    #
+    # Pre:
+    # Post: self.filePath does not exist
+    #
+    # Params:
+    #
+    # Return: True if succeeded, False otherwise
+    def remove(self):
+        self.changed = False
+
+        try:
+            os.remove(self.filePath)
+            self.changed = True
+        except FileNotFoundError:
+            pass
+        except OSError:
+            return False
+
+        return True
+
+    # Action: create the temporary file
+    #
+    # Pre:
+    # Post: self.tempPath has been created in the same directory as self.filePath. it is created with 0666, which
+    #       the kernel limits by the umask as it would for open(), so the umask never has to be changed to read it
+    #
+    # Params:
+    #
+    # Return: file descriptor open for writing
+    def __createTemp(self):
+        prefix = os.path.join(os.path.dirname(self.filePath), '.' + os.path.basename(self.filePath) + '.')
+
+        for attempt in range(CONFIG_TEMP_ATTEMPTS):
+            tempPath = prefix + binascii.hexlify(os.urandom(4)).decode('ascii')
+
+            try:
+                fd = os.open(tempPath, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+            except FileExistsError:
+                continue
+
+            self.tempPath = tempPath
+
+            return fd
+
+        raise FileExistsError(errno.EEXIST, "No free temporary file name for " + self.filePath)
+
+    # Action: compare the temporary file with the current file
+    #
+    # Pre:
+    # Post:
+    #
+    # Params:
+    #
+    # Return: True if they differ or the current file doesnt exist, False otherwise
+    def __contentDiffers(self):
+        try:
+            if (os.path.getsize(self.filePath) != os.path.getsize(self.tempPath)):
+                return True
+
+            return (self.__hashFile(self.filePath) != self.__hashFile(self.tempPath))
+        except OSError:
+            return True
+
+    # Action: hash the content of a file
+    #
+    # Pre: file exists
+    # Post:
+    #
+    # Params: filePath - the file to hash
+    #
+    # Return: hex digest
+    def __hashFile(self, filePath):
+        hash = hashlib.sha256()
+
+        with open(filePath, 'rb') as f:
+            while True:
+                chunk = f.read(CONFIG_HASH_READ_SIZE)
+                if (len(chunk) == 0):
+                    break
+                hash.update(chunk)
+
+        return hash.hexdigest()
+
+    # Action: work out the permissions for the new file
+    #
+    # Pre:
+    # Post:
+    #
+    # Params:
+    #
+    # Return: mode, or None to keep the temporary file's
+    def __getMode(self):
+        if (self.mode is not None):
+            return self.mode
+
+        # keep the permissions of the file being replaced
+        try:
+            return stat.S_IMODE(os.stat(self.filePath).st_mode)
+        except OSError:
+            # new files keep the mode the temporary file was created with
+            return None
@@ -7,6 +7,7 @@ import glob
 from includes.output import *
 from includes.util import *
 from includes.defines import *
+from objects.config.configwriter import ConfigWriter
 
 class IPFW:
     
@@ -17,6 +18,7 @@ class IPFW:
         self.ipfwFile = "ipfw.rules"
         self.rules = {}    # a dict of rules, keyed by rule number
         self.tables = {}   # a dict of tables, keyed by table number
+        self.changed = False    # whether the last apply() changed any of the rule files
 
     # Action: adds a rule to allow a port(s)
     #
@@ -70,18 +72,21 @@ class IPFW:
     # Action: apply firewall rules
     #
     # Pre: this object exists
-    # Post: ipfw rules have been applied to container or host
+    # Post: ipfw rules have been applied to container or host, and self.changed set
     #
     # Params: 
     #
     # Return: True if succeeded, False otherwise
     def apply(self):
+        self.changed = False
+
         # write the tables out first
         for tableNum, tableList in self.tables.items():
             filePath = self.directory + "/ipfw.table." + str(tableNum)
 
-            # open the table file for writing
-            with open(filePath, "w") as ipfw_table:
+            # open the table file for writing, with permissions of 700
+            writer = ConfigWriter(filePath, 0o700)
+            with writer as ipfw_table:
                 print('#!/usr/bin/env sh', file=ipfw_table)
 
                 # loop over the list, adding the values
@@ -89,8 +94,9 @@ class IPFW:
                     # print the table rule to the file
                     print("ipfw table " + str(tableNum) + " add " + value, file=ipfw_table)
 
-            # Set the permissions on this file to 700
-            os.chmod(filePath, 0o700)
+            self.changed = self.changed or writer.changed
+
+            # the live table is still synced when the file is unchanged, as it may have been changed or flushed since
             
             # set up the list command
             listCmd = ['ipfw', 'table', str(tableNum), 'list']
@@ -147,7 +153,9 @@ class IPFW:
         filePath = self.directory + "/ipfw.rules"
         # dont overwrite the hosts ipfw rules
         if (self.uuid is not None):
-            with open(filePath, "w") as ipfw_rules:
+            # with permissions of 700
+            writer = ConfigWriter(filePath, 0o700)
+            with writer as ipfw_rules:
                 # add the shebang
                 print('#!/usr/bin/env sh', file=ipfw_rules)
                 
@@ -158,10 +166,8 @@ class IPFW:
                 # loop over the rules, adding them to the ipfw file
                 for ruleNum, rule in self.rules.items():
                     print("ipfw add " + str(ruleNum) + " " + rule, file=ipfw_rules)
-                
-            
-            # Set the permissions on this file to 700
-            os.chmod(self.directory + '/' + self.ipfwFile, 0o700)
+
+            self.changed = self.changed or writer.changed
             
             # run the ipfw rules within the container only - host rules never change
             if (self.uuid is not None):    # its a container
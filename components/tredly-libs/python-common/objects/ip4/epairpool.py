@@ -0,0 +1,219 @@
+# A class to manage a pool of pre-created epair interfaces on the host
+#
+# Pooled epairs already have their mac addresses set and are marked with EPAIR_POOL_DESCRIPTION on the host side.
+# Starting a container takes one from the pool, and stopping a container hands its epair back, so that creating
+# epairs and setting mac addresses is kept off the critical path. The pool is refilled up to the configured size
+# once a container is up. Taking and returning interfaces is done under a file lock as builds in other processes
+# share the pool.
+import os
+import re
+import fcntl
+from subprocess import Popen, PIPE
+
+from objects.zfs.zfs import ZFSDataset
+from objects.ip4.netinterface import NetInterface
+from objects.ip4.networkscript import NetworkScript
+from includes.defines import *
+from includes.output import *
+
+# matches the start of an interface block in ifconfig output eg "epair0a: flags=8843<UP,..."
+IFCONFIG_IFACE_REGEX = re.compile(r'^(\S+): flags=')
+
+class EpairPool:
+
+    # Constructor
+    def __init__(self, size):
+        self.size = size        # the number of epairs to keep in the pool. 0 disables the pool
+
+    # Action: check whether the pool is in use
+    #
+    # Pre:
+    # Post:
+    #
+    # Params:
+    #
+    # Return: True if enabled, False otherwise
+    def isEnabled(self):
+        return (self.size > 0)
+
+    # Action: take an epair from the pool for a container
+    #
+    # Pre:
+    # Post: the epair's host side description is set to the container, so it is no longer in the pool
+    #
+    # Params: uuid - the uuid of the container taking it
+    #
+    # Return: tuple of (host NetInterface, container NetInterface) or None if the pool is empty
+    def take(self, uuid):
+        with self.__lock():
+            interfaces = self.__getInterfaces()
+
+            for name in self.__getPooled(interfaces):
+                containerName = re.sub('a$', 'b', name)
+
+                # mark it as ours before anyone else can take it
+                process = Popen(['ifconfig', name, 'description', 'Connected to container ' + uuid], stdin=PIPE, stdout=PIPE, stderr=PIPE)
+                stdOut, stdErr = process.communicate()
+
+                if (process.returncode != 0):
+                    continue
+
+                return (NetInterface(name, interfaces[name]['ether']), NetInterface(containerName, interfaces[containerName]['ether']))
+
+        return None
+
+    # Action: return a container's epair to the pool if the pool isnt full
+    #
+    # Pre: container is still running, with its side of the epair named VNET_CONTAINER_IFACE_NAME
+    # Post: the epair is back in the pool, or left for the caller to destroy
+    #
+    # Params: uuid - the uuid of the container
+    #         hostIface - the host side of the container's epair
+    #         bridgeInterface - the bridge the host side is a member of
+    #
+    # Return: True if it was returned to the pool, False otherwise
+    def recycle(self, uuid, hostIface, bridgeInterface):
+        containerIface = re.sub('a$', 'b', hostIface)
+
+        with self.__lock():
+            if (len(self.__getPooled(self.__getInterfaces())) < self.size):
+                # give the container side its epair name back so that it doesnt clash with other returned interfaces
+                containerNetwork = NetworkScript()
+                containerNetwork.addStep("rename container interface", ['ifconfig', VNET_CONTAINER_IFACE_NAME, 'name', containerIface])
+
+                hostNetwork = NetworkScript()
+                hostNetwork.addStep("return epair from container trd-" + uuid, ['ifconfig', containerIface, '-vnet', 'trd-' + uuid])
+                hostNetwork.addStep("remove host interface from bridge", ['ifconfig', bridgeInterface, 'deletem', hostIface])
+                hostNetwork.addStep("return epair to the pool", ['ifconfig', hostIface, 'down', 'description', EPAIR_POOL_DESCRIPTION])
+
+                if (containerNetwork.run(['jexec', 'trd-' + uuid])) and (hostNetwork.run()):
+                    return True
+
+        return False
+
+    # Action: create epairs until the pool is full
+    #
+    # Pre:
+    # Post: the pool holds self.size epairs, each with unique mac addresses
+    #
+    # Params:
+    #
+    # Return: True if succeeded, False otherwise
+    def fill(self):
+        if (not self.isEnabled()):
+            return True
+
+        with self.__lock():
+            interfaces = self.__getInterfaces()
+            missing = self.size - len(self.__getPooled(interfaces))
+
+            if (missing <= 0):
+                return True
+
+            macsInUse = self.getMacsInUse(interfaces)
+
+            for i in range(0, missing):
+                hostInterface = NetInterface()
+                hostInterface.generateMac(macsInUse = macsInUse)
+                macsInUse.add(hostInterface.mac)
+
+                containerInterface = NetInterface()
+                containerInterface.generateMac(macsInUse = macsInUse)
+                macsInUse.add(containerInterface.mac)
+
+                network = NetworkScript()
+                network.addStep("create epair for pool", ['ifconfig', 'epair', 'create'], 'ifconfig "${hostIface}" destroy', 'hostIface')
+                network.addStep("set host epair mac address " + hostInterface.mac, 'ifconfig "${hostIface}" ether ' + hostInterface.mac)
+                network.addStep("set container epair mac address " + containerInterface.mac, 'ifconfig "${hostIface%a}b" ether ' + containerInterface.mac)
+                network.addStep("add epair to the pool", 'ifconfig "${hostIface}" description "' + EPAIR_POOL_DESCRIPTION + '"')
+
+                if (not network.run()):
+                    return False
+
+        return True
+
+    # Action: get all mac addresses in use by the host, the pool and running containers
+    #
+    # Pre:
+    # Post:
+    #
+    # Params: interfaces - output of __getInterfaces() if it has already been read, otherwise None
+    #
+    # Return: set of mac addresses
+    def getMacsInUse(self, interfaces = None):
+        if (interfaces is None):
+            interfaces = self.__getInterfaces()
+
+        # everything visible on the host, including the pool and the host side of container epairs
+        macs = set(iface['ether'] for iface in interfaces.values() if (iface['ether'] is not None))
+
+        # the container side of an epair is inside the container's vnet, so use the address recorded in zfs
+        zfsPartitions = ZFSDataset(ZFS_TREDLY_PARTITIONS_DATASET)
+        for dataset, property, value in zfsPartitions.iterPropertiesRecursive([ZFS_PROP_ROOT + ':container_mac'], ['local', 'received'], ['filesystem']):
+            macs.add(value)
+
+        return macs
+
+    # Action: get the interfaces on the host from a single ifconfig call
+    #
+    # Pre:
+    # Post:
+    #
+    # Params:
+    #
+    # Return: dict of interface name -> dict with description and ether
+    def __getInterfaces(self):
+        process = Popen(['ifconfig', '-a'], stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        stdOut, stdErr = process.communicate()
+
+        interfaces = {}
+        current = None
+        for line in stdOut.decode(encoding='UTF-8', errors='replace').splitlines():
+            m = IFCONFIG_IFACE_REGEX.match(line)
+
+            if (m is not None):
+                current = {'description': None, 'ether': None}
+                interfaces[m.group(1)] = current
+            elif (current is not None):
+                line = line.strip()
+
+                if (line.startswith('description: ')):
+                    current['description'] = line[len('description: '):]
+                elif (line.startswith('ether ')):
+                    current['ether'] = line.split()[1]
+
+        return interfaces
+
+    # Action: get the host side names of the epairs in the pool
+    #
+    # Pre:
+    # Post:
+    #
+    # Params: interfaces - output of __getInterfaces()
+    #
+    # Return: list of interface names
+    def __getPooled(self, interfaces):
+        pooled = []
+
+        for name, iface in sorted(interfaces.items()):
+            # the container side must be on the host too
+            if (iface['description'] == EPAIR_POOL_DESCRIPTION) and (re.sub('a$', 'b', name) in interfaces.keys()):
+                pooled.append(name)
+
+        return pooled
+
+    # Action: get a lock on the pool, shared with other processes
+    #
+    # Pre:
+    # Post:
+    #
+    # Params:
+    #
+    # Return: open lock file, to be used as a context manager
+    def __lock(self):
+        os.makedirs(os.path.dirname(EPAIR_POOL_LOCK), exist_ok=True)
+
+        lockFile = open(EPAIR_POOL_LOCK, 'w')
+        fcntl.flock(lockFile, fcntl.LOCK_EX)
+
+        return lockFile
@@ -0,0 +1,259 @@
+# A class to hand out free IPv4 addresses from a network
+#
+# Addresses in use are read from ZFS once and held in a bitmap of host offsets within the network. Addresses handed
+# out are reserved with a file in IP4_RESERVATION_DIR until they have been registered in ZFS, so that builds running
+# at the same time in other processes cant be given the same address. Other processes may have registered addresses
+# since the bitmap was built, so each allocate() re-reads ZFS once, after reserving its first candidate, and checks
+# its candidates against that.
+import os
+import re
+import fcntl
+import random
+import threading
+from ipaddress import IPv4Address, ip_network
+
+from objects.zfs.zfs import ZFSDataset
+from includes.defines import *
+from includes.output import *
+
+# matches an ip4_addr property eg bridge0|192.168.0.1/24
+IP4_ADDR_REGEX = re.compile(r'^(\w+)\|([\w.]+)\/(\d+)$')
+
+# finds a byte in the bitmap with at least one free address
+FREE_BYTE_REGEX = re.compile(b'[^\xff]')
+
+class IP4Allocator:
+
+    # Constructor
+    def __init__(self, networkAddr, cidr):
+        self.network = ip_network(networkAddr + "/" + str(cidr), strict=False)
+        self.base = int(self.network.network_address)
+        self.size = self.network.num_addresses
+        self.bitmap = None          # bytearray, one bit per address in the network. set means in use
+        self.lock = threading.Lock()
+
+    # Action: build the bitmap of addresses in use
+    #
+    # Pre:
+    # Post: self.bitmap has been populated from ZFS
+    #
+    # Params: hostIp4 - the host's own address on this network, or None
+    #
+    # Return: True if succeeded, False otherwise
+    def build(self, hostIp4 = None):
+        bitmap = bytearray((self.size + 7) // 8)
+
+        # the network and broadcast addresses are never handed out
+        if (self.size > 2):
+            self.__setBit(bitmap, 0)
+            self.__setBit(bitmap, self.size - 1)
+
+        # the bits past the end of the network
+        for offset in range(self.size, len(bitmap) * 8):
+            self.__setBit(bitmap, offset)
+
+        if (hostIp4 is not None) and (len(hostIp4) > 0):
+            self.__markUsed(bitmap, hostIp4)
+
+        if (self.__markRegistered(bitmap) is None):
+            return False
+
+        self.bitmap = bitmap
+
+        return True
+
+    # Action: allocate and reserve a free address
+    #
+    # Pre: build() has been called
+    # Post: the returned address has been reserved and marked as used
+    #
+    # Params:
+    #
+    # Return: string (ip address) or None if the network is full or ZFS couldnt be read
+    def allocate(self):
+        with self.lock:
+            # the addresses registered in ZFS, read once per call
+            registered = None
+
+            # start from a random point so addresses are spread across the network like before
+            start = random.randrange(len(self.bitmap))
+
+            for begin, end in [(start, len(self.bitmap)), (0, start)]:
+                m = FREE_BYTE_REGEX.search(self.bitmap, begin, end)
+
+                while (m is not None):
+                    byteIndex = m.start()
+
+                    for bit in range(8):
+                        offset = byteIndex * 8 + bit
+
+                        if (self.__isSet(self.bitmap, offset)):
+                            continue
+
+                        # taken whether or not we get the reservation, if another build has it we dont want it either
+                        self.__setBit(self.bitmap, offset)
+
+                        ip4 = str(IPv4Address(self.base + offset))
+                        if (not reserveIP4(ip4)):
+                            continue
+
+                        # another process may have registered it since the bitmap was built. read ZFS after the
+                        # first reservation so that nothing can register it unseen. this brings the bitmap up to
+                        # date, so the scan skips everything registered since rather than going back to ZFS for
+                        # each collision
+                        if (registered is None):
+                            registered = self.__markRegistered(self.bitmap)
+
+                            if (registered is None):
+                                releaseIP4(ip4)
+                                return None
+
+                        if (ip4 not in registered):
+                            return ip4
+
+                        releaseIP4(ip4)
+
+                    m = FREE_BYTE_REGEX.search(self.bitmap, byteIndex + 1, end)
+
+        return None
+
+    # Action: check whether an address is in use according to the bitmap
+    #
+    # Pre: build() has been called
+    # Post:
+    #
+    # Params: ip4 - the address to check
+    #
+    # Return: True if in use or outside this network, False otherwise
+    def isUsed(self, ip4):
+        offset = int(IPv4Address(ip4)) - self.base
+
+        if (offset < 0) or (offset >= self.size):
+            return True
+
+        return self.__isSet(self.bitmap, offset)
+
+    # Action: mark the addresses registered in ZFS as used
+    #
+    # Pre:
+    # Post: bitmap has every container's address in this network set
+    #
+    # Params: bitmap - the bitmap to update
+    #
+    # Return: set of registered addresses, or None if ZFS couldnt be read
+    def __markRegistered(self, bitmap):
+        registered = set()
+
+        # every container's ip4_addr, asking zfs for only that property
+        zfsTredly = ZFSDataset(ZFS_TREDLY_DATASET)
+        for dataset, property, ip4Addr in zfsTredly.iterPropertiesRecursive([ZFS_PROP_ROOT + ':ip4_addr'], ['local', 'received']):
+            m = IP4_ADDR_REGEX.match(ip4Addr)
+
+            if (m is not None):
+                registered.add(m.group(2))
+                self.__markUsed(bitmap, m.group(2))
+
+        if (zfsTredly.lastReturnCode != 0):
+            e_error("Failed to get ip addresses in use")
+            return None
+
+        return registered
+
+    # Action: mark an address in the bitmap as used
+    #
+    # Pre:
+    # Post: bit has been set if ip4 is within this network
+    #
+    # Params: bitmap - the bitmap to update
+    #         ip4 - the address
+    #
+    # Return:
+    def __markUsed(self, bitmap, ip4):
+        try:
+            offset = int(IPv4Address(ip4)) - self.base
+        except ValueError:
+            return
+
+        if (offset >= 0) and (offset < self.size):
+            self.__setBit(bitmap, offset)
+
+    def __setBit(self, bitmap, offset):
+        bitmap[offset >> 3] |= (1 << (offset & 7))
+
+    def __isSet(self, bitmap, offset):
+        return (bitmap[offset >> 3] & (1 << (offset & 7))) != 0
+
+# Action: reserve an ip address for this process
+#
+# Pre:
+# Post: a reservation file containing our pid exists for ip4
+#
+# Params: ip4 - the address to reserve
+#
+# Return: True if reserved, False if another running process holds it
+def reserveIP4(ip4):
+    os.makedirs(IP4_RESERVATION_DIR, exist_ok=True)
+
+    # hold the lock while checking and writing so two processes cant both take over a stale reservation
+    with open(IP4_RESERVATION_DIR + '/.lock', 'w') as lockFile:
+        fcntl.flock(lockFile, fcntl.LOCK_EX)
+
+        if (ip4ReservedByOther(ip4)):
+            return False
+
+        with open(IP4_RESERVATION_DIR + '/' + ip4, 'w') as reservation:
+            reservation.write(str(os.getpid()))
+
+    return True
+
+# Action: release a reservation made by this process
+#
+# Pre:
+# Post: reservation file has been removed if we held it
+#
+# Params: ip4 - the address to release
+#
+# Return:
+def releaseIP4(ip4):
+    if (ip4 is None) or (not os.path.isdir(IP4_RESERVATION_DIR)):
+        return
+
+    with open(IP4_RESERVATION_DIR + '/.lock', 'w') as lockFile:
+        fcntl.flock(lockFile, fcntl.LOCK_EX)
+
+        if (ip4ReservedByOther(ip4)):
+            return
+
+        try:
+            os.remove(IP4_RESERVATION_DIR + '/' + ip4)
+        except FileNotFoundError:
+            pass
+
+# Action: check whether a running process other than this one has reserved an ip
+#
+# Pre:
+# Post:
+#
+# Params: ip4 - the address to check
+#
+# Return: True if reserved by another live process, False otherwise
+def ip4ReservedByOther(ip4):
+    try:
+        with open(IP4_RESERVATION_DIR + '/' + ip4) as reservation:
+            pid = int(reservation.read().strip())
+    except (OSError, ValueError):
+        # no reservation, or not one we can make sense of
+        return False
+
+    if (pid == os.getpid()):
+        return False
+
+    # check whether the process that made it is still alive
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+
+    return True
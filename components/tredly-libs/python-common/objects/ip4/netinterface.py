@@ -17,15 +17,19 @@ class NetInterface:
     # Post: self.mac has been set with a random mac address
     #
     # Params: octet1-3 - the first three octets in the mac address
+    #         macsInUse - set of mac addresses that must not be generated, or None
     #
     # Return: True if succeeded, False otherwise
-    def generateMac(self, octet1 = "02", octet2 = "33", octet3 = "11"):
-        # generate the rest of the octets
-        octet4 = hex(random.randint(0x00, 0x7f)).lstrip('0x')
-        octet5 = hex(random.randint(0x00, 0xff)).lstrip('0x')
-        octet6 = hex(random.randint(0x00, 0xff)).lstrip('0x')
-        
-        # generate and set the mac
-        self.mac = octet1 + ":" + octet2 + ":" + octet3 + ":" + str(octet4).rjust(2, '0') + ":" + str(octet5).rjust(2,'0') + ":" + str(octet6).rjust(2,'0') 
-        
-        return True
\ No newline at end of file
+    def generateMac(self, octet1 = "02", octet2 = "33", octet3 = "11", macsInUse = None):
+        while True:
+            # generate the rest of the octets
+            octet4 = hex(random.randint(0x00, 0x7f)).lstrip('0x')
+            octet5 = hex(random.randint(0x00, 0xff)).lstrip('0x')
+            octet6 = hex(random.randint(0x00, 0xff)).lstrip('0x')
+
+            # generate and set the mac
+            self.mac = octet1 + ":" + octet2 + ":" + octet3 + ":" + str(octet4).rjust(2, '0') + ":" + str(octet5).rjust(2,'0') + ":" + str(octet6).rjust(2,'0')
+
+            # try again if it collides with one in use
+            if (macsInUse is None) or (self.mac not in macsInUse):
+                return True
\ No newline at end of file
@@ -0,0 +1,132 @@
+# A class to run a series of network setup commands with a single exec
+#
+# Each step is a shell command. The steps are compiled into one sh script which prints the status of each step as it
+# runs, and on the first failure runs the rollback commands of the steps that already succeeded in reverse order.
+# Step output can be captured into a shell variable so that later steps (and the caller) can use it, eg the name of
+# a newly created epair.
+from subprocess import Popen, PIPE
+import shlex
+
+from includes.output import *
+
+class NetworkScript:
+
+    # Constructor
+    def __init__(self):
+        self.steps = []             # list of dicts with description, cmd, rollback and variable
+        self.values = {}            # variable name -> captured output, populated by run()
+        self.failedStep = None      # description of the step that failed, None if all succeeded
+
+    # Action: add a step to this script
+    #
+    # Pre:
+    # Post: step has been added
+    #
+    # Params: description - what this step does, used in error messages
+    #         cmd - list of arguments, or a shell string if it needs to reference a variable from an earlier step
+    #         rollback - command to undo this step if a later step fails, in the same form as cmd. None for no rollback
+    #         variable - shell variable to capture the output of cmd into. None to not capture
+    #
+    # Return:
+    def addStep(self, description, cmd, rollback = None, variable = None):
+        self.steps.append({
+            'description': description,
+            'cmd': self.__toShell(cmd),
+            'rollback': self.__toShell(rollback),
+            'variable': variable
+        })
+
+    # Action: compile the steps into a shell script
+    #
+    # Pre:
+    # Post:
+    #
+    # Params:
+    #
+    # Return: string
+    def compile(self):
+        lines = []
+
+        for index, step in enumerate(self.steps):
+            if (step['variable'] is not None):
+                lines.append('if ' + step['variable'] + '=$(' + step['cmd'] + ' 2>&1); then')
+                lines.append('    echo "OK ' + str(index) + ' ${' + step['variable'] + '}"')
+                lines.append('else')
+                lines.append('    echo "FAIL ' + str(index) + ' ${' + step['variable'] + '}" | tr "\\n" " "; echo')
+            else:
+                lines.append('if out=$(' + step['cmd'] + ' 2>&1); then')
+                lines.append('    echo "OK ' + str(index) + '"')
+                lines.append('else')
+                lines.append('    echo "FAIL ' + str(index) + ' ${out}" | tr "\\n" " "; echo')
+
+            # undo everything that succeeded before this step
+            for previous in reversed(self.steps[:index]):
+                if (previous['rollback'] is not None):
+                    lines.append('    ' + previous['rollback'] + ' > /dev/null 2>&1')
+
+            lines.append('    exit 1')
+            lines.append('fi')
+
+        return "\n".join(lines) + "\n"
+
+    # Action: run the script
+    #
+    # Pre: steps have been added
+    # Post: self.values holds the captured variables, self.failedStep is set if a step failed
+    #
+    # Params: prefix - list of arguments to run sh within, eg ['jexec', 'trd-<uuid>']
+    #
+    # Return: True if all steps succeeded, False otherwise
+    def run(self, prefix = []):
+        self.values = {}
+        self.failedStep = None
+
+        cmd = prefix + ['sh', '-c', self.compile()]
+        process = Popen(cmd, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        stdOut, stdErr = process.communicate()
+
+        completed = 0
+        for line in stdOut.decode(encoding='UTF-8', errors='replace').splitlines():
+            parts = line.split(' ', 2)
+
+            # ignore anything that isnt a status line
+            if (len(parts) < 2) or (parts[0] not in ['OK', 'FAIL']) or (not parts[1].isdigit()):
+                continue
+
+            step = self.steps[int(parts[1])]
+
+            if (len(parts) > 2):
+                output = parts[2].strip()
+            else:
+                output = ''
+
+            if (parts[0] == 'OK'):
+                completed += 1
+
+                if (step['variable'] is not None):
+                    self.values[step['variable']] = output
+            else:
+                self.failedStep = step['description']
+                e_error("Failed to " + step['description'] + ": " + output)
+
+        # the script didnt report on every step, eg sh itself could not be run
+        if (self.failedStep is None) and (completed < len(self.steps)):
+            self.failedStep = self.steps[completed]['description']
+            e_error("Failed to " + self.failedStep)
+            print(stdErr)
+
+        return (self.failedStep is None)
+
+    # Action: turn a command into a shell string
+    #
+    # Pre:
+    # Post:
+    #
+    # Params: cmd - list of arguments, or a shell string
+    #
+    # Return: string, or None if cmd was None
+    def __toShell(self, cmd):
+        if (cmd is None) or (isinstance(cmd, str)):
+            return cmd
+
+        return ' '.join(shlex.quote(arg) for arg in cmd)
@@ -3,6 +3,9 @@ import os.path
 import re
 from subprocess import Popen, PIPE
 
+from objects.tredly.servicereload import ServiceReload
+from objects.config.configwriter import ConfigWriter
+
 class Layer4ProxyFile:
 
     # Constructor
@@ -10,6 +13,7 @@ class Layer4ProxyFile:
         self.filePath = filePath
         self.preamble = ''
         self.lines = []
+        self.changed = False    # whether the last write() changed the file
 
     # Action: reads layer 4 proxy file, and stores parsed lines to self
     #
@@ -158,14 +162,18 @@ class Layer4ProxyFile:
     # Action: writes a layer 4 proxy file.
     #
     # Pre:
-    # Post: the self.lines object has been written to the layer 4 proxy file in the layer 4 proxy format
+    # Post: the self.lines object has been written to the layer 4 proxy file in the layer 4 proxy format if it changed,
+    #       and self.changed set
     #
     # Params:
     #
     # Return: True if successful, False otherwise
     def write(self):
+        writer = ConfigWriter(self.filePath)
+        self.changed = False
+
         try:
-            with open(self.filePath, 'w') as l4proxyFile:
+            with writer as l4proxyFile:
                 print(self.preamble, file=l4proxyFile)
                 
                 for i, line in enumerate(self.lines):
@@ -180,7 +188,9 @@ class Layer4ProxyFile:
                     print(text, file=l4proxyFile)
         except IOError:
             return False
-        
+
+        self.changed = writer.changed
+
         return True
     
     # Action: reload the layer 4 proxy data from self.filePath
@@ -192,7 +202,5 @@ class Layer4ProxyFile:
     #
     # Return: True if succeeded, False otherwise
     def reload(self):
-        # run the script that this object represents
-        process = Popen(['sh', self.filePath], stdin=PIPE, stdout=PIPE, stderr=PIPE)
-        stdOut, stdErr = process.communicate()
-        return (process.returncode == 0)
\ No newline at end of file
+        # run the script that this object represents, or queue it if reloads are being deferred
+        return ServiceReload().request('layer 4 proxy', ['sh', self.filePath])
\ No newline at end of file
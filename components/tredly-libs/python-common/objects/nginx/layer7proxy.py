@@ -1,17 +1,24 @@
 # A class to retrieve data from a tredly host
 from subprocess import Popen, PIPE
 import re
+import os
+import shutil
 import builtins
+import hashlib
+import ipaddress
+from collections import OrderedDict
 
 from includes.util import *
 from includes.defines import *
 from includes.output import *
 from objects.nginx.nginxblock import *
+from objects.tredly.servicereload import ServiceReload
 
 class Layer7Proxy:
 
     # Constructor
-    #def __init__(self):
+    def __init__(self):
+        self.changed = False    # whether any file saved by this object has changed, so nginx needs a reload
     
     # Action: reload nginx on the host
     #
@@ -22,11 +29,8 @@ class Layer7Proxy:
     #
     # Return: True if succeeded, False otherwise
     def reload(self):
-        # reload nginx
-        process = Popen(['service', 'nginx', 'reload'],  stdin=PIPE, stdout=PIPE, stderr=PIPE)
-        stdOut, stdErr = process.communicate()
-
-        if (process.returncode != 0):
+        # reload nginx once its config passes nginx -t, or queue it if reloads are being deferred
+        if (not ServiceReload().request('nginx', ['service', 'nginx', 'reload'], ['nginx', '-t'])):
             e_error("Failed to reload layer 7 proxy")
             return False
         else:
@@ -46,9 +50,117 @@ class Layer7Proxy:
     #         sslCert - the path to the cert eg ssl/stage/star.tld.com/server.crt
     #         sslKey - the path to the key, eg ssl/stage/star.tld.com/server.key
     #         includes - any extra files to include within this URL
+    #         keepalive - the number of idle connections to the container that each nginx worker keeps open. 0 disables keepalive
+    #         keepaliveTimeout - how long an idle keepalive connection stays open, eg 60s. None for nginx's default
+    #         keepaliveRequests - the number of requests sent over a keepalive connection before it is closed. None for nginx's default
+    #         cache - dict of cache options from the tredlyfile, None to not cache this URL
+    #         partitionName - the partition whose proxy_cache file holds the cache zone for this URL
+    #         loadBalancing - dict of load balancing options from the tredlyfile, None for round robin with nginx's defaults
+    #         ocspStapling - whether to staple OCSP responses to the cert. None for the host's httpProxyOcspStapling
+    #         gzip - dict of gzip options from the tredlyfile, None for the proxy's defaults
+    #         accessVariable - a geo variable from getGeoVariable() that must be non zero for requests to be allowed
     #
     # Return: True if succeeded, False otherwise
-    def registerUrl(self, url, ip4, maxFileSize, websocket, servernameFilename, upstreamFilename, errorResponse, sslCert = None, sslKey = None, includes = None):
+    def registerUrl(self, url, ip4, maxFileSize, websocket, servernameFilename, upstreamFilename, errorResponse, sslCert = None, sslKey = None, includes = None, keepalive = 0, keepaliveTimeout = None, keepaliveRequests = None, cache = None, partitionName = None, loadBalancing = None, ocspStapling = None, gzip = None, accessVariable = None):
+        return self.registerUrls([{
+            'url': url,
+            'maxFileSize': maxFileSize,
+            'websocket': websocket,
+            'servernameFilename': servernameFilename,
+            'upstreamFilename': upstreamFilename,
+            'errorResponse': errorResponse,
+            'sslCert': sslCert,
+            'sslKey': sslKey,
+            'keepalive': keepalive,
+            'keepaliveTimeout': keepaliveTimeout,
+            'keepaliveRequests': keepaliveRequests,
+            'cache': cache,
+            'loadBalancing': loadBalancing,
+            'ocspStapling': ocspStapling,
+            'gzip': gzip
+        }], ip4, includes, partitionName, accessVariable)
+
+    # Action: add a number of urls to the layer 7 proxy
+    #
+    # Pre: 
+    # Post: the given urls have been added as proxy URL definitions within nginx
+    #
+    # Params: urls - a list of dicts with the keys url, maxFileSize, websocket, servernameFilename, upstreamFilename,
+    #                errorResponse, sslCert, sslKey, keepalive, keepaliveTimeout, keepaliveRequests, cache,
+    #                loadBalancing, ocspStapling and gzip, as for registerUrl
+    #         ip4 - the ip4 address of the container serving these urls
+    #         includes - any extra files to include within each URL
+    #         partitionName - the partition whose proxy_cache file holds the cache zones for these urls
+    #         accessVariable - a geo variable from getGeoVariable() that must be non zero for requests to be allowed
+    #
+    # Return: True if succeeded, False otherwise
+    def registerUrls(self, urls, ip4, includes = None, partitionName = None, accessVariable = None):
+        # urls on the same domain and protocol share a server_name file, so load each file once and apply all of the
+        # urls to it in memory before saving
+        servernames = OrderedDict()
+        upstreams = OrderedDict()
+
+        # the cache zones for all of the urls live in the partition's proxy_cache file
+        cacheZones = None
+        if (partitionName is not None):
+            cacheZones = NginxBlock(None, None, NGINX_PROXYCACHE_DIR + '/' + nginxFormatFilename(partitionName))
+            if (not self.__loadFile(cacheZones)):
+                return False
+
+        for urlObj in urls:
+            servernamePath = '/usr/local/etc/nginx/server_name/' + nginxFormatFilename(urlObj['servernameFilename'])
+            upstreamPath = '/usr/local/etc/nginx/upstream/' + nginxFormatFilename(urlObj['upstreamFilename'])
+
+            if (servernamePath not in servernames.keys()):
+                servernames[servernamePath] = NginxBlock(None, None, servernamePath)
+                if (not self.__loadFile(servernames[servernamePath])):
+                    return False
+
+            if (upstreamPath not in upstreams.keys()):
+                upstreams[upstreamPath] = NginxBlock(None, None, upstreamPath)
+                if (not self.__loadFile(upstreams[upstreamPath])):
+                    return False
+
+            # cache zones are defined for the whole host, so the zone is named after both the partition and the url.
+            # without a partition there is nowhere to define the zone, so the url isnt cached
+            cache = None
+            cacheZone = None
+            if (partitionName is not None):
+                cache = urlObj['cache']
+                cacheZone = self.__getCacheZoneName(partitionName, urlObj['upstreamFilename'])
+
+            self.__applyUrl(servernames[servernamePath], upstreams[upstreamPath], urlObj['url'], ip4, urlObj['maxFileSize'],
+                urlObj['websocket'], urlObj['upstreamFilename'], urlObj['errorResponse'], urlObj['sslCert'], urlObj['sslKey'], includes,
+                urlObj['keepalive'], urlObj['keepaliveTimeout'], urlObj['keepaliveRequests'], cache, cacheZone, urlObj['loadBalancing'],
+                urlObj['ocspStapling'], urlObj['gzip'], accessVariable)
+
+            if (cacheZones is not None):
+                self.__applyCacheZone(cacheZones, partitionName, urlObj['upstreamFilename'], urlObj['cache'])
+
+        # save the cache zones and upstream files before the server_name files that refer to them
+        blocks = list(upstreams.values()) + list(servernames.values())
+        if (cacheZones is not None):
+            blocks.insert(0, cacheZones)
+
+        for block in blocks:
+            if (not block.saveFile()):
+                return False
+            self.changed = self.changed or block.changed
+
+        return True
+
+    # Action: add a url to loaded server_name and upstream files
+    #
+    # Pre: servername and upstream have been loaded from their files
+    # Post: the url has been added to servername and upstream, but not saved
+    #
+    # Params: servername - the NginxBlock for the server_name file
+    #         upstream - the NginxBlock for the upstream file
+    #         cacheZone - the name of the url's cache zone, from __getCacheZoneName()
+    #         the rest as for registerUrl
+    #
+    # Return: 
+    def __applyUrl(self, servername, upstream, url, ip4, maxFileSize, websocket, upstreamFilename, errorResponse, sslCert, sslKey, includes, keepalive, keepaliveTimeout, keepaliveRequests, cache, cacheZone, loadBalancing, ocspStapling, gzip, accessVariable):
         # split the url into its domain and directory parts
         if ('/' in url.rstrip('/')):
             urlDomain = url.split('/', 1)[0]
@@ -66,12 +178,6 @@ class Layer7Proxy:
             protocol = "https"
             
         
-        # create nginxblocks from each of these files
-        servername = NginxBlock(None, None, '/usr/local/etc/nginx/server_name/' + nginxFormatFilename(servernameFilename))
-        servername.loadFile()
-        upstream = NginxBlock(None, None, '/usr/local/etc/nginx/upstream/' + nginxFormatFilename(upstreamFilename))
-        upstream.loadFile()
-
         #####################################
         # SET UP THE UPSTREAM FILE
         # check if the https upstream block exists
@@ -81,12 +187,62 @@ class Layer7Proxy:
             # not defined, so define it
             upstream.addBlock('upstream', upstreamFilename)
         
-        # add the ip address of this container to the upstream block
-        upstream.upstream[upstreamFilename].addAttr('server', ip4 + ':' + port)
+        # set the balancing method. this is shared by every container serving this url, so the last to register wins
+        for attr in LEADING_ATTRS:
+            if (attr in upstream.upstream[upstreamFilename].attrs.keys()):
+                del upstream.upstream[upstreamFilename].attrs[attr]
 
-        # save the upstream file
-        if (not upstream.saveFile()):
-            return False
+        if (loadBalancing is None):
+            method = 'roundRobin'
+        else:
+            method = loadBalancing['method']
+
+        if (method == 'leastConn'):
+            upstream.upstream[upstreamFilename].attrs['least_conn'][0] = None
+        elif (method == 'ipHash'):
+            upstream.upstream[upstreamFilename].attrs['ip_hash'][0] = None
+        elif (method == 'hash'):
+            upstream.upstream[upstreamFilename].attrs['hash'][0] = loadBalancing['hashKey'] + ' consistent'
+
+        # the ip address of this container, and its options within the pool
+        server = ip4 + ':' + port
+        if (loadBalancing is not None):
+            server += ' weight=' + str(loadBalancing['weight']) + ' max_fails=' + str(loadBalancing['maxFails']) + ' fail_timeout=' + loadBalancing['failTimeout']
+
+            if (loadBalancing['backup']):
+                server += ' backup'
+
+        # replace any previous entry for this container, keeping the other containers in the pool
+        servers = []
+        for value in upstream.upstream[upstreamFilename].attrs['server'].values():
+            if (not re.match('^' + re.escape(ip4 + ':' + port) + '( |$)', value)):
+                servers.append(value)
+        servers.append(server)
+
+        # nginx wont load backup servers with the hash methods
+        if (method in ['ipHash', 'hash']):
+            servers = [re.sub(' backup$', '', value) for value in servers]
+
+        upstream.upstream[upstreamFilename].attrs['server'] = dict(enumerate(servers))
+
+        # keep idle connections to the containers open so that each request doesnt need a new one
+        if (keepalive > 0):
+            upstream.upstream[upstreamFilename].attrs['keepalive'][0] = str(keepalive)
+
+            if (keepaliveTimeout is not None):
+                upstream.upstream[upstreamFilename].attrs['keepalive_timeout'][0] = keepaliveTimeout
+            elif ('keepalive_timeout' in upstream.upstream[upstreamFilename].attrs.keys()):
+                del upstream.upstream[upstreamFilename].attrs['keepalive_timeout']
+
+            if (keepaliveRequests is not None):
+                upstream.upstream[upstreamFilename].attrs['keepalive_requests'][0] = str(keepaliveRequests)
+            elif ('keepalive_requests' in upstream.upstream[upstreamFilename].attrs.keys()):
+                del upstream.upstream[upstreamFilename].attrs['keepalive_requests']
+        else:
+            # remove the keepalive entries
+            for attr in ['keepalive', 'keepalive_timeout', 'keepalive_requests']:
+                if (attr in upstream.upstream[upstreamFilename].attrs.keys()):
+                    del upstream.upstream[upstreamFilename].attrs[attr]
         
         #####################################
         # SET UP THE SERVER_NAME FILE
@@ -98,23 +254,11 @@ class Layer7Proxy:
             # not defined, so define it
             servername.addBlock('server')
 
-        # add ssl specific items
-        if (sslCert is not None):
-            servername.server[0].attrs['ssl'][0] = "on"
-            servername.server[0].attrs['ssl_certificate'][0] = sslCert
-            servername.server[0].attrs['ssl_certificate_key'][0] = sslKey
-        else:
-            # remove the ssl entries
-            if ('ssl' in servername.server[0].attrs.keys()):
-                del servername.server[0].attrs['ssl']
-            if ('ssl_certificate' in servername.server[0].attrs.keys()):
-                del servername.server[0].attrs['ssl_certificate']
-            if ('ssl_certificate_key' in servername.server[0].attrs.keys()):
-                del servername.server[0].attrs['ssl_certificate_key']
-        
         # add standard lines
         servername.server[0].attrs['server_name'][0] = urlDomain
-        servername.server[0].attrs['listen'][0] = builtins.tredlyCommonConfig.httpProxyIP + ":" + port
+
+        # add the listen line and ssl specific items
+        self.__applyTls(servername.server[0], sslCert, sslKey, ocspStapling)
 
         # add the location block
         try:
@@ -132,12 +276,77 @@ class Layer7Proxy:
             if ('include' in servername.server[0].location[urlDirectory].attrs.keys()):
                 del servername.server[0].location[urlDirectory].attrs['include']
         
-        # include websockets if requested, otherwise include http/https include file
+        # remove the previous proxy_pass include in case websocket or cache has changed
+        if ('include' in servername.server[0].location[urlDirectory].attrs.keys()):
+            servername.server[0].location[urlDirectory].delAttrByRegex('include', '^proxy_pass/')
+
+        # include websockets if requested, otherwise include http/https include file. cached responses need to be
+        # buffered, which the plain http/https include turns off
         if (websocket):
             servername.server[0].location[urlDirectory].addAttr('include', 'proxy_pass/ws_wss')
+        elif (cache is not None):
+            servername.server[0].location[urlDirectory].addAttr('include', 'proxy_pass/http_https_cache')
         else:
             servername.server[0].location[urlDirectory].addAttr('include', 'proxy_pass/http_https')
         
+        # upstream keepalive connections need http 1.1 and no "Connection: close" from the client. the websocket
+        # include already uses http 1.1, and needs its Connection header for the upgrade
+        if (keepalive > 0) and (not websocket):
+            servername.server[0].location[urlDirectory].attrs['proxy_http_version'][0] = '1.1'
+            servername.server[0].location[urlDirectory].addAttr('proxy_set_header', 'Connection ""')
+        else:
+            if ('proxy_http_version' in servername.server[0].location[urlDirectory].attrs.keys()):
+                del servername.server[0].location[urlDirectory].attrs['proxy_http_version']
+            if ('proxy_set_header' in servername.server[0].location[urlDirectory].attrs.keys()):
+                servername.server[0].location[urlDirectory].delAttrByRegex('proxy_set_header', '^Connection ""$')
+
+        # remove any previous cache settings and add the current ones
+        for attr in ['proxy_cache', 'proxy_cache_valid', 'proxy_cache_bypass', 'proxy_no_cache', 'proxy_cache_use_stale', 'proxy_cache_background_update', 'proxy_cache_lock']:
+            if (attr in servername.server[0].location[urlDirectory].attrs.keys()):
+                del servername.server[0].location[urlDirectory].attrs[attr]
+
+        if (cache is not None):
+            servername.server[0].location[urlDirectory].attrs['proxy_cache'][0] = cacheZone
+
+            for valid in cache['valid']:
+                servername.server[0].location[urlDirectory].addAttr('proxy_cache_valid', valid)
+
+            # dont serve bypassed requests from the cache, or store their responses
+            if (len(cache['bypass']) > 0):
+                servername.server[0].location[urlDirectory].attrs['proxy_cache_bypass'][0] = ' '.join(cache['bypass'])
+                servername.server[0].location[urlDirectory].attrs['proxy_no_cache'][0] = ' '.join(cache['bypass'])
+
+            # serve stale responses while a single request refreshes them, or while the container is erroring
+            if (cache['staleWhileRevalidate']):
+                servername.server[0].location[urlDirectory].attrs['proxy_cache_use_stale'][0] = 'updating error timeout http_500 http_502 http_503 http_504'
+                servername.server[0].location[urlDirectory].attrs['proxy_cache_background_update'][0] = 'on'
+                servername.server[0].location[urlDirectory].attrs['proxy_cache_lock'][0] = 'on'
+
+        # compress responses for this url, otherwise leave it to the proxy's defaults
+        for attr in ['gzip', 'gzip_types', 'gzip_min_length', 'gzip_proxied']:
+            if (attr in servername.server[0].location[urlDirectory].attrs.keys()):
+                del servername.server[0].location[urlDirectory].attrs[attr]
+
+        if (gzip is not None):
+            if (gzip['enabled']):
+                servername.server[0].location[urlDirectory].attrs['gzip'][0] = 'on'
+                servername.server[0].location[urlDirectory].attrs['gzip_proxied'][0] = 'any'
+                servername.server[0].location[urlDirectory].attrs['gzip_min_length'][0] = str(gzip['minLength'])
+
+                # text/html is always compressed, and nginx warns if it is listed
+                types = [mimeType for mimeType in gzip['types'] if (mimeType != 'text/html')]
+                if (len(types) > 0):
+                    servername.server[0].location[urlDirectory].attrs['gzip_types'][0] = ' '.join(types)
+            else:
+                servername.server[0].location[urlDirectory].attrs['gzip'][0] = 'off'
+
+        # deny requests from outside the whitelists of the containers serving this location, with a single lookup of
+        # the variable that combines their geo maps
+        if (accessVariable is not None):
+            locationVariable = self.addLocationAccess(servername, urlDirectory, accessVariable)
+            servername.server[0].location[urlDirectory].addBlock('if', '(' + locationVariable + ' = 0)')
+            servername.server[0].location[urlDirectory].blocks['if']['(' + locationVariable + ' = 0)'].attrs['return'][0] = '403'
+
         # add maxfilesize if requested
         if (maxFileSize is not None):
             servername.server[0].location[urlDirectory].attrs['client_max_body_size'][0] = maxFileSize
@@ -173,13 +382,315 @@ class Layer7Proxy:
         servername.server[0].location['/tredly_error_docs'].attrs['log_not_found'][0] = 'off'
         servername.server[0].location['/tredly_error_docs'].attrs['access_log'][0] = 'off'
         servername.server[0].location['/tredly_error_docs'].attrs['internal'][0] = None
-            
-        # save the file
-        if (not servername.saveFile()):
+
+    # Action: set the listen line and tls settings of a server block
+    #
+    # Pre: 
+    # Post: server listens for http, or for https with the host's tls settings if a cert was given
+    #
+    # Params: server - the NginxBlock of the server
+    #         sslCert - the path to the cert, None for http
+    #         sslKey - the path to the key
+    #         ocspStapling - whether to staple OCSP responses to the cert. None for the host's httpProxyOcspStapling
+    #
+    # Return: 
+    def __applyTls(self, server, sslCert, sslKey, ocspStapling = None):
+        # remove the ssl entries, so that only the current settings are written
+        for attr in ['ssl', 'ssl_certificate', 'ssl_certificate_key', 'ssl_session_cache', 'ssl_session_timeout', 'ssl_session_tickets', 'ssl_stapling', 'resolver']:
+            if (attr in server.attrs.keys()):
+                del server.attrs[attr]
+
+        if (sslCert is None):
+            server.attrs['listen'][0] = builtins.tredlyCommonConfig.httpProxyIP + ":80"
+            return
+
+        # http2 is enabled per listening address in nginx, so it is only set host wide to keep every https server block the same
+        if (builtins.tredlyCommonConfig.httpProxyHttp2 == "yes"):
+            server.attrs['listen'][0] = builtins.tredlyCommonConfig.httpProxyIP + ":443 http2"
+        else:
+            server.attrs['listen'][0] = builtins.tredlyCommonConfig.httpProxyIP + ":443"
+
+        server.attrs['ssl'][0] = "on"
+        server.attrs['ssl_certificate'][0] = sslCert
+        server.attrs['ssl_certificate_key'][0] = sslKey
+
+        # every server uses the same shared session cache, so that nginx sees a single definition of it
+        if (builtins.tredlyCommonConfig.httpProxySslSessionCache == "0"):
+            server.attrs['ssl_session_cache'][0] = "off"
+        else:
+            server.attrs['ssl_session_cache'][0] = "shared:tredly_ssl:" + builtins.tredlyCommonConfig.httpProxySslSessionCache
+            server.attrs['ssl_session_timeout'][0] = builtins.tredlyCommonConfig.httpProxySslSessionTimeout
+
+        if (builtins.tredlyCommonConfig.httpProxySslSessionTickets == "yes"):
+            server.attrs['ssl_session_tickets'][0] = "on"
+        else:
+            server.attrs['ssl_session_tickets'][0] = "off"
+
+        if (ocspStapling is None):
+            ocspStapling = (builtins.tredlyCommonConfig.httpProxyOcspStapling == "yes")
+
+        # nginx needs a resolver to look up the OCSP responder
+        if (ocspStapling) and (len(builtins.tredlyCommonConfig.dns) > 0):
+            server.attrs['ssl_stapling'][0] = "on"
+            server.attrs['resolver'][0] = ' '.join(builtins.tredlyCommonConfig.dns)
+
+    # Action: remove a url's cache zone from the layer 7 proxy
+    #
+    # Pre: 
+    # Post: the cache zone and its cached responses have been removed
+    #
+    # Params: partitionName - the partition the url belongs to
+    #         upstreamFilename - the url's upstream name
+    #
+    # Return: True if succeeded, False otherwise
+    def removeCacheZone(self, partitionName, upstreamFilename):
+        cacheZones = NginxBlock(None, None, NGINX_PROXYCACHE_DIR + '/' + nginxFormatFilename(partitionName))
+        if (not self.__loadFile(cacheZones)):
             return False
-        
-        return True
-        
+
+        self.__applyCacheZone(cacheZones, partitionName, upstreamFilename, None)
+
+        result = cacheZones.saveFile()
+        self.changed = self.changed or cacheZones.changed
+
+        # the cached responses are no longer reachable
+        shutil.rmtree(NGINX_CACHE_DATA_DIR + '/' + nginxFormatFilename(partitionName) + '/' + upstreamFilename, ignore_errors=True)
+
+        return result
+
+    # Action: add or remove a url's cache zone in a loaded proxy_cache file
+    #
+    # Pre: cacheZones has been loaded from its file
+    # Post: the zone has been set to the given options, or removed if cache is None
+    #
+    # Params: cacheZones - the NginxBlock for the partition's proxy_cache file
+    #         partitionName - the partition the url belongs to
+    #         upstreamFilename - the url's upstream name
+    #         cache - dict of cache options from the tredlyfile
+    #
+    # Return: 
+    def __applyCacheZone(self, cacheZones, partitionName, upstreamFilename, cache):
+        cachePath = NGINX_CACHE_DATA_DIR + '/' + nginxFormatFilename(partitionName) + '/' + upstreamFilename
+        zoneName = self.__getCacheZoneName(partitionName, upstreamFilename)
+
+        # remove the existing definition for this zone
+        if ('proxy_cache_path' in cacheZones.attrs.keys()):
+            cacheZones.delAttrByRegex('proxy_cache_path', '^' + re.escape(cachePath) + ' ')
+
+        if (cache is not None):
+            cacheZones.addAttr('proxy_cache_path', cachePath + ' levels=1:2 keys_zone=' + zoneName + ':' + cache['zoneSize'] +
+                ' max_size=' + cache['maxSize'] + ' inactive=' + cache['inactive'] + ' use_temp_path=off')
+
+    # Action: get the name of a url's cache zone
+    #
+    # Pre: 
+    # Post: 
+    #
+    # Params: partitionName - the partition the url belongs to
+    #         upstreamFilename - the url's upstream name
+    #
+    # Return: the zone name
+    def __getCacheZoneName(self, partitionName, upstreamFilename):
+        # neither part can contain a dot once formatted, so the name is unique to the partition and url
+        return nginxFormatFilename(partitionName) + '.' + upstreamFilename
+
+    # Action: load an nginx file, so that a file which fails to parse isnt saved back out empty
+    #
+    # Pre:
+    # Post: block has been populated from its file if it parsed
+    #
+    # Params: block - the NginxBlock to load
+    #
+    # Return: True if succeeded, False otherwise
+    def __loadFile(self, block):
+        if (block.loadFile()):
+            return True
+
+        e_error("Failed to parse " + str(block.filePath))
+        return False
+
+    # Action: get the name of the geo variable for a whitelist
+    #
+    # Pre: 
+    # Post: 
+    #
+    # Params: name - the name of the whitelist, eg a container's uuid
+    #
+    # Return: the variable, including its $
+    def getGeoVariable(self, name):
+        # nginx variable names can only contain letters, numbers and underscores
+        return '$tredly_' + re.sub('[^A-Za-z0-9_]', '_', name)
+
+    # Action: get the name of the variable that combines the geo maps of the containers serving a location
+    #
+    # Pre: 
+    # Post: 
+    #
+    # Params: servername - the NginxBlock of the server_name file holding the location
+    #         urlDirectory - the location
+    #
+    # Return: the variable, including its $
+    def getLocationAccessVariable(self, servername, urlDirectory):
+        # locations can contain characters that variable names cant, so name it by a hash of the file and location
+        location = os.path.basename(servername.filePath) + urlDirectory
+
+        return self.getGeoVariable('location_' + hashlib.sha1(location.encode('utf-8')).hexdigest()[:16])
+
+    # Action: add a container's geo variable to the map that decides access to a location
+    #
+    # Pre: 
+    # Post: the server_name file maps the location's variable to 1 when any of its containers' geo variables is 1,
+    #       so that a client in the whitelist of any container serving the location is allowed. save the file to apply
+    #
+    # Params: servername - the NginxBlock of the server_name file holding the location
+    #         urlDirectory - the location
+    #         accessVariable - the container's geo variable from getGeoVariable()
+    #
+    # Return: the location's variable
+    def addLocationAccess(self, servername, urlDirectory, accessVariable):
+        locationVariable = self.getLocationAccessVariable(servername, urlDirectory)
+        accessVariables = self.__popLocationAccessMap(servername, locationVariable)
+
+        if (accessVariable not in accessVariables):
+            accessVariables.append(accessVariable)
+
+        self.__addLocationAccessMap(servername, locationVariable, accessVariables)
+
+        return locationVariable
+
+    # Action: remove a container's geo variable from the map that decides access to a location
+    #
+    # Pre: 
+    # Post: the container no longer affects access to the location. once no containers are left the map and the
+    #       location's check of it have been removed. save the file to apply
+    #
+    # Params: servername - the NginxBlock of the server_name file holding the location
+    #         urlDirectory - the location
+    #         accessVariable - the container's geo variable from getGeoVariable()
+    #
+    # Return: 
+    def removeLocationAccess(self, servername, urlDirectory, accessVariable):
+        locationVariable = self.getLocationAccessVariable(servername, urlDirectory)
+        accessVariables = self.__popLocationAccessMap(servername, locationVariable)
+
+        if (accessVariable in accessVariables):
+            accessVariables.remove(accessVariable)
+
+        if (len(accessVariables) > 0):
+            self.__addLocationAccessMap(servername, locationVariable, accessVariables)
+        else:
+            try:
+                del servername.blocks['server'][0].blocks['location'][urlDirectory].blocks['if']['(' + locationVariable + ' = 0)']
+            except KeyError:
+                # doesnt exist so pass
+                pass
+
+    # Action: add the map for a location's variable to a server_name file
+    #
+    # Pre: 
+    # Post: the map has been added
+    #
+    # Params: servername - the NginxBlock of the server_name file
+    #         locationVariable - the location's variable from getLocationAccessVariable()
+    #         accessVariables - the geo variables of the containers serving the location
+    #
+    # Return: 
+    def __addLocationAccessMap(self, servername, locationVariable, accessVariables):
+        # map the concatenated geo variables, eg "$tredly_a$tredly_b", which contain a 1 if any of them allow the client
+        key = '"' + ''.join(accessVariables) + '" ' + locationVariable
+
+        servername.addBlock('map', key)
+        servername.blocks['map'][key].attrs['default'][0] = '0'
+        servername.blocks['map'][key].attrs['~1'][0] = '1'
+
+    # Action: remove the map for a location's variable from a server_name file
+    #
+    # Pre: 
+    # Post: the map has been removed
+    #
+    # Params: servername - the NginxBlock of the server_name file
+    #         locationVariable - the location's variable from getLocationAccessVariable()
+    #
+    # Return: list of the geo variables the map combined
+    def __popLocationAccessMap(self, servername, locationVariable):
+        accessVariables = []
+
+        for key in list(servername.blocks['map'].keys()):
+            # the key is the map's source and the variable it sets
+            if (key.endswith(' ' + locationVariable)):
+                accessVariables = re.findall('\\$\\w+', key.rsplit(' ', 1)[0])
+                del servername.blocks['map'][key]
+
+        return accessVariables
+
+    # Action: add a whitelist to a partition's geo file
+    #
+    # Pre: 
+    # Post: the geo file contains a map for name, which is 1 for addresses within the whitelist and 0 otherwise
+    #
+    # Params: partitionName - the partition whose geo file to add the map to
+    #         name - the name of the whitelist, eg a container's uuid
+    #         whitelist - a list of ip4 addresses and networks. an empty whitelist allows every address
+    #
+    # Return: True if succeeded, False otherwise
+    def registerGeoWhitelist(self, partitionName, name, whitelist):
+        geoFile = NginxBlock(None, None, NGINX_GEO_DIR + '/' + nginxFormatFilename(partitionName))
+        if (not self.__loadFile(geoFile)):
+            return False
+
+        variable = self.getGeoVariable(name)
+
+        # replace the existing map
+        if (variable in geoFile.blocks['geo'].keys()):
+            del geoFile.blocks['geo'][variable]
+
+        geoFile.addBlock('geo', variable)
+        geo = geoFile.blocks['geo'][variable]
+
+        if (len(whitelist) == 0):
+            geo.attrs['default'][0] = '1'
+        else:
+            geo.attrs['default'][0] = '0'
+
+            # merge overlapping and adjacent ranges so the map is as small as possible
+            networks = []
+            for ip4 in whitelist:
+                try:
+                    networks.append(ipaddress.ip_network(ip4, strict=False))
+                except ValueError:
+                    e_warning("Invalid whitelist entry " + ip4)
+
+            for network in ipaddress.collapse_addresses(networks):
+                geo.attrs[str(network)][0] = '1'
+
+        result = geoFile.saveFile()
+        self.changed = self.changed or geoFile.changed
+
+        return result
+
+    # Action: remove a whitelist from a partition's geo file
+    #
+    # Pre: 
+    # Post: the geo file no longer contains a map for name
+    #
+    # Params: partitionName - the partition whose geo file to remove the map from
+    #         name - the name of the whitelist
+    #
+    # Return: True if succeeded, False otherwise
+    def removeGeoWhitelist(self, partitionName, name):
+        geoFile = NginxBlock(None, None, NGINX_GEO_DIR + '/' + nginxFormatFilename(partitionName))
+        if (not self.__loadFile(geoFile)):
+            return False
+
+        variable = self.getGeoVariable(name)
+
+        if (variable in geoFile.blocks['geo'].keys()):
+            del geoFile.blocks['geo'][variable]
+
+        result = geoFile.saveFile()
+        self.changed = self.changed or geoFile.changed
+
+        return result
 
     # Action: add an access file to the layer 7 proxy
     #
@@ -194,7 +705,8 @@ class Layer7Proxy:
     def registerAccessFile(self, file, whitelist, deny = False):
         # create nginxblocks from each of these files
         accessFile = NginxBlock(None, None, file)
-        accessFile.loadFile()
+        if (not self.__loadFile(accessFile)):
+            return False
         
         # loop over the whitelist and add in the ips to the access file
         if (len(whitelist) > 0):
@@ -207,7 +719,10 @@ class Layer7Proxy:
         if (deny):
             accessFile.addAttr('deny', 'all')
         
-        return accessFile.saveFile()
+        result = accessFile.saveFile()
+        self.changed = self.changed or accessFile.changed
+        
+        return result
 
     # Action: add a redirect URL to the layer 7 proxy
     #
@@ -233,10 +748,8 @@ class Layer7Proxy:
         # work out which protocol we are redirecting FROM
         if (redirectFromSslCert is None):
             redirectFromProtocol = 'http'
-            redirectFromPort = "80"
         else:
             redirectFromProtocol = 'https'
-            redirectFromPort = "443"
         
         # split out the redirect to parts
         redirectToProtocol = redirectTo.split('://')[0]
@@ -247,7 +760,8 @@ class Layer7Proxy:
         
         # create nginxblock object
         servernameRedirect = NginxBlock(None, None, filePath)
-        servernameRedirect.loadFile()
+        if (not self.__loadFile(servernameRedirect)):
+            return False
         
         # check if the server block exists, and add it if it doesnt
         try:
@@ -258,21 +772,9 @@ class Layer7Proxy:
 
         # add attrs
         servernameRedirect.server[0].attrs['server_name'][0] = urlDomain
-        servernameRedirect.server[0].attrs['listen'][0] = builtins.tredlyCommonConfig.httpProxyIP + ":" + redirectFromPort
         
-        # enable ssl if a cert was presented
-        if (redirectFromSslCert is not None):
-            servernameRedirect.server[0].attrs['ssl'][0] = "on"
-            servernameRedirect.server[0].attrs['ssl_certificate'][0] = redirectFromSslCert
-            servernameRedirect.server[0].attrs['ssl_certificate_key'][0] = redirectFromSslKey
-        else:
-            # remove the ssl entries
-            if ('ssl' in servernameRedirect.server[0].attrs.keys()):
-                del servernameRedirect.server[0].attrs['ssl']
-            if ('ssl_certificate' in servernameRedirect.server[0].attrs.keys()):
-                del servernameRedirect.server[0].attrs['ssl_certificate']
-            if ('ssl_certificate_key' in servernameRedirect.server[0].attrs.keys()):
-                del servernameRedirect.server[0].attrs['ssl_certificate_key']
+        # add the listen line, and enable ssl if a cert was presented
+        self.__applyTls(servernameRedirect.server[0], redirectFromSslCert, redirectFromSslKey)
         
         # add the location block if it doesnt exist
         try:
@@ -285,4 +787,7 @@ class Layer7Proxy:
         servernameRedirect.server[0].location[urlDirectory].attrs['return'][0] = "301 " + redirectToProtocol + '://' + redirectToDomain + '$request_uri'
         
         # save the file and return whether it succeeded or not
-        return servernameRedirect.saveFile()
\ No newline at end of file
+        result = servernameRedirect.saveFile()
+        self.changed = self.changed or servernameRedirect.changed
+        
+        return result
\ No newline at end of file
@@ -14,14 +14,33 @@
 # FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION 
 # WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
-# Version 0.2
+# Version 0.3
 
-from collections import defaultdict
 from collections import OrderedDict
 import re
+import io
 import json
 import os
 
+from objects.nginx.nginxparser import NginxParser, NginxComment, NginxSyntaxError
+from objects.config.configwriter import ConfigWriter
+
+# attrs that nginx needs before the others in their block, eg the balancing method before keepalive in an upstream
+LEADING_ATTRS = ['hash', 'ip_hash', 'least_conn']
+
+# a defaultdict that keeps its keys in the order they were added, so that files are written back in the order they
+# were read
+class OrderedDefaultDict(OrderedDict):
+
+    # constructor
+    def __init__(self, factory):
+        super().__init__()
+        self.factory = factory
+
+    # create missing keys like defaultdict does
+    def __missing__(self, key):
+        self[key] = self.factory()
+        return self[key]
 
 class NginxBlock:
 
@@ -33,8 +52,15 @@ class NginxBlock:
         # set the filepath of this block
         self.filePath = filePath
         # set attrs and blocks as 2d dicts
-        self.attrs = defaultdict(dict)
-        self.blocks = defaultdict(dict)
+        self.attrs = OrderedDefaultDict(OrderedDict)
+        self.blocks = OrderedDefaultDict(OrderedDict)
+        # comments within this block, including their #
+        self.comments = []
+        # the order attrs, blocks and comments were read or added in, as ('attr', name), ('block', name) or
+        # ('comment', index) keys
+        self.order = OrderedDict()
+        # whether the last saveFile changed the file
+        self.changed = False
     
     # allow attrs and blocks to be addressable without having to use their relevant dict names
     def __getattr__(self, key):
@@ -59,35 +85,56 @@ class NginxBlock:
             return True
         
         # Clear the dicts
-        self.attrs = defaultdict(dict)
-        self.blocks = defaultdict(dict)
+        self.attrs = OrderedDefaultDict(OrderedDict)
+        self.blocks = OrderedDefaultDict(OrderedDict)
+        self.comments = []
+        self.order = OrderedDict()
         
         # open file
-        f = open(self.filePath, 'r')
-        
-        # parse it
-        return self.parse(f.read(), 0)
+        with open(self.filePath, 'r') as f:
+            # parse it
+            return self.parse(f.read(), 0)
     
-    # saves the output of toString to file
+    # saves the output of write to file
     def saveFile(self, deleteEmpty = True):
         # sanity check
         if (self.filePath is None):
             return False
         
-        # open file
-        f = open(self.filePath, 'w')
+        writer = ConfigWriter(self.filePath)
+        self.changed = False
         
-        data = self.toString()
-        
-        # if self.tostring is length of 0 then delete the file
-        if (len(data) > 0) or (not deleteEmpty):
-            # save the data
-            return f.write(data)
+        # if there is nothing to write then delete the file
+        if (self.isEmpty()) and (deleteEmpty):
+            result = writer.remove()
         else:
-            # delete it
-            os.remove(self.filePath)
-            
-            return True
+            # write straight to the file, replacing it only if it changed
+            try:
+                with writer as f:
+                    self.write(f)
+                result = True
+            except OSError:
+                result = False
+        
+        self.changed = writer.changed
+        
+        return result
+    
+    # checks whether this block would produce any output
+    def isEmpty(self):
+        if (len(self.comments) > 0):
+            return False
+        
+        # names can be left with no values once their values are deleted
+        for values in self.attrs.values():
+            if (len(values) > 0):
+                return False
+        
+        for blocks in self.blocks.values():
+            if (len(blocks) > 0):
+                return False
+        
+        return True
     
     # adds an attribute
     def addAttr(self, name, value = None):
@@ -99,6 +146,8 @@ class NginxBlock:
         if (value in self.attrs[name].values()):
             return True
         
+        self.order[('attr', name)] = None
+
         # use a number as a key
         index = len(self.attrs[name])
 
@@ -115,7 +164,7 @@ class NginxBlock:
         if (len(name) == 0):
             return False
         
-        newDict = {}
+        newDict = OrderedDict()
         
         # loop over attrs
         for key, element in self.attrs[name].items():
@@ -141,6 +190,8 @@ class NginxBlock:
             # create a new block
             block = NginxBlock(name, value)
 
+        self.order[('block', name)] = None
+
         # check if a value was set
         if (value is None) or (len(value) == 0):
             # use a number as a key
@@ -158,125 +209,87 @@ class NginxBlock:
 
     # converts this object back into a config file
     def toString(self, depth = 0):
+        output = io.StringIO()
+        self.write(output, depth)
+        
+        return output.getvalue()
+    
+    # writes this object as a config file to a stream
+    def write(self, stream, depth = 0):
         # set the required indent for this level
-        blockIndent = 4 * depth
-        attrIndent = 4 * depth
+        blockIndent = ' ' * (4 * depth)
+        attrIndent = blockIndent
         
-        # sort the attrs and blocks by key for predictable output
-        sortedAttrs = OrderedDict(sorted(self.attrs.items(), key=lambda t: t[0]))
-        sortedBlocks = OrderedDict(sorted(self.blocks.items(), key=lambda t: t[0]))
-
-        string = ''
         # print the name if set
         if (self.name is not None):
-            line = self.name + " "
+            stream.write(blockIndent + self.name + " ")
             # add the value if its present
             if (self.value is not None):
-                line = line + self.value + " "
-        
-            string = string + line.rjust(blockIndent + len(line)) + "{\n"
-            attrIndent += 4
+                stream.write(self.value + " ")
+            stream.write("{\n")
+            
+            attrIndent += '    '
         else:
             # no name (root object), decrement the depth for better formatting
             depth -= 1
         
-        # print attrs
-        for row in sortedAttrs:
-            for val in sortedAttrs[row]:
-                # format the line first
-                line = row
-                if (sortedAttrs[row][val] is not None):
-                    line += " " + sortedAttrs[row][val]
-                
-                # add it to our string
-                string = string + line.rjust(attrIndent + len(line)) + ";\n"
+        # print the attrs nginx needs first
+        for name in LEADING_ATTRS:
+            if (name in self.attrs):
+                self.writeAttr(stream, attrIndent, name)
+        
+        # then everything else in the order it was read or added. attrs and blocks assigned to directly go last
+        entries = list(self.order.keys())
+        entries.extend(('attr', name) for name in self.attrs.keys() if (('attr', name) not in self.order))
+        entries.extend(('block', name) for name in self.blocks.keys() if (('block', name) not in self.order))
+        
+        for entryType, key in entries:
+            if (entryType == 'comment'):
+                stream.write(attrIndent + self.comments[key] + "\n")
+            elif (entryType == 'attr'):
+                if (key not in LEADING_ATTRS):
+                    self.writeAttr(stream, attrIndent, key)
+            else:
+                for block in self.blocks.get(key, {}).values():
+                    # recursively print out the blocks
+                    block.write(stream, depth + 1)
+                    stream.write("\n")
         
-        # print blocks
-        for row in sortedBlocks:
-            for val in sortedBlocks[row]:
-                # recursively print out the blocks
-                string = string + sortedBlocks[row][val].toString(depth + 1) + "\n"
-
         # append a final curly brace if a name was set
         if (self.name is not None):
-            string = string + "}".rjust(blockIndent + 1)
-
-        return string
-
-    # parses an nginx config file recursively
+            stream.write(blockIndent + "}")
+    
+    # writes each value of an attr to a stream
+    def writeAttr(self, stream, indent, name):
+        for value in self.attrs.get(name, {}).values():
+            if (value is not None):
+                stream.write(indent + name + " " + value + ";\n")
+            else:
+                stream.write(indent + name + ";\n")
+    
+    # parses an nginx config string
     def parse(self, string, depth = 0):
-        # set some variables for this run
-        numBlocks = 0
-        thisBlock = ''
-        blockName = ''
-        blockValue = ''
+        try:
+            tree = NginxParser().parse(string)
+        except NginxSyntaxError:
+            return False
         
-        # loop over the lines
-        for line in string.splitlines():
-            
-            # clean up the line
-            # remove any comments
-            line = line.split('#', 1)[0]
-            # clean up whitespace
-            line = line.strip()
-            
-            # check for close curly brace
-            if (re.match('^}$', line) is not None):
-                numBlocks -= 1
-
-            # matches first block in the string
-            if (numBlocks == 0) and (re.match('^.+{$', line) is not None):
-                # strip off the curly brace
-                tmp = line.rstrip('{')
-                tmp = tmp.strip()
-                
-                # check if its a key or a key value pair
-                if (re.search(r"\s", tmp)): 
-                    # key value
-                    blockName = tmp.split(' ', 1)[0].strip()
-                    blockValue = tmp.split(' ', 1)[1].strip()
-                else:
-                    # key only
-                    blockName = line.split(' ')[0].strip()
-
-            # add to our block if it wasnt the start block or end block
-            if (numBlocks > 0) and (len(line) > 0):
-                thisBlock += line + "\n"
-            
-            # start of a block
-            if (re.match('^.+{$', line) is not None):
-                numBlocks += 1
-            
-            # matches key values/attrs for this object
-            if (re.match('^\w.+\s.+\w.+$', line) is not None) and (numBlocks == 0):
-                # clean up the string
-                line = line.rstrip(';')
-                line = line.strip()
-                
-                # squash spaces
-                line = re.sub( '\s+', ' ', line)
-                
-                # add it
-                self.addAttr(line.split(' ', 1)[0].strip(), line.split(' ', 1)[1].strip())
-            
-            # if this is a closing curly brace and we're at level 0 then form the object
-            if (re.match('^}$', line) is not None) and (numBlocks == 0):
+        self.loadTree(tree)
+        
+        return True
+    
+    # populates this object from a node parsed by NginxParser
+    def loadTree(self, node):
+        for child in node.children:
+            if (isinstance(child, NginxComment)):
+                self.order[('comment', len(self.comments))] = None
+                self.comments.append(child.text)
+            elif (child.children is None):
+                self.addAttr(child.name, child.value())
+            else:
                 # create a new block and set its name and value
-                block = NginxBlock()
-                
-                # set its name and value
-                block.name = blockName
-                if (len(blockValue) > 0):
-                    block.value = blockValue
-                
-                # parse this block
-                block.parse(thisBlock, (depth + 1))
+                block = NginxBlock(child.name, child.value())
+                block.loadTree(child)
                 
                 # add it to our 2d dict
-                self.addBlock(blockName, blockValue, block)
-                
-                # reset values and continue processing
-                thisBlock=''
-                blockName = ''
-                blockValue = ''
-        return True
\ No newline at end of file
+                self.addBlock(child.name, child.value(), block)
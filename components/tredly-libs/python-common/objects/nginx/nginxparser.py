@@ -0,0 +1,117 @@
+# Parses nginx config into a tree of nodes in a single pass
+#
+# The tokenizer walks the string once with a single regex, and the parser builds the tree as the tokens arrive using
+# a stack of open blocks, so no part of the string is read more than once. Words are kept exactly as written,
+# including any quotes, and comments are kept as nodes.
+import re
+
+# one alternative per token type, tried at the current position. a word is any run of quoted strings, escaped
+# characters, ${variables} and characters that dont end a word. a # only starts a comment at the start of a token
+TOKEN_REGEX = re.compile(r'''
+      (?P<space>\s+)
+    | (?P<comment>\#[^\n]*)
+    | (?P<open>\{)
+    | (?P<close>\})
+    | (?P<semicolon>;)
+    | (?P<word>(?:"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*'|\$\{[^}]*\}|\\.|[^\s{};"'\\])+)
+''', re.VERBOSE | re.DOTALL)
+
+# raised when the config cant be parsed
+class NginxSyntaxError(Exception):
+    pass
+
+# a directive, or a block when it has children
+class NginxNode:
+    __slots__ = ('name', 'args', 'children', 'line')
+
+    def __init__(self, name, args, children = None, line = 0):
+        self.name = name            # the directive name, None for the root of a file
+        self.args = args            # list of words following the name
+        self.children = children    # list of child nodes, None if this isnt a block
+        self.line = line            # line number the directive starts on
+
+    # the args as nginx would display them
+    def value(self):
+        if (len(self.args) == 0):
+            return None
+
+        return ' '.join(self.args)
+
+# a comment, including its #
+class NginxComment:
+    __slots__ = ('text', 'line')
+
+    def __init__(self, text, line = 0):
+        self.text = text
+        self.line = line
+
+class NginxParser:
+
+    # splits a string into (type, text, line) tuples, skipping whitespace
+    def tokenize(self, string):
+        position = 0
+        line = 1
+        length = len(string)
+
+        while (position < length):
+            match = TOKEN_REGEX.match(string, position)
+
+            if (match is None):
+                raise NginxSyntaxError("Unexpected " + repr(string[position]) + " on line " + str(line))
+
+            text = match.group()
+
+            if (match.lastgroup != 'space'):
+                yield (match.lastgroup, text, line)
+
+            line += text.count('\n')
+            position = match.end()
+
+    # parses a string into a tree, returning the root node
+    def parse(self, string):
+        root = NginxNode(None, [], [])
+
+        # the blocks that are open, innermost last
+        stack = [root]
+        # the words of the directive being read
+        words = []
+        wordsLine = 0
+
+        for tokenType, text, line in self.tokenize(string):
+            if (tokenType == 'word'):
+                if (len(words) == 0):
+                    wordsLine = line
+                words.append(text)
+
+            elif (tokenType == 'semicolon'):
+                # ignore stray semicolons
+                if (len(words) > 0):
+                    stack[-1].children.append(NginxNode(words[0], words[1:], None, wordsLine))
+                    words = []
+
+            elif (tokenType == 'open'):
+                if (len(words) == 0):
+                    raise NginxSyntaxError("Block without a name on line " + str(line))
+
+                block = NginxNode(words[0], words[1:], [], wordsLine)
+                stack[-1].children.append(block)
+                stack.append(block)
+                words = []
+
+            elif (tokenType == 'close'):
+                if (len(words) > 0):
+                    raise NginxSyntaxError("Missing ; after " + words[0] + " on line " + str(wordsLine))
+                if (len(stack) == 1):
+                    raise NginxSyntaxError("Unexpected } on line " + str(line))
+
+                stack.pop()
+
+            elif (tokenType == 'comment'):
+                stack[-1].children.append(NginxComment(text, line))
+
+        if (len(words) > 0):
+            raise NginxSyntaxError("Missing ; after " + words[0] + " on line " + str(wordsLine))
+        if (len(stack) > 1):
+            raise NginxSyntaxError("Missing } for " + stack[-1].name + " on line " + str(stack[-1].line))
+
+        return root
@@ -0,0 +1,372 @@
+# A class to cache containers part way through their onCreate commands
+#
+# Each prefix of a container's onCreate commands is identified by a key - a hash of the release and the commands up to
+# that point, including the contents of any fileFolderMapping sources. After each command the container is snapshotted
+# and the snapshot received into the cache, named by its key. Later builds are cloned from the longest prefix of their
+# onCreate commands that is cached and only run the commands after it.
+#
+# Snapshots of consecutive commands are appended to the same cache dataset with incremental streams, so each command
+# only costs the blocks it changed. When the cache grows past its quota the least recently used snapshots are destroyed,
+# except those that containers are still cloned from.
+import os
+import stat
+import json
+import time
+import fcntl
+import hashlib
+from subprocess import Popen, PIPE
+
+from objects.zfs.zfs import ZFSDataset
+from objects.tredly.containertemplate import getReleaseGuid
+from includes.defines import *
+from includes.output import *
+
+# snapshot property holding the time the snapshot was last stored or cloned from
+BUILD_CACHE_LASTUSED = ZFS_PROP_ROOT + ":buildcache_lastused"
+# bytes read at a time when hashing fileFolderMapping sources
+BUILD_CACHE_HASH_READ_SIZE = 1048576
+
+class BuildCache:
+
+    # Constructor
+    def __init__(self, releaseName, quota):
+        self.releaseName = releaseName
+        self.quota = quota                  # megabytes of disk the cache may use. 0 disables the cache
+        self.keys = []                      # the key of the onCreate commands up to and including each command
+        self.lastSnapshot = None            # full name of the cache snapshot matching the container's current state
+        self.containerSnapshot = None       # name of the snapshot last taken of the container
+
+        # a changed or re-fetched release or container skeleton invalidates everything built on it
+        self.hash = hashlib.sha256((releaseName + "\n" + str(getReleaseGuid(releaseName)) + "\n" + str(CONTAINER_TEMPLATE_VERSION) + "\n").encode('utf-8'))
+
+    # Action: check whether the cache is in use
+    #
+    # Pre:
+    # Post:
+    #
+    # Params:
+    #
+    # Return: True if enabled, False otherwise
+    def isEnabled(self):
+        return (self.quota > 0)
+
+    # Action: add the next onCreate command to the keys
+    #
+    # Pre:
+    # Post: the key for the commands so far has been appended to self.keys
+    #
+    # Params: createCmd - the onCreate command
+    #         sourcePath - the path on the host that a fileFolderMapping copies from, None for other commands
+    #
+    # Return:
+    def addStep(self, createCmd, sourcePath = None):
+        self.hash.update((json.dumps(createCmd, sort_keys=True) + "\n").encode('utf-8'))
+
+        if (sourcePath is not None):
+            self.__hashPath(sourcePath)
+
+        self.keys.append(self.hash.hexdigest())
+
+    # Action: create a container dataset as a clone of the longest cached prefix of its onCreate commands
+    #
+    # Pre: all steps have been added
+    # Post: dataset has been cloned and mounted if a prefix was cached
+    #
+    # Params: dataset - the container's dataset
+    #         mountPoint - the container's mountpoint
+    #
+    # Return: the number of onCreate commands the clone already has, 0 if nothing was cloned
+    def clone(self, dataset, mountPoint):
+        if (not self.isEnabled()):
+            return 0
+
+        # hold the lock so the snapshot cant be evicted before it has been cloned
+        with self.__lock():
+            snapshots = self.__getSnapshots()
+
+            for steps in range(len(self.keys), 0, -1):
+                snapshot = snapshots.get(self.keys[steps - 1])
+
+                if (snapshot is None):
+                    continue
+
+                cacheDataset, snapshotName = snapshot.split('@', 1)
+
+                if (not ZFSDataset(cacheDataset).cloneSnapshot(snapshotName, dataset, mountPoint)):
+                    e_warning("Failed to clone build cache snapshot " + snapshot)
+                    return 0
+
+                ZFSDataset(dataset, mountPoint).mount()
+                self.__touch(snapshot)
+                self.lastSnapshot = snapshot
+
+                return steps
+
+        return 0
+
+    # Action: add a container to the cache as it is after some of its onCreate commands
+    #
+    # Pre: the first steps onCreate commands have been run successfully within the container
+    # Post: the container has been snapshotted and the snapshot received into the cache
+    #
+    # Params: dataset - the container's dataset
+    #         steps - the number of onCreate commands that have been run
+    #
+    # Return: True if succeeded, False otherwise
+    def store(self, dataset, steps):
+        key = self.keys[steps - 1]
+        zfsContainer = ZFSDataset(dataset)
+
+        if (not zfsContainer.takeSnapshot(key)):
+            e_warning("Failed to snapshot container for the build cache")
+            return False
+
+        stored = False
+
+        with self.__lock():
+            # append to the cache dataset holding the container's previous state if nothing else has been added to it
+            if (self.lastSnapshot is not None):
+                cacheDataset = self.lastSnapshot.split('@', 1)[0]
+
+                if (self.__getLatestSnapshot(cacheDataset) == self.lastSnapshot):
+                    if (self.containerSnapshot is None):
+                        # the container is a clone of the last snapshot
+                        fromSnapshot = self.lastSnapshot
+                    else:
+                        fromSnapshot = dataset + '@' + self.containerSnapshot
+
+                    stored = zfsContainer.sendSnapshot(key, cacheDataset, fromSnapshot)
+
+            # otherwise start a new cache dataset with a full copy
+            if (not stored):
+                cacheDataset = ZFS_TREDLY_BUILDCACHE_DATASET + '/' + key
+
+                # the cache datasets are never mounted
+                ZFSDataset(ZFS_TREDLY_BUILDCACHE_DATASET, 'none').create()
+
+                stored = zfsContainer.sendSnapshot(key, cacheDataset)
+
+            if (stored):
+                self.lastSnapshot = cacheDataset + '@' + key
+                self.__touch(self.lastSnapshot)
+            else:
+                self.lastSnapshot = None
+
+        # only the latest snapshot is needed to send the next one from
+        if (self.containerSnapshot is not None):
+            zfsContainer.destroySnapshot(self.containerSnapshot)
+        self.containerSnapshot = key
+
+        if (not stored):
+            e_warning("Failed to add container to the build cache")
+
+        return stored
+
+    # Action: tidy up once a container's onCreate commands have finished
+    #
+    # Pre:
+    # Post: the container's build cache snapshot has been destroyed and the cache evicted down to its quota
+    #
+    # Params: dataset - the container's dataset
+    #
+    # Return: True if succeeded, False otherwise
+    def finish(self, dataset):
+        if (self.containerSnapshot is not None):
+            ZFSDataset(dataset).destroySnapshot(self.containerSnapshot)
+            self.containerSnapshot = None
+
+        return self.evict()
+
+    # Action: destroy the least recently used snapshots until the cache fits within its quota
+    #
+    # Pre:
+    # Post: the cache uses no more than its quota, unless the remaining snapshots have clones
+    #
+    # Params:
+    #
+    # Return: True if the cache fits within its quota, False otherwise
+    def evict(self):
+        quotaBytes = self.quota * 1024 * 1024
+
+        with self.__lock():
+            used = self.__getUsed()
+
+            if (used is None) or (used <= quotaBytes):
+                return True
+
+            # name, clones, last used
+            cmd = ['zfs', 'list', '-H', '-p', '-r', '-t', 'snapshot', '-o', 'name,clones,' + BUILD_CACHE_LASTUSED, ZFS_TREDLY_BUILDCACHE_DATASET]
+            process = Popen(cmd, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+            stdOut, stdErr = process.communicate()
+
+            snapshots = []
+            for line in stdOut.decode(encoding='UTF-8', errors='replace').splitlines():
+                lineParts = line.split('\t')
+                if (len(lineParts) < 3):
+                    continue
+
+                # snapshots with clones are in use by containers
+                if (lineParts[1] not in ['', '-']):
+                    continue
+
+                if (lineParts[2].isdigit()):
+                    lastUsed = int(lineParts[2])
+                else:
+                    lastUsed = 0
+
+                snapshots.append((lastUsed, lineParts[0]))
+
+            for lastUsed, snapshot in sorted(snapshots):
+                cacheDataset, snapshotName = snapshot.split('@', 1)
+                ZFSDataset(cacheDataset).destroySnapshot(snapshotName)
+
+                # destroy the dataset along with its last snapshot
+                if (self.__getLatestSnapshot(cacheDataset) is None):
+                    ZFSDataset(cacheDataset).destroy()
+
+                used = self.__getUsed()
+                if (used is None) or (used <= quotaBytes):
+                    return True
+
+        e_warning("Build cache is larger than its quota of " + str(self.quota) + "MB as its remaining entries are in use")
+        return False
+
+    # Action: get the snapshots in the cache
+    #
+    # Pre:
+    # Post:
+    #
+    # Params:
+    #
+    # Return: dict of key -> full snapshot name
+    def __getSnapshots(self):
+        cmd = ['zfs', 'list', '-H', '-r', '-t', 'snapshot', '-o', 'name', ZFS_TREDLY_BUILDCACHE_DATASET]
+        process = Popen(cmd, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        stdOut, stdErr = process.communicate()
+
+        snapshots = {}
+        for line in stdOut.decode(encoding='UTF-8', errors='replace').splitlines():
+            if ('@' in line):
+                snapshots[line.split('@', 1)[1]] = line
+
+        return snapshots
+
+    # Action: get the most recent snapshot of a cache dataset
+    #
+    # Pre:
+    # Post:
+    #
+    # Params: cacheDataset - the dataset within the cache
+    #
+    # Return: full snapshot name, or None if it has none
+    def __getLatestSnapshot(self, cacheDataset):
+        cmd = ['zfs', 'list', '-H', '-d', '1', '-t', 'snapshot', '-s', 'createtxg', '-o', 'name', cacheDataset]
+        process = Popen(cmd, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        stdOut, stdErr = process.communicate()
+
+        lines = stdOut.decode(encoding='UTF-8', errors='replace').splitlines()
+
+        if (process.returncode != 0) or (len(lines) == 0):
+            return None
+
+        return lines[-1]
+
+    # Action: get the disk space used by the cache
+    #
+    # Pre:
+    # Post:
+    #
+    # Params:
+    #
+    # Return: bytes, or None if the cache doesnt exist
+    def __getUsed(self):
+        # the default output is human readable, so ask for the exact value
+        cmd = ['zfs', 'get', '-H', '-p', '-o', 'value', 'used', ZFS_TREDLY_BUILDCACHE_DATASET]
+        process = Popen(cmd, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        stdOut, stdErr = process.communicate()
+
+        used = stdOut.decode(encoding='UTF-8').strip()
+
+        if (process.returncode != 0) or (not used.isdigit()):
+            return None
+
+        return int(used)
+
+    # Action: mark a snapshot as used
+    #
+    # Pre: snapshot exists
+    # Post: its last used time has been set to now
+    #
+    # Params: snapshot - full name of the snapshot
+    #
+    # Return: True if succeeded, False otherwise
+    def __touch(self, snapshot):
+        return ZFSDataset(snapshot).setProperty(BUILD_CACHE_LASTUSED, str(int(time.time())))
+
+    # Action: add the contents of a file or directory to the hash
+    #
+    # Pre:
+    # Post: names, types, modes and contents have been hashed
+    #
+    # Params: path - the file or directory on the host
+    #
+    # Return:
+    def __hashPath(self, path):
+        if (not os.path.isdir(path)) or (os.path.islink(path)):
+            self.__hashEntry(path, '.')
+            return
+
+        for root, dirs, files in os.walk(path):
+            # walk in a fixed order so the same tree always gives the same hash
+            dirs.sort()
+
+            for name in sorted(dirs + files):
+                fullPath = os.path.join(root, name)
+                self.__hashEntry(fullPath, os.path.relpath(fullPath, path))
+
+    # Action: add a single file, directory or link to the hash
+    #
+    # Pre:
+    # Post: name, type, mode and contents have been hashed
+    #
+    # Params: fullPath - the path on the host
+    #         name - the path relative to the mapping's source
+    #
+    # Return:
+    def __hashEntry(self, fullPath, name):
+        try:
+            st = os.lstat(fullPath)
+        except OSError:
+            self.hash.update(("missing " + name + "\n").encode('utf-8', errors='surrogateescape'))
+            return
+
+        self.hash.update((name + " " + oct(st.st_mode) + "\n").encode('utf-8', errors='surrogateescape'))
+
+        if (stat.S_ISLNK(st.st_mode)):
+            self.hash.update((os.readlink(fullPath) + "\n").encode('utf-8', errors='surrogateescape'))
+        elif (stat.S_ISREG(st.st_mode)):
+            with open(fullPath, 'rb') as f:
+                while True:
+                    chunk = f.read(BUILD_CACHE_HASH_READ_SIZE)
+                    if (len(chunk) == 0):
+                        break
+                    self.hash.update(chunk)
+
+            # separate the contents from the next entry
+            self.hash.update(("\n" + str(st.st_size) + "\n").encode('utf-8'))
+
+    # Action: get a lock on the cache, shared with other processes
+    #
+    # Pre:
+    # Post:
+    #
+    # Params:
+    #
+    # Return: open lock file, to be used as a context manager
+    def __lock(self):
+        os.makedirs(os.path.dirname(BUILD_CACHE_LOCK), exist_ok=True)
+
+        lockFile = open(BUILD_CACHE_LOCK, 'w')
+        fcntl.flock(lockFile, fcntl.LOCK_EX)
+
+        return lockFile
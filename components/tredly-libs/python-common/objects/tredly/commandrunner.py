@@ -0,0 +1,182 @@
+# A class to run commands, streaming their output to a log file as it is produced
+#
+# stdout and stderr are read from a pipe in fixed size chunks and appended to the log, with only the last few lines
+# kept in memory to show the user if the command fails. Daemons started by a command (eg "service postgresql start")
+# keep the pipe open after the command exits, so once it has exited only what is already in the pipe is read.
+# Each command's duration and exit status are written to the log and kept in self.results.
+import os
+import time
+import signal
+import selectors
+from collections import deque
+from subprocess import Popen, DEVNULL, STDOUT, PIPE
+
+from includes.output import *
+
+# bytes read from the pipe at a time, and the longest line kept before it is split
+CMD_READ_SIZE = 65536
+# lines of output kept in memory for error messages
+CMD_TAIL_LINES = 100
+# seconds to keep reading output that is already in the pipe once the command has exited
+CMD_DRAIN_TIME = 1
+
+class CommandRunner:
+
+    # Constructor
+    def __init__(self, logPath = None, timeout = None):
+        self.logPath = logPath          # file to append output to, None to not log
+        self.timeout = timeout          # seconds before a command is killed, None for no limit
+        self.results = []               # list of dicts with command, returnCode, timedOut and duration
+        self.tail = deque(maxlen=CMD_TAIL_LINES)    # the last lines of output from the last command
+
+    # Action: run a command
+    #
+    # Pre:
+    # Post: command has been run, its output logged and its result appended to self.results
+    #
+    # Params: cmd - list of arguments
+    #         description - how to describe the command in the log, defaults to the arguments
+    #
+    # Return: dict with command, returnCode, timedOut and duration
+    def run(self, cmd, description = None):
+        if (description is None):
+            description = ' '.join(cmd)
+
+        self.tail.clear()
+
+        logFile = None
+        if (self.logPath is not None):
+            try:
+                logFile = open(self.logPath, 'ab')
+                logFile.write(("==> " + time.strftime('%Y-%m-%d %H:%M:%S %z') + " " + description + "\n").encode('utf-8'))
+            except OSError as e:
+                e_warning("Could not write to " + self.logPath + ": " + str(e))
+                if (logFile is not None):
+                    logFile.close()
+                logFile = None
+
+        try:
+            startTime = time.time()
+
+            try:
+                # run in its own session so that anything it starts can be killed on timeout
+                process = Popen(cmd, stdin=DEVNULL, stdout=PIPE, stderr=STDOUT, start_new_session=True)
+            except OSError as e:
+                # eg the command doesnt exist, so fail with the status the shell would give
+                self.tail.append(str(e))
+                if (logFile is not None):
+                    logFile.write((str(e) + "\n").encode('utf-8'))
+
+                returnCode = 127
+                timedOut = False
+            else:
+                returnCode, timedOut = self.__readOutput(process, logFile, startTime)
+
+            result = {
+                'command': description,
+                'returnCode': returnCode,
+                'timedOut': timedOut,
+                'duration': time.time() - startTime
+            }
+            self.results.append(result)
+
+            if (logFile is not None):
+                if (timedOut):
+                    status = "timed out"
+                else:
+                    status = "exit status " + str(returnCode)
+
+                logFile.write(("<== " + status + " after " + "{:.2f}".format(result['duration']) + "s\n").encode('utf-8'))
+        finally:
+            if (logFile is not None):
+                logFile.close()
+
+        return result
+
+    # Action: read a command's output until it exits
+    #
+    # Pre: process has been started with its output on a pipe
+    # Post: output has been appended to the log and its last lines kept in self.tail
+    #
+    # Params: process - the Popen object of the command
+    #         logFile - the log opened for appending, or None
+    #         startTime - when the command was started, for the timeout
+    #
+    # Return: tuple of the command's exit status and whether it timed out
+    def __readOutput(self, process, logFile, startTime):
+        timedOut = False
+        partial = b''
+        exitTime = None
+
+        selector = selectors.DefaultSelector()
+        selector.register(process.stdout, selectors.EVENT_READ)
+
+        try:
+            while True:
+                now = time.time()
+
+                # kill it if it has run for too long
+                if (self.timeout is not None) and (exitTime is None) and (now - startTime > self.timeout):
+                    timedOut = True
+                    self.__kill(process)
+
+                if (exitTime is None) and (process.poll() is not None):
+                    exitTime = now
+
+                # stop once the command has exited and the pipe has been drained, or something it started is
+                # holding the pipe open
+                if (exitTime is not None) and (now - exitTime > CMD_DRAIN_TIME):
+                    break
+
+                if (len(selector.select(0.1)) == 0):
+                    continue
+
+                chunk = os.read(process.stdout.fileno(), CMD_READ_SIZE)
+
+                # end of output
+                if (len(chunk) == 0):
+                    if (exitTime is None):
+                        process.wait()
+                    break
+
+                if (logFile is not None):
+                    logFile.write(chunk)
+                    logFile.flush()
+
+                # keep the last lines for error messages, splitting overly long lines so memory use is bounded
+                lines = (partial + chunk).split(b'\n')
+                partial = lines.pop()
+                if (len(partial) > CMD_READ_SIZE):
+                    lines.append(partial)
+                    partial = b''
+
+                for line in lines:
+                    self.tail.append(line.decode('utf-8', errors='replace'))
+        finally:
+            selector.close()
+            process.stdout.close()
+
+        if (len(partial) > 0):
+            self.tail.append(partial.decode('utf-8', errors='replace'))
+
+            # make sure the log's footer starts on its own line
+            if (logFile is not None):
+                logFile.write(b"\n")
+
+        return (process.returncode, timedOut)
+
+    # Action: kill a command and everything it started
+    #
+    # Pre:
+    # Post: the command's process group has been killed
+    #
+    # Params: process - the Popen object of the command
+    #
+    # Return:
+    def __kill(self, process):
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            process.kill()
+
+        process.wait()
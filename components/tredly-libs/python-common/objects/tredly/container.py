@@ -8,6 +8,8 @@ from pprint import pprint
 import shutil
 from subprocess import Popen, PIPE
 import shlex
+import threading
+import fcntl
 from includes.util import *
 from includes.defines import *
 from includes.output import *
@@ -16,15 +18,26 @@ import io
 
 from objects.zfs.zfs import ZFSDataset
 from objects.ip4.netinterface import NetInterface
+from objects.ip4.networkscript import NetworkScript
+from objects.ip4.epairpool import EpairPool
 from objects.firewall.ipfw import IPFW
 from objects.nginx.nginxblock import NginxBlock
 from objects.nginx.layer7proxy import *
 from objects.tredly.unboundfile import *
+from objects.tredly.unboundcontrol import UnboundControl
 from objects.config.configfile import ConfigFile
 from objects.layer4proxy.layer4proxyfile import *
 from objects.tredly.tredlyhost import TredlyHost
+from objects.tredly.containermeta import ContainerMeta
+from objects.tredly.containertemplate import ContainerTemplate
+from objects.tredly.commandrunner import CommandRunner
+from objects.tredly.buildcache import BuildCache
+from objects.tredly.filecopier import FileCopier
 
 class Container:
+    # held while changing host wide config (dns, proxies, host and containergroup firewalls) so that containers
+    # can be started in parallel
+    hostLock = threading.RLock()
 
     # Constructor
     def __init__(self, partitionName = "default", releaseName = None):
@@ -119,6 +132,9 @@ class Container:
 
         self.hostInterface = None
         self.containerInterfaces = []
+        self.commandResults = []           # results of commands run with runCmd, see CommandRunner
+        self.buildCache = None             # BuildCache for this container's onCreate commands
+        self.dnsUpdates = UnboundControl() # dns changes made by the current start/stop, to apply to unbound
 
     # Action: populate this object with data from a tredlyfile
     #
@@ -413,10 +429,7 @@ class Container:
         # make sure all sources for fileFolderMapping exist
         for createCmd in self.onCreate:
             if (createCmd['type'] == "fileFolderMapping"):
-                if (re.match('^partition/', createCmd['source'])):
-                    source = TREDLY_PARTITIONS_MOUNT + "/" + self.partitionName + "/" + TREDLY_PTN_DATA_DIR_NAME + "/" + createCmd['source'].split('/', 1)[-1].rstrip()
-                else:
-                    source = builtins.tredlyFile.fileLocation.rstrip('/') + '/' + createCmd['source']
+                source = self.getFileFolderMappingSource(createCmd)
 
                 # check that the source exists
                 if (not os.path.exists(source)):
@@ -450,56 +463,32 @@ class Container:
         # create container dataset
         zfsContainer = ZFSDataset(self.dataset, self.mountPoint)
 
-        # create the dataset
-        if (not zfsContainer.create()):
-            print("Failed to create container dataset " + self.dataset)
-            return False
-
-        # mount it
-        zfsContainer.mount()
-
-        zfsContainer.setProperty(ZFS_PROP_ROOT + ":buildepoch", str(self.buildEpoch))
-
-        # create log dir within container
-        cmd = ['mkdir', '-p', self.mountPoint + "/" + TREDLY_CONTAINER_LOG_DIR]
-        process = Popen(cmd,  stdin=PIPE, stdout=PIPE, stderr=PIPE)
-        stdOut, stdErr = process.communicate()
-        if (process.returncode != 0):
-            e_error("Failed to create container log directory ")
+        # clone the container as it was part way through its onCreate commands from an earlier build if we can
+        self.buildCache = self.getBuildCache()
+        cachedSteps = self.buildCache.clone(self.dataset, self.mountPoint)
 
-        # combine lists of directories to create
-        createDirs = CONTAINER_CREATE_DIRS + CONTAINER_BASEDIRS
+        # otherwise clone the skeleton from the release's template, building the template first if needed
+        template = ContainerTemplate(self.releaseName)
 
-        # set up some default directories
-        for dir in createDirs:
-            process = Popen(['mkdir', '-p', self.mountPoint + "/root" + dir],  stdin=PIPE, stdout=PIPE, stderr=PIPE)
-            stdOut, stdErr = process.communicate()
-            rc = process.returncode
-            if (rc != 0):
-                e_error("Failed to create container directory " + dir)
+        if (cachedSteps > 0):
+            e_note("Cloned from build cache, skipping the first " + str(cachedSteps) + " onCreate commands")
+        elif (not template.prepare()) or (not template.clone(self.dataset, self.mountPoint)):
+            e_warning("Could not clone container template, creating container from release")
 
-        # and touch some files
-        for file in CONTAINER_CREATE_FILES:
-            cmd = ['touch', self.mountPoint + "/root" + file]
-            process = Popen(cmd,  stdin=PIPE, stdout=PIPE, stderr=PIPE)
-            stdOut, stdErr = process.communicate()
-            rc = process.returncode
-            if (rc != 0):
-                e_error("Failed to create container file " + file)
+            # create the dataset
+            if (not zfsContainer.create()):
+                print("Failed to create container dataset " + self.dataset)
+                return False
 
-        # copy in some useful directories from the release
-        for dir in CONTAINER_COPY_DIRS:
-            cmd1 = ['find', "."]
-            findCmd = Popen(cmd1, cwd=TREDLY_RELEASES_MOUNT + "/" + self.releaseName + "/root" + dir, stdout=PIPE)
+            # mount it
+            zfsContainer.mount()
 
-            cmd2= ['cpio', '-dp', '--quiet', self.mountPoint + "/root" + dir]
-            cpioCmd = Popen(cmd2, cwd=TREDLY_RELEASES_MOUNT + "/" + self.releaseName + "/root" + dir, stdin=findCmd.stdout, stdout=PIPE)
-            findCmd.stdout.close()
-            stdOut, stdErr = cpioCmd.communicate()
-            findCmd.wait()
+            # create the default directories and files and copy in the release directories
+            template.populate(self.mountPoint)
 
-            if (findCmd.returncode != 0) or (cpioCmd.returncode != 0):
-                e_error("Failed to copy container directory " + dir)
+        with zfsContainer:
+            zfsContainer.setProperty(ZFS_PROP_ROOT + ":buildepoch", str(self.buildEpoch))
+            zfsContainer.setProperty(ZFS_PROP_ROOT + ":buildcache_steps", str(cachedSteps))
 
         # copy in some useful files from the host
         for file in CONTAINER_COPY_HOST_FILES:
@@ -541,31 +530,6 @@ class Container:
         # register this objects values in zfs properties
         self.registerInZFS()
 
-        # Update the pkg database
-        e_note("Updating package database")
-        cmd = ['pkg', 'update']
-        process = Popen(cmd,  stdin=PIPE, stdout=PIPE, stderr=PIPE)
-        stdOut, stdErr = process.communicate()
-        if (process.returncode == 0):
-            # errored
-            e_success("Success")
-        else:
-            # Success
-            e_error("Failed")
-            print(stdErr)
-
-        e_note("Updating container's pkg catalogue")
-        cmd = ['cp', '/var/db/pkg/repo-FreeBSD.sqlite', self.mountPoint + "/root/var/db/pkg"]
-        process = Popen(cmd,  stdin=PIPE, stdout=PIPE, stderr=PIPE)
-        stdOut, stdErr = process.communicate()
-        if (process.returncode == 0):
-            # errored
-            e_success("Success")
-        else:
-            # Success
-            e_error("Failed")
-            print(stdErr)
-
         # loop over the urls and set up a set to copy from
         certsToCopy = set() # use a set for unique values
         for url in self.urls:
@@ -609,66 +573,77 @@ class Container:
     # Return: True if succeeded, False otherwise
     def registerInZFS(self):
         # set up ZFS access to container dataset
-        zfsContainer = ZFSDataset(self.dataset, self.mountPoint)
+        zfsContainer = ZFSDataset(self.dataset, self.mountPoint, True)
+
+        # collect everything below and write it in as few zfs transactions as possible
+        zfsContainer.beginBatch()
+
+        # most properties go in the record, written as a single json property. those the bash tools read stay in the
+        # legacy layout
+        meta = ContainerMeta(zfsContainer)
 
         # set some ZFS properties in the container dataset
-        zfsContainer.setProperty(ZFS_PROP_ROOT + ":host_hostuuid", self.uuid)
-        zfsContainer.setProperty(ZFS_PROP_ROOT + ":containername", self.name)
-        zfsContainer.setProperty(ZFS_PROP_ROOT + ":containergroupname", self.group)
-        zfsContainer.setProperty(ZFS_PROP_ROOT + ":partition", self.partitionName)
-        zfsContainer.setProperty(ZFS_PROP_ROOT + ":mountpoint", self.mountPoint)
-        zfsContainer.setProperty(ZFS_PROP_ROOT + ":maxhdd", self.maxHdd)
-        zfsContainer.setProperty(ZFS_PROP_ROOT + ":maxram", self.maxRam)
-        zfsContainer.setProperty(ZFS_PROP_ROOT + ":maxcpu", self.maxCpu)
-        zfsContainer.setProperty(ZFS_PROP_ROOT + ":securelevel", self.securelevel)
-        zfsContainer.setProperty(ZFS_PROP_ROOT + ":devfs_ruleset", self.devfsRuleset)
-        zfsContainer.setProperty(ZFS_PROP_ROOT + ":enforce_statfs", self.enforceStatfs)
-        zfsContainer.setProperty(ZFS_PROP_ROOT + ":children_max", self.childrenMax)
-        zfsContainer.setProperty(ZFS_PROP_ROOT + ":allow_set_hostname", self.allowSetHostname)
-        zfsContainer.setProperty(ZFS_PROP_ROOT + ":allow_sysvipc", self.allowSysvipc)
-        zfsContainer.setProperty(ZFS_PROP_ROOT + ":allow_raw_sockets", self.allowRawSockets)
-        zfsContainer.setProperty(ZFS_PROP_ROOT + ":allow_chflags", self.allowChflags)
-        zfsContainer.setProperty(ZFS_PROP_ROOT + ":allow_mount", self.allowMount)
-        zfsContainer.setProperty(ZFS_PROP_ROOT + ":allow_mount_devfs", self.allowMountDevfs)
-        zfsContainer.setProperty(ZFS_PROP_ROOT + ":allow_mount_nullfs", self.allowMountNullfs)
-        zfsContainer.setProperty(ZFS_PROP_ROOT + ":allow_mount_procfs", self.allowMountProcfs)
-        zfsContainer.setProperty(ZFS_PROP_ROOT + ":allow_mount_tmpfs", self.allowMountTmpfs)
-        zfsContainer.setProperty(ZFS_PROP_ROOT + ":allow_mount_zfs", self.allowMountZfs)
-        zfsContainer.setProperty(ZFS_PROP_ROOT + ":allow_quotas", self.allowQuotas)
-        zfsContainer.setProperty(ZFS_PROP_ROOT + ":allow_socket_af", self.allowSocketAF)
-        zfsContainer.setProperty(ZFS_PROP_ROOT + ":exec_prestart", self.execPrestart)
-        zfsContainer.setProperty(ZFS_PROP_ROOT + ":exec_poststart", self.execPoststart)
-        zfsContainer.setProperty(ZFS_PROP_ROOT + ":exec_prestop", self.execPrestop)
-        zfsContainer.setProperty(ZFS_PROP_ROOT + ":exec_start",self.execStart)
-        zfsContainer.setProperty(ZFS_PROP_ROOT + ":exec_stop", self.execStop)
-        zfsContainer.setProperty(ZFS_PROP_ROOT + ":exec_clean", self.execClean)
-        zfsContainer.setProperty(ZFS_PROP_ROOT + ":exec_timeout", self.execTimeout)
-        zfsContainer.setProperty(ZFS_PROP_ROOT + ":exec_fib", self.execFib)
-        zfsContainer.setProperty(ZFS_PROP_ROOT + ":stop_timeout", self.stopTimeout)
-        zfsContainer.setProperty(ZFS_PROP_ROOT + ":mount_devfs", self.mountDevfs)
-        zfsContainer.setProperty(ZFS_PROP_ROOT + ":mount_fdescfs", self.mountFdescfs)
-        zfsContainer.setProperty(ZFS_PROP_ROOT + ":ip4", self.ip4)
-        zfsContainer.setProperty(ZFS_PROP_ROOT + ":ip4_saddrsel", self.ip4SaddrSel)
-        zfsContainer.setProperty(ZFS_PROP_ROOT + ":domainname", self.domainName)
-        zfsContainer.setProperty(ZFS_PROP_ROOT + ":nginx_accessfile_dir", NGINX_ACCESSFILE_DIR)
-        zfsContainer.setProperty(ZFS_PROP_ROOT + ":nginx_servername_dir", NGINX_SERVERNAME_DIR)
-        zfsContainer.setProperty(ZFS_PROP_ROOT + ":nginx_upstream_dir", NGINX_UPSTREAM_DIR)
-        zfsContainer.setProperty(ZFS_PROP_ROOT + ":releasename", self.releaseName)
+        meta.setProperty("host_hostuuid", self.uuid)
+        meta.setProperty("containername", self.name)
+        meta.setProperty("containergroupname", self.group)
+        meta.setProperty("partition", self.partitionName)
+        meta.setProperty("mountpoint", self.mountPoint)
+        meta.setProperty("maxhdd", self.maxHdd)
+        meta.setProperty("maxram", self.maxRam)
+        meta.setProperty("maxcpu", self.maxCpu)
+        meta.setProperty("securelevel", self.securelevel)
+        meta.setProperty("devfs_ruleset", self.devfsRuleset)
+        meta.setProperty("enforce_statfs", self.enforceStatfs)
+        meta.setProperty("children_max", self.childrenMax)
+        meta.setProperty("allow_set_hostname", self.allowSetHostname)
+        meta.setProperty("allow_sysvipc", self.allowSysvipc)
+        meta.setProperty("allow_raw_sockets", self.allowRawSockets)
+        meta.setProperty("allow_chflags", self.allowChflags)
+        meta.setProperty("allow_mount", self.allowMount)
+        meta.setProperty("allow_mount_devfs", self.allowMountDevfs)
+        meta.setProperty("allow_mount_nullfs", self.allowMountNullfs)
+        meta.setProperty("allow_mount_procfs", self.allowMountProcfs)
+        meta.setProperty("allow_mount_tmpfs", self.allowMountTmpfs)
+        meta.setProperty("allow_mount_zfs", self.allowMountZfs)
+        meta.setProperty("allow_quotas", self.allowQuotas)
+        meta.setProperty("allow_socket_af", self.allowSocketAF)
+        meta.setProperty("exec_prestart", self.execPrestart)
+        meta.setProperty("exec_poststart", self.execPoststart)
+        meta.setProperty("exec_prestop", self.execPrestop)
+        meta.setProperty("exec_start", self.execStart)
+        meta.setProperty("exec_stop", self.execStop)
+        meta.setProperty("exec_clean", self.execClean)
+        meta.setProperty("exec_timeout", self.execTimeout)
+        meta.setProperty("exec_fib", self.execFib)
+        meta.setProperty("stop_timeout", self.stopTimeout)
+        meta.setProperty("mount_devfs", self.mountDevfs)
+        meta.setProperty("mount_fdescfs", self.mountFdescfs)
+        meta.setProperty("ip4", self.ip4)
+        meta.setProperty("ip4_saddrsel", self.ip4SaddrSel)
+        meta.setProperty("domainname", self.domainName)
+        meta.setProperty("nginx_accessfile_dir", NGINX_ACCESSFILE_DIR)
+        meta.setProperty("nginx_servername_dir", NGINX_SERVERNAME_DIR)
+        meta.setProperty("nginx_upstream_dir", NGINX_UPSTREAM_DIR)
+        meta.setProperty("releasename", self.releaseName)
+
+        # used to order bulk starts
+        if (self.startOrder is not None):
+            meta.setProperty("startorder", str(self.startOrder))
 
         # persistent storage
         if (self.persistentStorageID is not None):
-            zfsContainer.setProperty(ZFS_PROP_ROOT + ":persistentstorageid", self.persistentStorageID)
-            zfsContainer.setProperty(ZFS_PROP_ROOT + ":persistentmountpoint", self.persistentMountPoint)
-            zfsContainer.setProperty(ZFS_PROP_ROOT + ":persistentdataset", self.persistentDataset)
+            meta.setProperty("persistentstorageid", self.persistentStorageID)
+            meta.setProperty("persistentmountpoint", self.persistentMountPoint)
+            meta.setProperty("persistentdataset", self.persistentDataset)
 
         # do the ZFS arrays
         for dns in self.dns:
-            zfsContainer.appendArray(ZFS_PROP_ROOT + '.dns', dns)
+            meta.appendArray("dns", dns)
 
         # jsonify the urls individually and append to array
         for url in self.urls:
             # jsonify the url and minify it, then append to zfs array
-            zfsContainer.appendJsonArray(ZFS_PROP_ROOT + ".jsonurls", url)
+            meta.appendJsonArray("jsonurls", url)
 
         # loop over urls and register
         for urlObj in self.urls:
@@ -695,23 +670,27 @@ class Container:
             upstreamFilename = protocol + '-' + nginxFormatFilename(urlObj['url'].rstrip('/'))
 
             # register the URL in ZFS
-            zfsContainer.appendArray(ZFS_PROP_ROOT + ".url", urlObj['url'])
+            meta.appendArray("url", urlObj['url'])
 
                 # if a cert was used then register that too
             if (sslCert is not None):
-                zfsContainer.appendArray(ZFS_PROP_ROOT + ".url_cert", urlObj['cert'].split('/')[-1])
+                meta.appendArray("url_cert", urlObj['cert'].split('/')[-1])
 
             # register the filenames in ZFS for destruction
-            zfsContainer.appendArray(ZFS_PROP_ROOT + ".nginx_upstream", upstreamFilename)
-            zfsContainer.appendArray(ZFS_PROP_ROOT + ".nginx_servername", servernameFilename)
+            meta.appendArray("nginx_upstream", upstreamFilename)
+            meta.appendArray("nginx_servername", servernameFilename)
 
-            zfsContainer.appendArray(ZFS_PROP_ROOT + ".registered_dns_names", urlDomain)
+            meta.appendArray("registered_dns_names", urlDomain)
 
             for redirectFrom in urlObj['redirects']:
-                zfsContainer.appendArray(ZFS_PROP_ROOT + ".redirect_url", redirectFrom['url'])
+                meta.appendArray("redirect_url", redirectFrom['url'])
 
-                zfsContainer.appendArray(ZFS_PROP_ROOT + ".registered_dns_names", redirectFrom['url'].split('://',1)[1].split('/',1)[0])
-        return True
+                meta.appendArray("registered_dns_names", redirectFrom['url'].split('://',1)[1].split('/',1)[0])
+
+        meta.save()
+
+        # write it all to zfs
+        return zfsContainer.commitBatch()
 
 
     # Action: populates this object with data from the given dataset
@@ -727,86 +706,94 @@ class Container:
             return False
 
         self.dataset = dataset
-        # get a handle to the dataset
-        zfsContainer = ZFSDataset(self.dataset)
+        # get a handle to the dataset - read all properties in one go rather than once per property
+        zfsContainer = ZFSDataset(self.dataset, None, True)
+
+        # read from the json record if there is one, falling back to the legacy properties
+        meta = ContainerMeta(zfsContainer)
 
         # set the values from zfs - not all zfs values are retrieved here
-        self.uuid = zfsContainer.getProperty(ZFS_PROP_ROOT + ":host_hostuuid")
-        self.name = zfsContainer.getProperty(ZFS_PROP_ROOT + ":containername")
-        self.group = zfsContainer.getProperty(ZFS_PROP_ROOT + ":containergroupname")
+        self.uuid = meta.getProperty("host_hostuuid")
+        self.name = meta.getProperty("containername")
+        self.group = meta.getProperty("containergroupname")
 
         # if partition name cant be found then use the dataset
-        if (zfsContainer.getProperty(ZFS_PROP_ROOT + ":partition") is not None):
-            self.partitionName = zfsContainer.getProperty(ZFS_PROP_ROOT + ":partition")
+        if (meta.getProperty("partition") is not None):
+            self.partitionName = meta.getProperty("partition")
         else:
              # extract the partition name from the dataset
             self.partitionName = self.dataset.split('/')[3]
 
         self.mountPoint = zfsContainer.getProperty("mountpoint")
 
-        self.maxHdd = zfsContainer.getProperty(ZFS_PROP_ROOT + ":maxhdd")
-        self.maxRam = zfsContainer.getProperty(ZFS_PROP_ROOT + ":maxram")
-        self.maxCpu = zfsContainer.getProperty(ZFS_PROP_ROOT + ":maxcpu")
-
-        self.securelevel = zfsContainer.getProperty(ZFS_PROP_ROOT + ":securelevel")
-        self.devfsRuleset = zfsContainer.getProperty(ZFS_PROP_ROOT + ":devfs_ruleset")
-        self.enforceStatfs = zfsContainer.getProperty(ZFS_PROP_ROOT + ":enforce_statfs")
-        self.childrenMax = zfsContainer.getProperty(ZFS_PROP_ROOT + ":children_max")
-        self.allowSetHostname = zfsContainer.getProperty(ZFS_PROP_ROOT + ":allow_set_hostname")
-        self.allowSysvipc = zfsContainer.getProperty(ZFS_PROP_ROOT + ":allow_sysvipc")
-        self.allowRawSockets = zfsContainer.getProperty(ZFS_PROP_ROOT + ":allow_raw_sockets")
-        self.allowChflags = zfsContainer.getProperty(ZFS_PROP_ROOT + ":allow_chflags")
-        self.allowMount = zfsContainer.getProperty(ZFS_PROP_ROOT + ":allow_mount")
-        self.allowMountDevfs = zfsContainer.getProperty(ZFS_PROP_ROOT + ":allow_mount_devfs")
-        self.allowMountNullfs = zfsContainer.getProperty(ZFS_PROP_ROOT + ":allow_mount_nullfs")
-        self.allowMountProcfs = zfsContainer.getProperty(ZFS_PROP_ROOT + ":allow_mount_procfs")
-        self.allowMountTmpfs = zfsContainer.getProperty(ZFS_PROP_ROOT + ":allow_mount_tmpfs")
-        self.allowMountZfs = zfsContainer.getProperty(ZFS_PROP_ROOT + ":allow_mount_zfs")
-        self.allowQuotas = zfsContainer.getProperty(ZFS_PROP_ROOT + ":allow_quotas")
-        self.allowSocketAF = zfsContainer.getProperty(ZFS_PROP_ROOT + ":allow_socket_af")
-        self.execPrestart = zfsContainer.getProperty(ZFS_PROP_ROOT + ":exec_prestart")
-        self.execPoststart = zfsContainer.getProperty(ZFS_PROP_ROOT + ":exec_poststart")
-        self.execPrestop = zfsContainer.getProperty(ZFS_PROP_ROOT + ":exec_prestop")
-        self.execStart = zfsContainer.getProperty(ZFS_PROP_ROOT + ":exec_start")
-        self.execStop = zfsContainer.getProperty(ZFS_PROP_ROOT + ":exec_stop")
-        self.execClean = zfsContainer.getProperty(ZFS_PROP_ROOT + ":exec_clean")
-        self.execTimeout = zfsContainer.getProperty(ZFS_PROP_ROOT + ":exec_timeout")
-        self.execFib = zfsContainer.getProperty(ZFS_PROP_ROOT + ":exec_fib")
-        self.stopTimeout = zfsContainer.getProperty(ZFS_PROP_ROOT + ":stop_timeout")
-        self.mountDevfs = zfsContainer.getProperty(ZFS_PROP_ROOT + ":mount_devfs")
-        self.mountFdescfs = zfsContainer.getProperty(ZFS_PROP_ROOT + ":mount_fdescfs")
-        self.ip4 = zfsContainer.getProperty(ZFS_PROP_ROOT + ":ip4")
-        self.ip4SaddrSel = zfsContainer.getProperty(ZFS_PROP_ROOT + ":ip4_saddrsel")
-        self.domainName = zfsContainer.getProperty(ZFS_PROP_ROOT + ":domainname")
-        self.buildEpoch = zfsContainer.getProperty(ZFS_PROP_ROOT + ":buildepoch")
-        self.onStartScript = zfsContainer.getProperty(ZFS_PROP_ROOT + ":onstartscript")
-        self.onStopScript = zfsContainer.getProperty(ZFS_PROP_ROOT + ":onstopscript")
-        self.onDestroyScript = zfsContainer.getProperty(ZFS_PROP_ROOT + ":ondestroyscript")
-        self.hostIface = zfsContainer.getProperty(ZFS_PROP_ROOT + ":host_iface")
-        self.releaseName = zfsContainer.getProperty(ZFS_PROP_ROOT + ":releasename")
+        self.maxHdd = meta.getProperty("maxhdd")
+        self.maxRam = meta.getProperty("maxram")
+        self.maxCpu = meta.getProperty("maxcpu")
+
+        self.securelevel = meta.getProperty("securelevel")
+        self.devfsRuleset = meta.getProperty("devfs_ruleset")
+        self.enforceStatfs = meta.getProperty("enforce_statfs")
+        self.childrenMax = meta.getProperty("children_max")
+        self.allowSetHostname = meta.getProperty("allow_set_hostname")
+        self.allowSysvipc = meta.getProperty("allow_sysvipc")
+        self.allowRawSockets = meta.getProperty("allow_raw_sockets")
+        self.allowChflags = meta.getProperty("allow_chflags")
+        self.allowMount = meta.getProperty("allow_mount")
+        self.allowMountDevfs = meta.getProperty("allow_mount_devfs")
+        self.allowMountNullfs = meta.getProperty("allow_mount_nullfs")
+        self.allowMountProcfs = meta.getProperty("allow_mount_procfs")
+        self.allowMountTmpfs = meta.getProperty("allow_mount_tmpfs")
+        self.allowMountZfs = meta.getProperty("allow_mount_zfs")
+        self.allowQuotas = meta.getProperty("allow_quotas")
+        self.allowSocketAF = meta.getProperty("allow_socket_af")
+        self.execPrestart = meta.getProperty("exec_prestart")
+        self.execPoststart = meta.getProperty("exec_poststart")
+        self.execPrestop = meta.getProperty("exec_prestop")
+        self.execStart = meta.getProperty("exec_start")
+        self.execStop = meta.getProperty("exec_stop")
+        self.execClean = meta.getProperty("exec_clean")
+        self.execTimeout = meta.getProperty("exec_timeout")
+        self.execFib = meta.getProperty("exec_fib")
+        self.stopTimeout = meta.getProperty("stop_timeout")
+        self.mountDevfs = meta.getProperty("mount_devfs")
+        self.mountFdescfs = meta.getProperty("mount_fdescfs")
+        self.ip4 = meta.getProperty("ip4")
+        self.ip4SaddrSel = meta.getProperty("ip4_saddrsel")
+        self.domainName = meta.getProperty("domainname")
+        self.buildEpoch = meta.getProperty("buildepoch")
+        self.onStartScript = meta.getProperty("onstartscript")
+        self.onStopScript = meta.getProperty("onstopscript")
+        self.onDestroyScript = meta.getProperty("ondestroyscript")
+        self.hostIface = meta.getProperty("host_iface")
+        self.releaseName = meta.getProperty("releasename")
+
+        # containers created before startorder was stored are treated as the default order
+        startOrder = meta.getProperty("startorder")
+        if (startOrder is not None):
+            self.startOrder = int(startOrder)
         self.hostname = self.name
 
         # load the jsoned urls
-        self.urls = zfsContainer.getJsonArray(ZFS_PROP_ROOT + ".jsonurls")
+        self.urls = meta.getJsonArray("jsonurls")
 
 
-        self.layer4ProxyTcp = zfsContainer.getArray(ZFS_PROP_ROOT + ".layer4proxytcp")
-        self.layer4ProxyUdp = zfsContainer.getArray(ZFS_PROP_ROOT + ".layer4proxyudp")
+        self.layer4ProxyTcp = meta.getArray("layer4proxytcp")
+        self.layer4ProxyUdp = meta.getArray("layer4proxyudp")
 
         # nginx dirs
-        self.nginxUpstreamDir = zfsContainer.getProperty(ZFS_PROP_ROOT + ":nginx_upstream_dir")
-        self.nginxServernameDir = zfsContainer.getProperty(ZFS_PROP_ROOT + ":nginx_servername_dir")
-        self.nginxAccessfileDir = zfsContainer.getProperty(ZFS_PROP_ROOT + ":nginx_accessfile_dir")
+        self.nginxUpstreamDir = meta.getProperty("nginx_upstream_dir")
+        self.nginxServernameDir = meta.getProperty("nginx_servername_dir")
+        self.nginxAccessfileDir = meta.getProperty("nginx_accessfile_dir")
 
         # nginx files
-        self.nginxUpstreamFiles = zfsContainer.getArray(ZFS_PROP_ROOT + ".nginx_upstream")
-        self.nginxServernameFiles = zfsContainer.getArray(ZFS_PROP_ROOT + ".nginx_servername")
+        self.nginxUpstreamFiles = meta.getArray("nginx_upstream")
+        self.nginxServernameFiles = meta.getArray("nginx_servername")
 
         # registered dns names
-        self.registeredDNSNames = zfsContainer.getArray(ZFS_PROP_ROOT + ".registered_dns_names")
+        self.registeredDNSNames = meta.getArray("registered_dns_names")
 
         # get the ip address
-        ip4Addr = zfsContainer.getProperty(ZFS_PROP_ROOT + ":ip4_addr")
+        ip4Addr = meta.getProperty("ip4_addr")
 
         # we may not receive an ip address from ZFS
         if (ip4Addr is not None):
@@ -856,7 +843,7 @@ class Container:
         tredlyHost = TredlyHost()
 
         # get the certs
-        zfsContainer = ZFSDataset(self.dataset, self.mountPoint)
+        zfsContainer = ZFSDataset(self.dataset, self.mountPoint, True)
         urlCerts = zfsContainer.getArray(ZFS_PROP_ROOT + ".url_cert")
         redirectUrlCerts = zfsContainer.getArray(ZFS_PROP_ROOT + ".redirect_url_cert")
 
@@ -1050,6 +1037,8 @@ class Container:
         if (self.isRunning()):
             return True
 
+        self.dnsUpdates = UnboundControl()
+
         # check for none values and use defaults instead
         if (bridgeInterface is None):
             # put the container on the private network
@@ -1059,6 +1048,9 @@ class Container:
             # get an available ip address for this network
             ip4 = getAvailableIP4Address(builtins.tredlyCommonConfig.lifNetwork, builtins.tredlyCommonConfig.lifCIDR)
 
+            if (ip4 is None):
+                return False
+
         if (ip4Cidr is None):
             # use the default cidr
             ip4Cidr = builtins.tredlyCommonConfig.lifCIDR
@@ -1080,9 +1072,8 @@ class Container:
         # get an ip6 address object
         ip6Address = IPv6Interface(ip6 + '/' + ip6Cidr)
 
-        # create container interface and generate a mac address for it
+        # create container interface. its mac address is set up along with the epair below
         containerInterface = NetInterface()
-        containerInterface.generateMac()
 
         # add the ip address to this container interface
         containerInterface.ip4Addrs.append(ip4Address)
@@ -1124,7 +1115,7 @@ class Container:
             e_error("Failed to chmod /tmp")
 
         # get a handle to ZFS properties
-        zfsContainer = ZFSDataset(self.dataset, self.mountPoint)
+        zfsContainer = ZFSDataset(self.dataset, self.mountPoint, True)
 
         # apply devfs rulesets
         cmd = ['devfs', '-m', self.mountPoint + '/root/dev', 'rule', '-s', self.devfsRuleset, 'applyset']
@@ -1187,104 +1178,98 @@ class Container:
             print(stdErr)
             return False
 
-        # set up the vnet interface
-        cmd = ["ifconfig", "epair", "create"]
-        process = Popen(cmd,  stdin=PIPE, stdout=PIPE, stderr=PIPE);
-        stdOut, stdErr = process.communicate();
-        if (process.returncode != 0):
-            e_error("Failed to create epair for container")
-            print(stdErr)
+        # use a pre-created epair if there is one available
+        epairPool = EpairPool(builtins.tredlyCommonConfig.epairPoolSize)
+        pooledEpair = None
+        if (epairPool.isEnabled()):
+            pooledEpair = epairPool.take(self.uuid)
 
-        # strip the newline and assign this variable
-        hostInterfaceName = stdOut.rstrip().decode(encoding='UTF-8')
-        # swap the a at the end of the string to b
-        containerInterface.name =  re.sub('a$', 'b', hostInterfaceName)
+        # set up the vnet interface on the host with a single exec. the epair is destroyed again if any step fails
+        hostNetwork = NetworkScript()
 
-        # ensure these interfaces exist
-        if (not networkInterfaceExists(hostInterfaceName)):
-            e_error("Cannot find host interface " + hostInterfaceName)
-        if (not networkInterfaceExists(containerInterface.name)):
-            e_error("Cannot find container interface " + containerInterfaceName)
+        if (pooledEpair is not None):
+            # the pooled epair already has its mac addresses set
+            self.hostInterface = pooledEpair[0]
+            containerInterface.mac = pooledEpair[1].mac
 
-        # generate our own mac addresses - vimage has problems with mac collisions
-        self.hostInterface = NetInterface(hostInterfaceName)
-        self.hostInterface.generateMac()
+            hostIfaceRef = shlex.quote(self.hostInterface.name)
+            containerIfaceRef = shlex.quote(pooledEpair[1].name)
+        else:
+            # generate our own mac addresses - vimage has problems with mac collisions
+            macsInUse = epairPool.getMacsInUse()
+            self.hostInterface = NetInterface()
+            self.hostInterface.generateMac(macsInUse = macsInUse)
+            macsInUse.add(self.hostInterface.mac)
+            containerInterface.generateMac(macsInUse = macsInUse)
+
+            hostIfaceRef = '"${hostIface}"'
+            # the container side of the epair ends in b instead of a
+            containerIfaceRef = '"${hostIface%a}b"'
+
+            hostNetwork.addStep("create epair for container", ["ifconfig", "epair", "create"], 'ifconfig "${hostIface}" destroy', 'hostIface')
+            hostNetwork.addStep("set host epair mac address " + self.hostInterface.mac, 'ifconfig ' + hostIfaceRef + ' ether ' + self.hostInterface.mac)
+            hostNetwork.addStep("set container epair mac address " + containerInterface.mac, 'ifconfig ' + containerIfaceRef + ' ether ' + containerInterface.mac)
+
+        hostNetwork.addStep("attach epair to container trd-" + self.uuid, 'ifconfig ' + containerIfaceRef + ' vnet trd-' + self.uuid)
+        hostNetwork.addStep("add host interface to bridge", 'ifconfig ' + shlex.quote(bridgeInterface) + ' addm ' + hostIfaceRef + ' up')
+        # indicate that this epair is paired with a container
+        hostNetwork.addStep("set description on host epair", 'ifconfig ' + hostIfaceRef + ' description "Connected to container ' + self.uuid + '"')
+        hostNetwork.addStep("bring host interface up", 'ifconfig ' + hostIfaceRef + ' up')
 
-        # set the mac addresses for host
-        cmd = ["ifconfig", self.hostInterface.name, "ether", self.hostInterface.mac]
-        process = Popen(cmd,  stdin=PIPE, stdout=PIPE, stderr=PIPE);
-        stdOut, stdErr = process.communicate();
-        if (process.returncode != 0):
-            e_error("Failed to set host epair " + self.hostInterface.name + "mac address " + self.hostInterface.mac)
+        if (not hostNetwork.run()):
+            # a pooled epair isnt destroyed by the script, so do it here
+            if (pooledEpair is not None):
+                return self.abortStart(self.hostInterface.name, ip4)
 
-        # set the mac address for container
-        cmd = ["ifconfig", containerInterface.name, "ether", containerInterface.mac]
-        process = Popen(cmd,  stdin=PIPE, stdout=PIPE, stderr=PIPE);
-        stdOut, stdErr = process.communicate();
-        if (process.returncode != 0):
-            e_error("Failed to set host epair " + containerInterface.name + "mac address " + containerInterface.mac)
+            return self.abortStart(None, ip4)
 
-        # attach container interface to the container
-        cmd = ["ifconfig", containerInterface.name, "vnet", "trd-" + self.uuid]
-        process = Popen(cmd,  stdin=PIPE, stdout=PIPE, stderr=PIPE);
-        stdOut, stdErr = process.communicate();
-        if (process.returncode != 0):
-            e_error("Failed to attach epair " + containerInterface.name + " to container trd-" + self.uuid)
-            print(cmd)
+        if (pooledEpair is None):
+            self.hostInterface.name = hostNetwork.values['hostIface']
+        # swap the a at the end of the string to b
+        containerEpairName = re.sub('a$', 'b', self.hostInterface.name)
 
-        # rename the container interface to something more meaningful
-        cmd = ["jexec", "trd-" + self.uuid, "ifconfig", containerInterface.name, "name", VNET_CONTAINER_IFACE_NAME]
-        process = Popen(cmd,  stdin=PIPE, stdout=PIPE, stderr=PIPE);
-        stdOut, stdErr = process.communicate();
-        if (process.returncode != 0):
-            e_error("Failed to rename container interface")
-            print(cmd)
+        # work out the routes before configuring the container side
+        if (bridgeInterface == builtins.tredlyCommonConfig.wif):
+            # this is a public container
 
-        # change variable name since we just renamed it
-        containerInterface.name = VNET_CONTAINER_IFACE_NAME
+            # get the wan iface's ip address
+            wanIP = getInterfaceIP4(builtins.tredlyCommonConfig.wifPhysical)
 
-        # link the host interface to the bridge
-        cmd = ["ifconfig", bridgeInterface, "addm", self.hostInterface.name, "up"]
-        process = Popen(cmd,  stdin=PIPE, stdout=PIPE, stderr=PIPE);
-        stdOut, stdErr = process.communicate();
-        if (process.returncode != 0):
-            e_error("Failed to add host interface to bridge")
+            # get the current default route
+            f = os.popen("netstat -r4n | grep default | awk '{print $2}'" )
+            defaultRoute = f.read().strip()
+        else:
+            # private container, default comes from config
+            defaultRoute = builtins.tredlyCommonConfig.vnetDefaultRoute
 
-        # indicate that this epair is paired with a container
-        cmd = ["ifconfig", self.hostInterface.name, "description", "Connected to container " + self.uuid]
-        process = Popen(cmd,  stdin=PIPE, stdout=PIPE, stderr=PIPE);
-        stdOut, stdErr = process.communicate();
-        if (process.returncode != 0):
-            e_error("Failed to set description on host epair")
+        # set up the interface and routes inside the container with a single jexec
+        containerNetwork = NetworkScript()
+        # rename the container interface to something more meaningful
+        containerNetwork.addStep("rename container interface", ["ifconfig", containerEpairName, "name", VNET_CONTAINER_IFACE_NAME])
+        containerNetwork.addStep("set container ip address to " + ip4, ["ifconfig", VNET_CONTAINER_IFACE_NAME, "inet", ip4 + "/" + ip4Cidr])
+        containerNetwork.addStep("set container ip address to " + ip6, ["ifconfig", VNET_CONTAINER_IFACE_NAME, "inet6", ip6 + "/" + ip6Cidr])
 
-        # bring the host interface up
-        cmd = ["ifconfig", self.hostInterface.name, "up"]
-        process = Popen(cmd,  stdin=PIPE, stdout=PIPE, stderr=PIPE);
-        stdOut, stdErr = process.communicate();
-        if (process.returncode != 0):
-            e_error("Failed to bring host interface up")
+        if (bridgeInterface == builtins.tredlyCommonConfig.wif):
+            # add a route to the private network
+            containerNetwork.addStep("add route from public to private network", ["route", "add", "-net", builtins.tredlyCommonConfig.lifNetwork + "/" + builtins.tredlyCommonConfig.lifCIDR, wanIP])
 
-        # Set ip4 address
-        cmd = ["jexec", "trd-" + self.uuid, "ifconfig", containerInterface.name, "inet", ip4 + "/" + ip4Cidr]
-        process = Popen(cmd,  stdin=PIPE, stdout=PIPE, stderr=PIPE);
-        stdOut, stdErr = process.communicate();
-        if (process.returncode != 0):
-            e_error("Failed to set container ip address to " + ip4)
-            print(cmd)
+        # now set the default route
+        containerNetwork.addStep("add default route", ["route", "add", "default", defaultRoute])
 
-        # Set ip6 address
-        cmd = ["jexec", "trd-" + self.uuid, "ifconfig", containerInterface.name, "inet6", ip6 + "/" + ip6Cidr]
-        process = Popen(cmd,  stdin=PIPE, stdout=PIPE, stderr=PIPE);
-        stdOut, stdErr = process.communicate();
-        if (process.returncode != 0):
-            e_error("Failed to set container ip address to " + ip4)
-            print(cmd)
+        if (not containerNetwork.run(["jexec", "trd-" + self.uuid])):
+            return self.abortStart(self.hostInterface.name, ip4)
+
+        # change variable name since we just renamed it
+        containerInterface.name = VNET_CONTAINER_IFACE_NAME
 
         # append the container interface
         self.containerInterfaces.append(containerInterface)
 
         e_note(self.name + " allocated IP " + ip4)
 
+        # set the addresses and interfaces in a single zfs transaction
+        zfsContainer.beginBatch()
+
         # set the ip4 address in zfs
         zfsContainer.setProperty(ZFS_PROP_ROOT + ":ip4_addr", bridgeInterface + "|" + ip4 + "/" + ip4Cidr)
 
@@ -1295,45 +1280,28 @@ class Container:
         zfsContainer.setProperty(ZFS_PROP_ROOT + ":host_iface", self.hostInterface.name)
         zfsContainer.setProperty(ZFS_PROP_ROOT + ":container_iface", containerInterface.name)
 
-        # get a handle to the hosts ipfw setup
-        hostFirewall = IPFW('/usr/local/etc')
-        hostFirewall.readRules()
-        # set up some further routing for containers
-        if (bridgeInterface == builtins.tredlyCommonConfig.wif):
-            # this is a public container
+        # the container's mac address cant be seen from the host, so record it for collision checks
+        zfsContainer.setProperty(ZFS_PROP_ROOT + ":container_mac", containerInterface.mac)
 
-            # get the wan iface's ip address
-            wanIP = getInterfaceIP4(builtins.tredlyCommonConfig.wifPhysical)
+        zfsContainer.commitBatch()
 
-            # add a route to the private network
-            cmd = ["jexec", "trd-" + self.uuid, "route", "add", "-net", builtins.tredlyCommonConfig.lifNetwork + "/" + builtins.tredlyCommonConfig.lifCIDR, wanIP]
-            process = Popen(cmd,  stdin=PIPE, stdout=PIPE, stderr=PIPE)
-            stdOut, stdErr = process.communicate();
-            if (process.returncode != 0):
-                e_error("Failed to add route from public to private network")
-                print(cmd)
-
-            # get the current default route
-            f = os.popen("netstat -r4n | grep default | awk '{print $2}'" )
-            defaultRoute = f.read()
+        # the address is in zfs now so other builds will see it
+        releaseIP4(ip4)
 
-            # Add this ip address to the IPFW public ip table
-            hostFirewall.appendTable(1, ip4)
-            # Add the host's epair to the ipfw public epair table
-            hostFirewall.appendTable(2, self.hostInterface.name)
+        # public containers need to be added to the host firewall
+        if (bridgeInterface == builtins.tredlyCommonConfig.wif):
+            # get a handle to the hosts ipfw setup
+            hostFirewall = IPFW('/usr/local/etc')
 
-            hostFirewall.apply()
-        else:
-            # private container, default comes from config
-            defaultRoute = builtins.tredlyCommonConfig.vnetDefaultRoute
+            # the host firewall is shared with any other containers starting at the same time
+            with Container.hostLock:
+                hostFirewall.readRules()
+                # Add this ip address to the IPFW public ip table
+                hostFirewall.appendTable(1, ip4)
+                # Add the host's epair to the ipfw public epair table
+                hostFirewall.appendTable(2, self.hostInterface.name)
 
-        # now set hte default route
-        cmd = ["jexec", "trd-" + self.uuid, "route", "add", "default", defaultRoute]
-        process = Popen(cmd,  stdin=PIPE, stdout=PIPE, stderr=PIPE);
-        stdOut, stdErr = process.communicate();
-        if (process.returncode != 0):
-            e_error("Failed to add default route")
-            print(cmd)
+                hostFirewall.apply()
 
         # set resource limits
         self.applyResourceLimits()
@@ -1394,80 +1362,120 @@ class Container:
             else:
                 e_error("Failed")
 
-        # set up the container's hostname in DNS
-        e_note("Adding container to DNS")
-
-        # Set the container's hostname up in unbound
-        unboundFile = UnboundFile(UNBOUND_CONFIG_DIR + "/" + unboundFormatFilename(self.domainName))
-        # read contents
-        unboundFile.read()
-
-        # only assign this hostname to the first interface
-        if (unboundFile.append("local-data", self.hostname + '.' + self.domainName, "IN", "A", str(self.containerInterfaces[0].ip4Addrs[0].ip), self.uuid)):
-            zfsContainer.appendArray(ZFS_PROP_ROOT + ".registered_dns_names", self.hostname + '.' + self.domainName)
+        # dns, proxy and containergroup firewall files are shared with any other containers starting at the same time
+        with Container.hostLock:
+            # set up the container's hostname in DNS
+            e_note("Adding container to DNS")
 
-        # write out the file and show message to user
-        if (unboundFile.write()):
-            e_success("Success")
-        else:
-            e_error("Failed")
+            # Set the container's hostname up in unbound
+            unboundFile = UnboundFile(UNBOUND_CONFIG_DIR + "/" + unboundFormatFilename(self.domainName))
+            # read contents
+            unboundFile.read()
 
-        # set up layer 4 proxy if it was requested
-        if (self.layer4Proxy):
-            e_note("Configuring layer 4 Proxy (tcp/udp) for " + self.name)
+            # only assign this hostname to the first interface
+            if (unboundFile.append("local-data", self.hostname + '.' + self.domainName, "IN", "A", str(self.containerInterfaces[0].ip4Addrs[0].ip), self.uuid)):
+                meta = ContainerMeta(zfsContainer)
+                meta.appendArray("registered_dns_names", self.hostname + '.' + self.domainName)
+                meta.save()
 
-            if (self.registerLayer4Proxy()):
+            # write out the file and show message to user
+            if (unboundFile.write()):
                 e_success("Success")
             else:
                 e_error("Failed")
+            self.dnsUpdates.queue(unboundFile)
 
-        # Update containergroup member firewall tables
-        if (self.group is not None):
-            e_note("Updating container group '" + self.group + "' firewall rules")
+            # set up layer 4 proxy if it was requested
+            if (self.layer4Proxy):
+                e_note("Configuring layer 4 Proxy (tcp/udp) for " + self.name)
 
-            # get a list of containergroup uuids
-            containerGroupMembers = tredlyHost.getContainerGroupContainerUUIDs(self.group, self.partitionName)
-            # and containergroup ips
-            containerGroupIps = tredlyHost.getContainerGroupContainerIps(self.group, self.partitionName)
+                if (self.registerLayer4Proxy()):
+                    e_success("Success")
+                else:
+                    e_error("Failed")
 
-            success = True
+            # Update containergroup member firewall tables
+            if (self.group is not None):
+                e_note("Updating container group '" + self.group + "' firewall rules")
 
-            # loop over again and set the ip addresses
-            for uuid in containerGroupMembers:
-                firewall = IPFW('/tredly/ptn/' + self.partitionName + '/cntr/' + uuid + '/root/usr/local/etc', uuid)
+                # get a list of containergroup uuids
+                containerGroupMembers = tredlyHost.getContainerGroupContainerUUIDs(self.group, self.partitionName)
+                # and containergroup ips
+                containerGroupIps = tredlyHost.getContainerGroupContainerIps(self.group, self.partitionName)
 
-                if (not firewall.readRules()):
-                    e_error("Failed to read firewall rules from " + uuid)
+                success = True
 
-                # loop over ips, appending them to this uuid
-                for ip in containerGroupIps:
-                    if (not firewall.appendTable(1, ip)):
-                        e_error("Failed to add IP address to table 1 in " + uuid)
+                # loop over again and set the ip addresses
+                for uuid in containerGroupMembers:
+                    firewall = IPFW('/tredly/ptn/' + self.partitionName + '/cntr/' + uuid + '/root/usr/local/etc', uuid)
 
-                # apply the firewall rules, keeping the return code
-                success = success and firewall.apply()
+                    if (not firewall.readRules()):
+                        e_error("Failed to read firewall rules from " + uuid)
 
-            if (success):
-                e_success("Success")
-            else:
-                e_error("Failed")
+                    # loop over ips, appending them to this uuid
+                    for ip in containerGroupIps:
+                        if (not firewall.appendTable(1, ip)):
+                            e_error("Failed to add IP address to table 1 in " + uuid)
 
-        # Register any URLs
-        if (len(self.urls) > 0):
-            self.registerLayer7URLs()
+                    # apply the firewall rules, keeping the return code
+                    success = success and firewall.apply()
 
-        # reload unbound
-        e_note("Reloading DNS server")
-        cmd = ['service', 'unbound', 'reload']
-        process = Popen(cmd,  stdin=PIPE, stdout=PIPE, stderr=PIPE)
-        stdOut, stdErr = process.communicate()
-        if (process.returncode == 0):
-            e_success("Success")
-        else:
-            e_error("Failed")
+                if (success):
+                    e_success("Success")
+                else:
+                    e_error("Failed")
+
+            # Register any URLs
+            if (len(self.urls) > 0):
+                self.registerLayer7URLs()
+
+            # apply the dns changes before another container can write the same files
+            if (self.dnsUpdates.hasChanges()):
+                e_note("Updating DNS server")
+                if (self.dnsUpdates.applyOrReload()):
+                    e_success("Success")
+                else:
+                    e_error("Failed")
+
+        # top the epair pool back up now that this container is up
+        if (epairPool.isEnabled()):
+            if (not epairPool.fill()):
+                e_warning("Failed to refill the epair pool")
 
         return True
 
+    # Action: undo a start that failed while setting up networking
+    #
+    # Pre: the jail has been created
+    # Post: the epair has been destroyed, the jail removed and the container's filesystems unmounted
+    #
+    # Params: hostIface - the host side of the epair to destroy, or None if it has already been removed
+    #         ip4 - the ip4 address reserved for this container
+    #
+    # Return: False, so that the caller can return the result
+    def abortStart(self, hostIface, ip4):
+        e_note("Rolling back start of container " + self.name)
+
+        # destroying the host side of an epair also destroys the container side
+        if (hostIface is not None):
+            process = Popen(['ifconfig', hostIface, 'destroy'],  stdin=PIPE, stdout=PIPE, stderr=PIPE)
+            stdOut, stdErr = process.communicate()
+
+        process = Popen(['jail', '-r', 'trd-' + self.uuid],  stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        stdOut, stdErr = process.communicate()
+
+        # unmount all directories EXCEPT devfs mounted into this container
+        self.unmountAllDirs()
+
+        # unmount devfs last
+        process = Popen(['umount', '-f', '-t', 'devfs', self.mountPoint + '/root/dev'],  stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        stdOut, stdErr = process.communicate()
+
+        # let other builds have the address
+        releaseIP4(ip4)
+
+        return False
+
     # Action: stop this container and clean up
     #
     # Pre: container dataset exists
@@ -1481,12 +1489,17 @@ class Container:
 
         zfsContainer = ZFSDataset(self.dataset, self.mountPoint)
 
+        # check once whether the container is running, rather than forking jls at every step
+        running = self.isRunning()
+
         # return true if container already stopped
-        if (not self.isRunning()):
+        if (not running):
             return True
 
+        self.dnsUpdates = UnboundControl()
+
         # if the container is running then run the onstop/ondestroy commands
-        if (self.isRunning()):
+        if (running):
             # check if an onstop script is set and if so, run it
             if (self.onStopScript is not None):
                 e_note("Running onStop script")
@@ -1503,175 +1516,210 @@ class Container:
                 else:
                     e_error("Failed")
 
-        # remove container from dns
-        returnCode = True
-        e_note("Removing container from DNS")
-        for dnsName in self.registeredDNSNames.values():
-            # load the unbound file
-            unboundFile = UnboundFile(UNBOUND_CONFIG_DIR + "/" + unboundFormatFilename(dnsName))
-
-            # read contents
-            unboundFile.read()
-
-            # remove the elements for this uuid
-            unboundFile.removeElementsByUUID(self.uuid)
-
-            returnCode = (returnCode and unboundFile.write())
+        # other containers may be stopping at the same time and share these files
+        with Container.hostLock:
+            # remove container from dns
+            returnCode = True
+            e_note("Removing container from DNS")
+            for dnsName in self.registeredDNSNames.values():
+                # load the unbound file
+                unboundFile = UnboundFile(UNBOUND_CONFIG_DIR + "/" + unboundFormatFilename(dnsName))
 
-        # print success/failed to the user for DNS update
-        if (returnCode):
-            e_success("Success")
-        else:
-            e_error("Failed")
+                # read contents
+                unboundFile.read()
 
+                # remove the elements for this uuid
+                unboundFile.removeElementsByUUID(self.uuid)
 
-        # get the url certs from zfs
-        reloadNginx = False
-        # loop over the upstream files and delete all lines containing this ip
-        for upstreamFilename in self.nginxUpstreamFiles.values():
-            # load the nginx file
-            upstreamFile = NginxBlock(None, None, self.nginxUpstreamDir.rstrip('/') + '/' + upstreamFilename)
-            upstreamFile.loadFile()
+                returnCode = (returnCode and unboundFile.write())
+                self.dnsUpdates.queue(unboundFile)
 
-            # remove attrs from this file
-            try:
-                upstreamFile.blocks['upstream'][upstreamFilename].delAttrByRegex('server', "^" + str(self.containerInterfaces[0].ip4Addrs[0].ip) + ':')
-            except KeyError:
-                e_error("Definition not found in" + self.nginxUpstreamDir.rstrip('/') + '/' + upstreamFilename)
-            # if the upstream block is empty then delete it
-            try:
-                if (len(upstreamFile.blocks['upstream'][upstreamFilename].attrs) == 0):
-                    del upstreamFile.blocks['upstream'][upstreamFilename]
-            except KeyError:
-                e_error("Definition not found in" + self.nginxUpstreamDir.rstrip('/') + '/' + upstreamFilename)
-
-            # save it
-            upstreamFile.saveFile()
-            reloadNginx = True
-
-        # loop over the servername files and delete all urls related to this container
-        for servernameFilename in self.nginxServernameFiles.values():
-            # load the nginx file
-            servernameFile = NginxBlock(None, None, self.nginxServernameDir.rstrip('/') + '/' + servernameFilename)
-            servernameFile.loadFile()
-
-            for urlObj in self.urls:
-                # split up the domain and directory parts of the url
-                if ('/' in urlObj['url'].rstrip('/')):
-                    urlDomain = urlObj['url'].split('/', 1)[0]
-                    urlDirectory = '/' + urlObj['url'].split('/', 1)[1].rstrip('/') + '/'
-                else:
-                    urlDomain = urlObj['url']
-                    urlDirectory = '/'
+            # print success/failed to the user for DNS update
+            if (returnCode):
+                e_success("Success")
+            else:
+                e_error("Failed")
 
-                # check if any other containers are using this url
-                containersWithUrl = tredlyHost.getContainersWithArray(ZFS_PROP_ROOT + '.url', urlObj['url'])
 
-                # remove our uuid from this list
-                containersWithUrl.remove(self.uuid)
+            # get the url certs from zfs
+            reloadNginx = False
+            # loop over the upstream files and delete all lines containing this ip
+            for upstreamFilename in self.nginxUpstreamFiles.values():
+                # load the nginx file
+                upstreamFile = NginxBlock(None, None, self.nginxUpstreamDir.rstrip('/') + '/' + upstreamFilename)
+                # a file that failed to parse would be saved empty, so leave it alone
+                if (not upstreamFile.loadFile()):
+                    e_error("Failed to parse " + upstreamFile.filePath)
+                    continue
 
-                # check if the access file for this container is included in this location block and remove it
-                # copy the list
+                # remove attrs from this file
                 try:
-                    includeItems = list(servernameFile.blocks['server'][0].blocks['location'][urlDirectory].attrs['include'].items())
-                    for key, value in includeItems:
-                        if (value == NGINX_ACCESSFILE_DIR + '/' + self.uuid):
-                            del servernameFile.blocks['server'][0].blocks['location'][urlDirectory].attrs['include'][key]
+                    upstreamFile.blocks['upstream'][upstreamFilename].delAttrByRegex('server', "^" + str(self.containerInterfaces[0].ip4Addrs[0].ip) + ':')
                 except KeyError:
-                    # doesnt exist so pass
-                    pass
-
-                # if no other containers are using this url then delete the location block
-                if (len(containersWithUrl) == 0):
-                    try:
-                        del servernameFile.blocks['server'][0].blocks['location'][urlDirectory]
-
-                        # check if the error docs is the last block left, and if so delete it
-                        if (len(servernameFile.blocks['server'][0].blocks['location']) == 1):
-                            try:
-                                del servernameFile.blocks['server'][0].blocks['location']['/tredly_error_docs']
+                    e_error("Definition not found in" + self.nginxUpstreamDir.rstrip('/') + '/' + upstreamFilename)
+                # if the upstream block has no servers left then delete it, along with any keepalive settings
+                try:
+                    if ('server' not in upstreamFile.blocks['upstream'][upstreamFilename].attrs.keys()):
+                        del upstreamFile.blocks['upstream'][upstreamFilename]
+
+                        # and the url's cache zone
+                        layer7Proxy = Layer7Proxy()
+                        if (not layer7Proxy.removeCacheZone(self.partitionName, upstreamFilename)):
+                            e_error("Failed to remove cache zone " + upstreamFilename)
+                        reloadNginx = reloadNginx or layer7Proxy.changed
+                except KeyError:
+                    e_error("Definition not found in" + self.nginxUpstreamDir.rstrip('/') + '/' + upstreamFilename)
 
-                                # if there are no more locations then delete the server block
-                                if (len(servernameFile.blocks['server'][0].blocks['location']) == 0):
-                                    del servernameFile.blocks['server'][0]
-                            except:
-                                e_warning("Error docs location not found")
-                    except:
-                        e_warning('Layer 7 proxy location ' + urlDirectory + ' not found')
+                # save it
+                upstreamFile.saveFile()
+                reloadNginx = reloadNginx or upstreamFile.changed
 
-                if (not servernameFile.saveFile()):
-                    e_error("Failed to save server name file")
-                else:
-                    reloadNginx = True
+            # loop over the servername files and delete all urls related to this container
+            for servernameFilename in self.nginxServernameFiles.values():
+                # load the nginx file
+                servernameFile = NginxBlock(None, None, self.nginxServernameDir.rstrip('/') + '/' + servernameFilename)
+                if (not servernameFile.loadFile()):
+                    e_error("Failed to parse " + servernameFile.filePath)
+                    continue
 
-                # remove the redirect urls
-                for redirectUrl in urlObj['redirects']:
+                for urlObj in self.urls:
                     # split up the domain and directory parts of the url
-                    url = redirectUrl['url'].split('://')[1]
-                    if ('/' in url.rstrip('/')):
-                        urlDomain = url.split('/', 1)[0]
-                        urlDirectory = '/' + url.split('/', 1)[1].rstrip('/') + '/'
+                    if ('/' in urlObj['url'].rstrip('/')):
+                        urlDomain = urlObj['url'].split('/', 1)[0]
+                        urlDirectory = '/' + urlObj['url'].split('/', 1)[1].rstrip('/') + '/'
                     else:
-                        urlDomain = url
+                        urlDomain = urlObj['url']
                         urlDirectory = '/'
 
-                    protocol = redirectUrl['url'].split('://')[0]
-
-                    redirectUrlFile = nginxFormatFilename(protocol + '://' + urlDomain)
-
-                    redirectServernameFile = NginxBlock(None, None, self.nginxServernameDir.rstrip('/') + '/' + nginxFormatFilename(redirectUrlFile))
-                    redirectServernameFile.loadFile()
-
-                    # check if any other containers are using this redirect url
-
-                    containersWithUrl = tredlyHost.getContainersWithArray(ZFS_PROP_ROOT + '.redirect_url', redirectUrl['url'])
+                    # check if any other containers are using this url
+                    containersWithUrl = tredlyHost.getContainersWithArray(ZFS_PROP_ROOT + '.url', urlObj['url'])
 
                     # remove our uuid from this list
                     containersWithUrl.remove(self.uuid)
 
+                    # check if the access file for this container is included in this location block and remove it
+                    # copy the list
+                    try:
+                        includeItems = list(servernameFile.blocks['server'][0].blocks['location'][urlDirectory].attrs['include'].items())
+                        for key, value in includeItems:
+                            if (value == NGINX_ACCESSFILE_DIR + '/' + self.uuid):
+                                del servernameFile.blocks['server'][0].blocks['location'][urlDirectory].attrs['include'][key]
+                    except KeyError:
+                        # doesnt exist so pass
+                        pass
+
+                    # and this containers geo map from the location's access check
+                    layer7Proxy = Layer7Proxy()
+                    layer7Proxy.removeLocationAccess(servernameFile, urlDirectory, layer7Proxy.getGeoVariable(self.uuid))
+
                     # if no other containers are using this url then delete the location block
                     if (len(containersWithUrl) == 0):
                         try:
-                            del redirectServernameFile.blocks['server'][0].blocks['location'][urlDirectory]
-                        except:
-                            e_error("Location block " + urlDirectory + " not found")
-
-                        try:
-                            # check if there are now no location blocks listed
-                            if (len(redirectServernameFile.blocks['server'][0].blocks['location']) == 0):
-                                del redirectServernameFile.blocks['server'][0]
+                            del servernameFile.blocks['server'][0].blocks['location'][urlDirectory]
+
+                            # check if the error docs is the last block left, and if so delete it
+                            if (len(servernameFile.blocks['server'][0].blocks['location']) == 1):
+                                try:
+                                    del servernameFile.blocks['server'][0].blocks['location']['/tredly_error_docs']
+
+                                    # if there are no more locations then delete the server block
+                                    if (len(servernameFile.blocks['server'][0].blocks['location']) == 0):
+                                        del servernameFile.blocks['server'][0]
+                                except:
+                                    e_warning("Error docs location not found")
                         except:
-                            e_error("No server block found")
+                            e_warning('Layer 7 proxy location ' + urlDirectory + ' not found')
 
-                        # save it
-                        if (not redirectServernameFile.saveFile()):
-                            e_error("Failed to save redirect file")
+                    if (not servernameFile.saveFile()):
+                        e_error("Failed to save server name file")
+                    else:
+                        reloadNginx = reloadNginx or servernameFile.changed
+
+                    # remove the redirect urls
+                    for redirectUrl in urlObj['redirects']:
+                        # split up the domain and directory parts of the url
+                        url = redirectUrl['url'].split('://')[1]
+                        if ('/' in url.rstrip('/')):
+                            urlDomain = url.split('/', 1)[0]
+                            urlDirectory = '/' + url.split('/', 1)[1].rstrip('/') + '/'
                         else:
-                            reloadNginx = True
+                            urlDomain = url
+                            urlDirectory = '/'
 
-        # clean up the access file if it exists
-        if (self.nginxAccessfileDir is not None):
-            accessFile = self.nginxAccessfileDir.rstrip('/') + '/' + nginxFormatFilename(self.uuid)
+                        protocol = redirectUrl['url'].split('://')[0]
 
-            if (os.path.isfile(accessFile)):
-                os.remove(accessFile)
+                        redirectUrlFile = nginxFormatFilename(protocol + '://' + urlDomain)
 
-                reloadNginx = True
+                        redirectServernameFile = NginxBlock(None, None, self.nginxServernameDir.rstrip('/') + '/' + nginxFormatFilename(redirectUrlFile))
+                        if (not redirectServernameFile.loadFile()):
+                            e_error("Failed to parse " + redirectServernameFile.filePath)
+                            continue
 
-        # remove layer 4 proxy data for this uuid
-        if (len(self.layer4ProxyTcp) > 0) or (len(self.layer4ProxyUdp) > 0):
-            e_note("Removing Layer 4 proxy (tcp/udp) rules for " + self.name)
-            # remove any layer 4 proxy ports
-            layer4Proxy = Layer4ProxyFile(IPFW_FORWARDS)
+                        # check if any other containers are using this redirect url
 
-            # read the file
-            layer4Proxy.read()
+                        containersWithUrl = tredlyHost.getContainersWithArray(ZFS_PROP_ROOT + '.redirect_url', redirectUrl['url'])
+
+                        # remove our uuid from this list
+                        containersWithUrl.remove(self.uuid)
+
+                        # if no other containers are using this url then delete the location block
+                        if (len(containersWithUrl) == 0):
+                            try:
+                                del redirectServernameFile.blocks['server'][0].blocks['location'][urlDirectory]
+                            except:
+                                e_error("Location block " + urlDirectory + " not found")
+
+                            try:
+                                # check if there are now no location blocks listed
+                                if (len(redirectServernameFile.blocks['server'][0].blocks['location']) == 0):
+                                    del redirectServernameFile.blocks['server'][0]
+                            except:
+                                e_error("No server block found")
+
+                            # save it
+                            if (not redirectServernameFile.saveFile()):
+                                e_error("Failed to save redirect file")
+                            else:
+                                reloadNginx = reloadNginx or redirectServernameFile.changed
+
+            # clean up the access file if it exists
+            if (self.nginxAccessfileDir is not None):
+                accessFile = self.nginxAccessfileDir.rstrip('/') + '/' + nginxFormatFilename(self.uuid)
 
-            # remove lines associated with this uuid
-            layer4Proxy.removeElementsByUUID(self.uuid)
+                if (os.path.isfile(accessFile)):
+                    os.remove(accessFile)
 
-            layer4Proxy.write()
-            layer4Proxy.reload()
+                    reloadNginx = True
+
+            # and the geo map, now that no url checks it
+            layer7Proxy = Layer7Proxy()
+            if (not layer7Proxy.removeGeoWhitelist(self.partitionName, self.uuid)):
+                e_error("Failed to remove whitelist")
+            reloadNginx = reloadNginx or layer7Proxy.changed
+
+            # remove layer 4 proxy data for this uuid
+            if (len(self.layer4ProxyTcp) > 0) or (len(self.layer4ProxyUdp) > 0):
+                e_note("Removing Layer 4 proxy (tcp/udp) rules for " + self.name)
+                # remove any layer 4 proxy ports
+                layer4Proxy = Layer4ProxyFile(IPFW_FORWARDS)
+
+                # read the file
+                layer4Proxy.read()
+
+                # remove lines associated with this uuid
+                layer4Proxy.removeElementsByUUID(self.uuid)
+
+                # only rerun the forwards if the file changed
+                if (layer4Proxy.write()) and (layer4Proxy.changed):
+                    layer4Proxy.reload()
+
+            # apply the dns changes before another container can write the same files
+            if (self.dnsUpdates.hasChanges()):
+                e_note("Updating DNS server")
+                if (self.dnsUpdates.applyOrReload()):
+                    e_success("Success")
+                else:
+                    e_error("Failed")
 
         # check if postgres is installed
         cmd = ['pkg', '-j', 'trd-' + self.uuid, 'info']
@@ -1700,24 +1748,51 @@ class Container:
                 success = True
                 for memberUUID in containerGroupUUIDs:
                     # load the container data from ZFS
-                    groupMemberDataset = ZFS_TREDLY_PARTITIONS_DATASET + "/" + partitionName + "/" + TREDLY_CONTAINER_DIR_NAME + "/" + memberUUID
+                    groupMemberDataset = ZFS_TREDLY_PARTITIONS_DATASET + "/" + self.partitionName + "/" + TREDLY_CONTAINER_DIR_NAME + "/" + memberUUID
                     groupMember = Container()
                     groupMember.loadFromZFS(groupMemberDataset)
                     if (groupMember.uuid is None):
                         groupMember.uuid = memberUUID
 
-                    # remove the ip from this containers containergroup members
-                    groupMember.firewall.removeFromTable(1, str(self.containerInterfaces[0].ip4Addrs[0].ip))
+                    # other members of this group may be stopping at the same time
+                    with Container.hostLock:
+                        # remove the ip from this containers containergroup members
+                        groupMember.firewall.removeFromTable(1, str(self.containerInterfaces[0].ip4Addrs[0].ip))
 
-                    # apply it and get whether it succeeded or failed
-                    success = (success and groupMember.firewall.apply())
+                        # apply it and get whether it succeeded or failed
+                        success = (success and groupMember.firewall.apply())
                 if (success):
                     e_success("Success")
                 else:
                     e_error("Failed")
 
+        # check if this container is on the public interface
+        if (len(self.containerInterfaces) > 0):
+            if (self.containerInterfaces[0].name == builtins.tredlyCommonConfig.wif):
+                # it is so remove our elements from the ipfw tables, before the epair can go back to the pool
+                with Container.hostLock:
+                    # get a ipfw object on the host
+                    hostFirewall = IPFW('/usr/local/etc')
+                    hostFirewall.readRules()
+
+                    # remove the ip from table 1
+                    if (not hostFirewall.removeFromTable(1, str(self.containerInterfaces[0].ip4Addrs[0].ip))):
+                        e_error("Failed to remove ip address from host table 1")
+
+                    # remove the host's epair from table 2
+                    if (self.hostIface is not None) and (not hostFirewall.removeFromTable(2, self.hostIface)):
+                        e_error("Failed to remove interface from host table 2")
+
+                    hostFirewall.apply()
+
+        # hand the epair back to the pool while the container still holds its side of it
+        epairPool = EpairPool(builtins.tredlyCommonConfig.epairPoolSize)
+        recycledEpair = False
+        if (running) and (epairPool.isEnabled()) and (self.hostIface is not None) and (len(self.containerInterfaces) > 0):
+            recycledEpair = epairPool.recycle(self.uuid, self.hostIface, self.containerInterfaces[0].name)
+
         # if the container is running then stop it
-        if (self.isRunning()):
+        if (running):
             # stop the container
             e_note("Stopping Container " + self.name)
             cmd = ['jail', '-r', 'trd-' + self.uuid]
@@ -1729,24 +1804,6 @@ class Container:
             else:
                 e_error("Failed")
 
-        # check if this container is on the public interface
-        if (len(self.containerInterfaces) > 0):
-            if (self.containerInterfaces[0].name == builtins.tredlyCommonConfig.wif):
-                # it is so remove our elements from the ipfw tables
-                # get a ipfw object on the host
-                hostFirewall = IPFW('/usr/local/etc')
-                hostFirewall.readRules()
-
-                # remove the ip from table 1
-                if (not hostFirewall.removeFromTable(1, str(self.containerInterfaces[0].ip4Addrs[0].ip))):
-                    e_error("Failed to remove ip address from host table 1")
-
-                # remove the epair from table 2
-                if (not hostFirewall.removeFromTable(2, self.containerInterfaces[0].name)):
-                    e_error("Failed to remove interface from host table 2")
-
-                hostFirewall.apply()
-
         # tear down any resource limits if they were placed
         if (self.maxCpu is not None) or (self.maxRam is not None):
             e_note("Removing resource limits")
@@ -1762,36 +1819,31 @@ class Container:
 
 
         # make sure the hosts epair exists before attempting to destroy it
-        if (networkInterfaceExists(self.hostIface)):
+        if (recycledEpair) or (networkInterfaceExists(self.hostIface)):
             e_note("Removing container networking")
 
-            cmd = [ 'ifconfig', self.hostIface, 'destroy']
-            process = Popen(cmd,  stdin=PIPE, stdout=PIPE, stderr=PIPE)
-            stdOut, stdErr = process.communicate()
-            rc = process.returncode
-            if (rc == 0):
+            if (recycledEpair):
                 e_success("Success")
             else:
-                e_error("Failed to remove epair " + self.hostIfaced)
+                cmd = [ 'ifconfig', self.hostIface, 'destroy']
+                process = Popen(cmd,  stdin=PIPE, stdout=PIPE, stderr=PIPE)
+                stdOut, stdErr = process.communicate()
+                rc = process.returncode
+                if (rc == 0):
+                    e_success("Success")
+                else:
+                    e_error("Failed to remove epair " + self.hostIface)
 
             # remove ip address from zfs
+            zfsContainer.beginBatch()
             zfsContainer.unsetProperty(ZFS_PROP_ROOT + ":ip4_addr")
-
-        # reload unbound
-        e_note("Reloading DNS server")
-        process = Popen(['service', 'unbound', 'reload'], stdin=PIPE, stdout=PIPE, stderr=PIPE)
-        stdOut, stdErr = process.communicate()
-        if (process.returncode == 0):
-            e_success("Success")
-        else:
-            e_error("Failed")
+            zfsContainer.unsetProperty(ZFS_PROP_ROOT + ":container_mac")
+            zfsContainer.commitBatch()
 
         # reload nginx
         if (reloadNginx):
             e_note("Reloading Layer 7 Proxy")
-            process = Popen(['service', 'nginx', 'reload'], stdin=PIPE, stdout=PIPE, stderr=PIPE)
-            stdOut, stdErr = process.communicate()
-            if (process.returncode == 0):
+            if (Layer7Proxy().reload()):
                 e_success("Success")
             else:
                 e_error("Failed")
@@ -1897,8 +1949,9 @@ class Container:
             self.firewall.appendTable(2, ip4)
 
         # get a handle to ZFS properties
-        zfsContainer = ZFSDataset(self.dataset, self.mountPoint)
+        zfsContainer = ZFSDataset(self.dataset, self.mountPoint, True)
         # register ports in ZFS
+        zfsContainer.beginBatch()
         for tcpInPort in self.tcpInPorts:
             zfsContainer.appendArray(ZFS_PROP_ROOT + ".tcpinports", str(tcpInPort))
         for udpInPort in self.udpInPorts:
@@ -1907,6 +1960,7 @@ class Container:
             zfsContainer.appendArray(ZFS_PROP_ROOT + ".tcpoutports", str(tcpOutPort))
         for udpOutPort in self.udpOutPorts:
             zfsContainer.appendArray(ZFS_PROP_ROOT + ".udpoutports", str(udpOutPort))
+        zfsContainer.commitBatch()
 
         # apply the rules and return
         return self.firewall.apply()
@@ -1981,58 +2035,54 @@ class Container:
     #
     # Return: True if succeeded, False otherwise
     def runOnCreateCmds(self):
+        # skip the commands that this container was cloned from the build cache with
+        index = 0
+        cachedSteps = ZFSDataset(self.dataset, self.mountPoint).getProperty(ZFS_PROP_ROOT + ":buildcache_steps")
+        if (cachedSteps is not None) and (cachedSteps.isdigit()):
+            index = min(int(cachedSteps), len(self.onCreate))
+
+        if (self.buildCache is None):
+            self.buildCache = self.getBuildCache()
+        caching = self.buildCache.isEnabled()
+
         # loop over the create commands
-        for createCmd in self.onCreate:
+        while (index < len(self.onCreate)):
+            createCmd = self.onCreate[index]
+            index += 1
+            success = True
+
             if (createCmd['type'] == "exec"):    # ONCREATE COMMANDS
                 e_note('Running onCreate command: "' +  createCmd['value'] +'"')
 
                 # run it
-                if (self.runCmd(createCmd['value'])):
+                success = self.runCmd(createCmd['value'])
+                if (success):
                     e_success("Success")
                 else:
                     e_error("Failed")
 
             elif (createCmd['type'] == "installPackage"):   # INSTALL PACKAGE COMMANDS
-                e_note("Installing: " + createCmd['value'] + " and its dependencies")
-
-                # first mount the pkg cache from the host
-                cmd = ['mount_nullfs', '/var/cache/pkg', self.mountPoint + '/root/var/cache/pkg']
-                process = Popen(cmd,  stdin=PIPE, stdout=PIPE, stderr=PIPE)
-                stdOut, stdErr = process.communicate()
-                if (process.returncode != 0):
-                    e_error("Failed to mount host's pkg cache")
+                # install this and any packages directly following it in one transaction
+                packages = [createCmd['value']]
+                while (index < len(self.onCreate)) and (self.onCreate[index]['type'] == "installPackage"):
+                    packages.append(self.onCreate[index]['value'])
+                    index += 1
 
-                # proceed with install from the host
-                cmd = ['pkg', '-j', 'trd-' + self.uuid, 'install', "-y", createCmd['value']]
+                success = self.installPackages(packages)
 
-                installProcess = Popen(cmd,  stdin=PIPE, stdout=PIPE, stderr=PIPE)
-                stdOut, stdErr = installProcess.communicate()
-                if (installProcess.returncode != 0):
-                    # errored
-                    print(str(stdErr))
-                    e_error("Failed")
-                else:
-                    e_success("Success")
-
-                # now unmount it
-                cmd = ['umount', self.mountPoint + '/root/var/cache/pkg']
-                process = Popen(cmd,  stdin=PIPE, stdout=PIPE, stderr=PIPE)
-                stdOut, stdErr = process.communicate()
-                if (process.returncode != 0):
-                    e_error("Failed to unmount host's pkg cache")
-
-                # if the install succeeded and this was a postgres server then do workarounds
-                if (installProcess.returncode == 0) and (re.match('^.*postgresql[0-9]*-server.*$', createCmd['value'])):
-                    self.applyPostgresWorkaroundOnStart()
+                # the postgres workaround gives pgsql a uid based on this container's ip, so it cant be reused
+                for package in packages:
+                    if (re.match('^.*postgresql[0-9]*-server.*$', package)):
+                        caching = False
 
             elif (createCmd['type'] == "fileFolderMapping"):
+                # create the path to the source file/directory
+                source = self.getFileFolderMappingSource(createCmd)
+
                 # if first word of the source is "partition" then the file comes from the partition
                 if (re.match('^partition/', createCmd['source'])):
                     e_note('Copying Partition Data "' + createCmd['source'] + '" to "' + createCmd['target'] + '"')
 
-                    # create the path to the source file/directory
-                    source = TREDLY_PARTITIONS_MOUNT + "/" + self.partitionName + "/" + TREDLY_PTN_DATA_DIR_NAME + "/" + createCmd['source'].split('/', 1)[-1].rstrip()
-
                     # check if its a directory
                     if (os.path.isdir(source)):
                         # its a dir so add a trailing slash
@@ -2040,9 +2090,6 @@ class Container:
                 else:
                     e_note('Copying Container Data "' + createCmd['source'] + '" to "' + createCmd['target'] + '"')
 
-                    # create the path to the source file/directory
-                    source = builtins.tredlyFile.fileLocation.rstrip('/') + '/' + createCmd['source']
-
                 # set up the target
                 target = self.mountPoint + '/root' + createCmd['target']
                 targetDir = os.path.dirname(target)
@@ -2052,60 +2099,231 @@ class Container:
                     os.makedirs(targetDir)
 
                 # Copy the data in
-                cmd = ['cp', '-R', source, target]
-                process = Popen(cmd,  stdin=PIPE, stdout=PIPE, stderr=PIPE)
-                stdOut, stdErr = process.communicate()
+                copier = FileCopier(builtins.tredlyCommonConfig.copyWorkers)
 
-                if (process.returncode != 0):
+                if (not copier.copy(source, target)):
                     # errored
                     e_error("Failed to copy " + source + " to " + createCmd['target'])
-                    print(stdErr.decode('UTF-8').rstrip())
+                    print("\n".join(copier.errors))
+                    success = False
                 else:
                     # Success
-                    e_success("Success")
+                    e_success("Success, copied " + str(copier.filesCopied) + " files (" + str(copier.bytesCopied) + " bytes)")
             else:
                 e_warning("Unknown command " + createCmd['type'])
 
+            if (caching):
+                if (success):
+                    # cache the container as it is now for later builds
+                    self.buildCache.store(self.dataset, index)
+                else:
+                    # dont cache a failed command or anything run after it
+                    caching = False
+
+        if (self.buildCache.isEnabled()):
+            self.buildCache.finish(self.dataset)
+
+    # Action: get the path on the host that a fileFolderMapping copies from
+    #
+    # Pre:
+    # Post:
+    #
+    # Params: createCmd - the fileFolderMapping command
+    #
+    # Return: string
+    def getFileFolderMappingSource(self, createCmd):
+        # if first word of the source is "partition" then the file comes from the partition
+        if (re.match('^partition/', createCmd['source'])):
+            return TREDLY_PARTITIONS_MOUNT + "/" + self.partitionName + "/" + TREDLY_PTN_DATA_DIR_NAME + "/" + createCmd['source'].split('/', 1)[-1].rstrip()
+
+        return builtins.tredlyFile.fileLocation.rstrip('/') + '/' + createCmd['source']
+
+    # Action: set up the build cache for this container's onCreate commands
+    #
+    # Pre:
+    # Post:
+    #
+    # Params:
+    #
+    # Return: BuildCache object
+    def getBuildCache(self):
+        buildCache = BuildCache(self.releaseName, builtins.tredlyCommonConfig.buildCacheQuota)
+
+        # dont hash anything if the cache isnt in use
+        if (buildCache.isEnabled()):
+            for createCmd in self.onCreate:
+                if (createCmd['type'] == "fileFolderMapping"):
+                    buildCache.addStep(createCmd, self.getFileFolderMappingSource(createCmd))
+                else:
+                    buildCache.addStep(createCmd)
+
+        return buildCache
+
+    # Action: install packages within this container in a single pkg transaction
+    #
+    # Pre: container has been started
+    # Post: packages and their dependencies have been installed
+    #
+    # Params: packages - list of package names
+    #
+    # Return: True if all were installed, False otherwise
+    def installPackages(self, packages):
+        if (not self.updatePkgCatalogue()):
+            return False
+
+        e_note("Installing: " + ", ".join(packages) + " and their dependencies")
+
+        # first mount the pkg cache from the host
+        cacheMounted = True
+        cmd = ['mount_nullfs', PKG_CACHE_DIR, self.mountPoint + '/root' + PKG_CACHE_DIR]
+        process = Popen(cmd,  stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        stdOut, stdErr = process.communicate()
+        if (process.returncode != 0):
+            e_error("Failed to mount host's pkg cache")
+            cacheMounted = False
+
+        # proceed with install from the host
+        installed = []
+        cmd = ['pkg', '-j', 'trd-' + self.uuid, 'install', "-y"] + packages
+        process = Popen(cmd,  stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        stdOut, stdErr = process.communicate()
+        if (process.returncode == 0):
+            e_success("Success")
+            installed = packages
+        elif (len(packages) == 1):
+            # errored
+            print(str(stdErr))
+            e_error("Failed")
+        else:
+            # the transaction is all or nothing, so install them one at a time to find out which failed
+            e_warning("Failed to install packages together, installing them one at a time")
+
+            for package in packages:
+                e_note("Installing: " + package + " and its dependencies")
+
+                cmd = ['pkg', '-j', 'trd-' + self.uuid, 'install', "-y", package]
+                process = Popen(cmd,  stdin=PIPE, stdout=PIPE, stderr=PIPE)
+                stdOut, stdErr = process.communicate()
+                if (process.returncode != 0):
+                    # errored
+                    print(str(stdErr))
+                    e_error("Failed")
+                else:
+                    e_success("Success")
+                    installed.append(package)
+
+        # now unmount it
+        if (cacheMounted):
+            cmd = ['umount', self.mountPoint + '/root' + PKG_CACHE_DIR]
+            process = Popen(cmd,  stdin=PIPE, stdout=PIPE, stderr=PIPE)
+            stdOut, stdErr = process.communicate()
+            if (process.returncode != 0):
+                e_error("Failed to unmount host's pkg cache")
+
+        # if a postgres server was installed then do workarounds
+        for package in installed:
+            if (re.match('^.*postgresql[0-9]*-server.*$', package)):
+                self.applyPostgresWorkaroundOnStart()
+                break
+
+        return (len(installed) == len(packages))
+
+    # Action: make sure the host's package catalogue is fresh and this container has a copy of it
+    #
+    # Pre: container dataset exists
+    # Post: the host's catalogue has been updated if it is older than pkgUpdateTTL, and copied into the container if
+    #       the container's copy differs
+    #
+    # Params:
+    #
+    # Return: True if succeeded, False otherwise
+    def updatePkgCatalogue(self):
+        # another container may be updating the catalogue, so wait for it and then use its result
+        os.makedirs(os.path.dirname(PKG_UPDATE_STAMP), exist_ok=True)
+        with open(PKG_UPDATE_STAMP + ".lock", 'w') as lockFile:
+            fcntl.flock(lockFile, fcntl.LOCK_EX)
+
+            # pkg doesnt rewrite an up to date catalogue, so keep track of when it was last checked separately
+            try:
+                age = time.time() - os.path.getmtime(PKG_UPDATE_STAMP)
+            except OSError:
+                age = None
+
+            if (age is None) or (age < 0) or (age >= builtins.tredlyCommonConfig.pkgUpdateTTL):
+                e_note("Updating package database")
+                cmd = ['pkg', 'update']
+                process = Popen(cmd,  stdin=PIPE, stdout=PIPE, stderr=PIPE)
+                stdOut, stdErr = process.communicate()
+                if (process.returncode == 0):
+                    e_success("Success")
+
+                    with open(PKG_UPDATE_STAMP, 'w'):
+                        pass
+                    os.utime(PKG_UPDATE_STAMP)
+                else:
+                    e_error("Failed")
+                    print(stdErr)
+
+        # pkg keeps the catalogue in the same directory as the database of installed packages, so the container
+        # needs its own copy. only copy it when it has changed
+        containerCatalogue = self.mountPoint + "/root" + PKG_CATALOGUE
+        try:
+            hostStat = os.stat(PKG_CATALOGUE)
+        except OSError:
+            e_error("Host's pkg catalogue " + PKG_CATALOGUE + " not found")
+            return False
+
+        try:
+            containerStat = os.stat(containerCatalogue)
+            if (containerStat.st_size == hostStat.st_size) and (int(containerStat.st_mtime) == int(hostStat.st_mtime)):
+                return True
+        except OSError:
+            pass
+
+        e_note("Updating container's pkg catalogue")
+        try:
+            os.makedirs(os.path.dirname(containerCatalogue), exist_ok=True)
+            # keep the modification time so that the next check can tell whether it has changed
+            shutil.copy2(PKG_CATALOGUE, containerCatalogue)
+        except OSError as e:
+            e_error("Failed")
+            print(str(e))
+            return False
+
+        e_success("Success")
+        return True
+
     # Action: run a command within this container
     #
     # Pre: container dataset exists and has been started
-    # Post: the given command has been run within the container
+    # Post: the given command has been run within the container, its output appended to the container's command log
+    #       and its result appended to self.commandResults
     #
     # Params: command - the command to run (string)
     #         showOutputOnError - true if you want to print all errors to stdout, false to hide
     #
     # Return: True if succeeded, False otherwise
     def runCmd(self, command, showOutputOnError = True):
+        # commands are only limited if the host sets commandTimeout. exec.timeout is for jail(8)'s own scripts
+        timeout = None
+        if (builtins.tredlyCommonConfig.commandTimeout > 0):
+            timeout = builtins.tredlyCommonConfig.commandTimeout
 
-        # use temporary files instead of PIPE so that processes dont hang (eg "service postgresql start")
-        stdOutFd, stdOutPath = tempfile.mkstemp()
-        stdErrFd, stdErrPath = tempfile.mkstemp()
+        logPath = self.mountPoint + "/" + TREDLY_CONTAINER_LOG_DIR + "/" + CONTAINER_COMMAND_LOG
+        runner = CommandRunner(logPath, timeout)
 
         # add a jexec to the start of the command and run it in a shell inside the container
-        command = ['jexec', 'trd-' + self.uuid, 'sh', '-c', command]
-
-        # run the command, sending the output to our temporary files
-        process = Popen(command, stdin=PIPE, stdout=stdOutFd, stderr=stdOutFd)
+        result = runner.run(['jexec', 'trd-' + self.uuid, 'sh', '-c', command], command)
+        self.commandResults.append(result)
 
-        # get return code
-        process.communicate()
-
-        # open temp files for reading
-        with io.open(stdOutPath,'r', encoding='utf8') as stdOutFile:
-            stdOut = stdOutFile.read()
-        with io.open(stdErrPath,'r', encoding='utf8') as stdErrFile:
-            stdErr = stdErrFile.read()
-
-        # delete the files
-        os.remove(stdOutPath)
-        os.remove(stdErrPath)
-
-        # if it errored, then print out stdout and stderr
-        if (process.returncode != 0):
+        # if it errored, then print out the end of its output
+        if (result['timedOut']) or (result['returnCode'] != 0):
             if (showOutputOnError):
-                # print stdout and stderr
-                print(stdOut)
-                print(stdErr)
+                if (result['timedOut']):
+                    e_error("Command timed out after " + str(timeout) + " seconds: " + command)
+
+                print("\n".join(runner.tail))
+                print("Full output is in " + logPath)
             return False
 
         return True
@@ -2242,20 +2460,29 @@ class Container:
         layer7Proxy = Layer7Proxy()
 
         urlIncludes = []
-
-        # check if a whitelist exists and whitelist each url
-        if (len(self.ipv4Whitelist) > 0):
-            urlIncludes.append('/usr/local/etc/nginx/access/' + nginxFormatFilename(self.uuid))
+        accessVariable = None
 
         # get the partition whitelist
         zfsPartition = ZFSDataset('zroot/tredly/ptn/' + self.partitionName)
         ptnWhitelist = zfsPartition.getArray(ZFS_PROP_ROOT + '.ptn_ip4whitelist')
-        # include the ptn whitelist if it has elements
-        if (len(ptnWhitelist) > 0):
-            urlIncludes.append('/usr/local/etc/nginx/access/ptn_' + nginxFormatFilename(self.partitionName))
+
+        if (builtins.tredlyCommonConfig.httpProxyAccessMode == "geo"):
+            # each url checks this containers geo map
+            accessVariable = layer7Proxy.getGeoVariable(self.uuid)
+        else:
+            # check if a whitelist exists and whitelist each url
+            if (len(self.ipv4Whitelist) > 0):
+                urlIncludes.append('/usr/local/etc/nginx/access/' + nginxFormatFilename(self.uuid))
+
+            # include the ptn whitelist if it has elements
+            if (len(ptnWhitelist) > 0):
+                urlIncludes.append('/usr/local/etc/nginx/access/ptn_' + nginxFormatFilename(self.partitionName))
+
+        # the urls to register in the proxy, and the domains to register in DNS
+        proxyUrls = []
+        urlDomains = []
 
         for urlObj in self.urls:
-            e_note("Setting up URL " + urlObj['url'])
             # Set some values for http/https
             if (urlObj['cert'] is not None):
                 sslCert = "ssl/" + self.partitionName + "/" + urlObj['cert'].split('/')[-1] + "/server.crt"
@@ -2269,28 +2496,60 @@ class Container:
             # split up the domain and directory parts of the url
             if ('/' in urlObj['url'].rstrip('/')):
                 urlDomain = urlObj['url'].split('/', 1)[0]
-                urlDirectory = '/' + urlObj['url'].split('/', 1)[1]
             else:
                 urlDomain = urlObj['url']
-                urlDirectory = '/'
 
-            # set up the filenames
-            servernameFilename = protocol + '-' + nginxFormatFilename(urlDomain.rstrip('/'))
-            upstreamFilename = protocol + '-' + nginxFormatFilename(urlObj['url'].rstrip('/'))
+            proxyUrls.append({
+                'url': urlObj['url'],
+                'maxFileSize': urlObj['maxFileSize'],
+                'websocket': urlObj['enableWebsocket'],
+                'servernameFilename': protocol + '-' + nginxFormatFilename(urlDomain.rstrip('/')),
+                'upstreamFilename': protocol + '-' + nginxFormatFilename(urlObj['url'].rstrip('/')),
+                'errorResponse': urlObj['errorResponse'],
+                'sslCert': sslCert,
+                'sslKey': sslKey,
+                # containers created before these options existed wont have them
+                'keepalive': urlObj.get('keepalive', 0),
+                'keepaliveTimeout': urlObj.get('keepaliveTimeout'),
+                'keepaliveRequests': urlObj.get('keepaliveRequests'),
+                'cache': urlObj.get('cache'),
+                'loadBalancing': urlObj.get('loadBalancing'),
+                'ocspStapling': urlObj.get('ocspStapling'),
+                'gzip': urlObj.get('gzip')
+            })
+
+            if (urlDomain not in urlDomains):
+                urlDomains.append(urlDomain)
+
+        # register all of the urls at once, so that each server_name file is only written once per domain
+        if (len(proxyUrls) > 0):
+            if (accessVariable is not None):
+                # the container whitelist takes precedence over the partition's, as the first included access file
+                # does in allow mode
+                if (len(self.ipv4Whitelist) > 0):
+                    whitelist = self.ipv4Whitelist
+                else:
+                    whitelist = list(ptnWhitelist.values())
 
-            # register this URL
-            if (not layer7Proxy.registerUrl(urlObj['url'], str(self.containerInterfaces[0].ip4Addrs[0].ip), urlObj['maxFileSize'], urlObj['enableWebsocket'], servernameFilename, upstreamFilename, urlObj['errorResponse'], sslCert, sslKey, urlIncludes)):
-                e_error("Failed to register url " + urlObj['url'])
+                if (not layer7Proxy.registerGeoWhitelist(self.partitionName, self.uuid, whitelist)):
+                    e_error("Failed to register whitelist")
 
-            # add container whitelist
-            if (len(self.ipv4Whitelist) > 0):
-                layer7Proxy.registerAccessFile('/usr/local/etc/nginx/access/' + self.uuid, self.ipv4Whitelist, True)
+            e_note("Setting up URLs " + ', '.join([urlObj['url'] for urlObj in self.urls]))
+            if (layer7Proxy.registerUrls(proxyUrls, str(self.containerInterfaces[0].ip4Addrs[0].ip), urlIncludes, self.partitionName, accessVariable)):
+                e_success("Success")
+            else:
+                e_error("Failed to register urls")
 
-            # set the partition whitelist access file
-            if (len(ptnWhitelist) > 0):
-                layer7Proxy.registerAccessFile('/usr/local/etc/nginx/access/ptn_' + self.partitionName, ptnWhitelist.values(), True)
+            if (accessVariable is None):
+                # add container whitelist
+                if (len(self.ipv4Whitelist) > 0):
+                    layer7Proxy.registerAccessFile('/usr/local/etc/nginx/access/' + self.uuid, self.ipv4Whitelist, True)
 
+                # set the partition whitelist access file
+                if (len(ptnWhitelist) > 0):
+                    layer7Proxy.registerAccessFile('/usr/local/etc/nginx/access/ptn_' + self.partitionName, ptnWhitelist.values(), True)
 
+        for urlDomain in urlDomains:
             # Register this URL in DNS
             e_note("Registering " + urlDomain + " in DNS")
 
@@ -2308,9 +2567,11 @@ class Container:
                 e_success("Success")
             else:
                 e_error("Failed")
+            self.dnsUpdates.queue(unboundFile)
 
+        for urlObj in self.urls:
             # check if a cert wqs issued for the url, and if so then create a http redirect
-            if (sslCert is None):
+            if (urlObj['cert'] is None):
                 redirectToProtocol = "http"
             else:
                 redirectToProtocol = "https"
@@ -2364,6 +2625,11 @@ class Container:
                     e_success("Success")
                 else:
                     e_error("Failed")
+                self.dnsUpdates.queue(unboundFile)
+
+        # nothing to reload if none of the files changed
+        if (not layer7Proxy.changed):
+            return True
 
         e_note("Reloading layer 7 (HTTP) proxy")
         if (layer7Proxy.reload()):
@@ -2409,8 +2675,11 @@ class Container:
                 else:
                     e_error("Could not add port " + str(udpInPort) + "udp to Layer 4 Proxy. Does a rule already exist for this port?")
 
-            # write out the layer 4 proxy file and run it if it succeeded, returning hte value
+            # write out the layer 4 proxy file and run it if it changed, returning hte value
             if (layer4Proxy.write()):
+                if (not layer4Proxy.changed):
+                    return True
+
                 return layer4Proxy.reload()
 
             return False
@@ -0,0 +1,270 @@
+# Purpose: Stores a container's metadata as a single versioned JSON record in ZFS
+#
+# The record lives in ZFS_PROP_META, and is split into the ZFS array com.tredly.meta if it is too large for one
+# property. Each property is stored in one place only. Those that the bash tools or the host index read or write
+# stay in the legacy com.tredly:<name> and com.tredly.<name>:<N> layout, and everything else is held in the record.
+# The legacy layout is also used as a fallback for containers whose record is missing or doesnt hold a property.
+
+import json
+from collections import OrderedDict
+
+from includes.defines import *
+from includes.output import *
+
+class ContainerMeta:
+    # scalar properties kept in the legacy layout as com.tredly:<name>. the bash tools read all of these (container
+    # exists/list/modify and the partition whitelists), the host index reads the names and groups, and bash modify
+    # writes maxram and maxcpu
+    LEGACY_PROPERTIES = [
+        'host_hostuuid', 'containername', 'containergroupname', 'maxram', 'maxcpu', 'buildepoch', 'persistentstorageid'
+    ]
+
+    # arrays kept in the legacy layout as com.tredly.<name>:<N>, as the host index looks containers up by them and
+    # the bash partition whitelists read the urls
+    LEGACY_ARRAYS = ['url', 'url_cert', 'redirect_url']
+
+    # scalar properties held in the record
+    PROPERTIES = [
+        'partition', 'mountpoint', 'maxhdd', 'securelevel', 'devfs_ruleset', 'enforce_statfs', 'children_max',
+        'allow_set_hostname', 'allow_sysvipc', 'allow_raw_sockets', 'allow_chflags', 'allow_mount',
+        'allow_mount_devfs', 'allow_mount_nullfs', 'allow_mount_procfs', 'allow_mount_tmpfs', 'allow_mount_zfs',
+        'allow_quotas', 'allow_socket_af', 'exec_prestart', 'exec_poststart', 'exec_prestop', 'exec_start',
+        'exec_stop', 'exec_clean', 'exec_timeout', 'exec_fib', 'stop_timeout', 'mount_devfs', 'mount_fdescfs', 'ip4',
+        'ip4_saddrsel', 'domainname', 'nginx_accessfile_dir', 'nginx_servername_dir', 'nginx_upstream_dir',
+        'releasename', 'persistentmountpoint', 'persistentdataset', 'startorder'
+    ]
+
+    # arrays held in the record
+    ARRAYS = ['dns', 'jsonurls', 'nginx_upstream', 'nginx_servername', 'registered_dns_names']
+
+    # Constructor
+    #
+    # zfsDataset should be a ZFSDataset in snapshot mode so that the record and the legacy fallback come from
+    # a single zfs get
+    def __init__(self, zfsDataset):
+        self.zfsDataset = zfsDataset
+        self.record = None          # dict with version, properties and arrays. None if not loaded/found
+
+    # Action: load the record from ZFS
+    #
+    # Pre:
+    # Post: self.record has been populated if a record this version of tredly understands was found
+    #
+    # Params:
+    #
+    # Return: True if a record was loaded, False otherwise
+    def load(self):
+        self.record = None
+
+        value = self.zfsDataset.getProperty(ZFS_PROP_META)
+
+        if (value is None):
+            return False
+
+        try:
+            record = json.loads(value)
+
+            # large records are split over an array, with a header in the main property
+            if ('chunks' in record.keys()):
+                chunks = list(self.zfsDataset.getArray(ZFS_PROP_ROOT + '.meta').values())
+
+                if (len(chunks) != record['chunks']):
+                    e_warning("Metadata for " + self.zfsDataset.dataset + " is incomplete, using legacy properties")
+                    return False
+
+                record = json.loads(''.join(chunks))
+        except (ValueError, AttributeError, TypeError):
+            e_warning("Failed to parse metadata for " + self.zfsDataset.dataset + ", using legacy properties")
+            return False
+
+        # ignore records written by a newer version of tredly, the legacy properties are still valid
+        if (not isinstance(record.get('version'), int)) or (record['version'] > CONTAINER_META_VERSION):
+            return False
+
+        record.setdefault('properties', {})
+        record.setdefault('arrays', {})
+
+        self.record = record
+
+        return True
+
+    # Action: write the record to ZFS
+    #
+    # Pre:
+    # Post: ZFS_PROP_META (and its chunks if needed) have been set
+    #
+    # Params:
+    #
+    # Return: True if succeeded, False otherwise
+    def save(self):
+        record = self.__getRecord()
+        record['version'] = CONTAINER_META_VERSION
+
+        value = json.dumps(record, separators=(',',':'), sort_keys=True)
+
+        # write the record in one zfs transaction unless the caller is already batching
+        commit = (self.zfsDataset.batch is None)
+        self.zfsDataset.beginBatch()
+
+        # remove chunks from a previous, larger record
+        self.zfsDataset.unsetArray(ZFS_PROP_ROOT + '.meta')
+
+        if (len(value) <= ZFS_META_CHUNK_SIZE):
+            self.zfsDataset.setProperty(ZFS_PROP_META, value)
+        else:
+            chunks = [value[i:i + ZFS_META_CHUNK_SIZE] for i in range(0, len(value), ZFS_META_CHUNK_SIZE)]
+
+            for chunk in chunks:
+                self.zfsDataset.appendArray(ZFS_PROP_ROOT + '.meta', chunk)
+
+            self.zfsDataset.setProperty(ZFS_PROP_META, json.dumps({'version': CONTAINER_META_VERSION, 'chunks': len(chunks)}, separators=(',',':')))
+
+        if (commit):
+            return self.zfsDataset.commitBatch()
+
+        return True
+
+    # Action: create the record from the legacy properties
+    #
+    # Pre:
+    # Post: a record exists for this container
+    #
+    # Params:
+    #
+    # Return: True if succeeded or a record already existed, False otherwise
+    def migrate(self):
+        if (self.load()):
+            return True
+
+        self.record = {'version': CONTAINER_META_VERSION, 'properties': {}, 'arrays': {}}
+
+        for name in ContainerMeta.PROPERTIES:
+            value = self.zfsDataset.getProperty(ZFS_PROP_ROOT + ':' + name)
+
+            if (value is not None):
+                self.record['properties'][name] = value
+
+        for name in ContainerMeta.ARRAYS:
+            values = list(self.zfsDataset.getArray(ZFS_PROP_ROOT + '.' + name).values())
+
+            if (len(values) > 0):
+                self.record['arrays'][name] = values
+
+        return self.save()
+
+    # Action: get a property, from the record if it holds it or from the legacy property if not
+    #
+    # Pre:
+    # Post:
+    #
+    # Params: name - the property name without the com.tredly: prefix
+    #
+    # Return: string, or None if not set
+    def getProperty(self, name):
+        # records written by older versions of tredly may hold a copy of these, which bash wont have kept up to date
+        if (name in ContainerMeta.LEGACY_PROPERTIES):
+            return self.zfsDataset.getProperty(ZFS_PROP_ROOT + ':' + name)
+
+        record = self.__getRecord()
+
+        if (name in record['properties'].keys()):
+            return record['properties'][name]
+
+        return self.zfsDataset.getProperty(ZFS_PROP_ROOT + ':' + name)
+
+    # Action: get an array, from the record if it holds it or from the legacy array if not
+    #
+    # Pre:
+    # Post:
+    #
+    # Params: name - the array name without the com.tredly. prefix
+    #
+    # Return: OrderedDict of index -> value, in the same form as ZFSDataset.getArray()
+    def getArray(self, name):
+        if (name in ContainerMeta.LEGACY_ARRAYS):
+            return self.zfsDataset.getArray(ZFS_PROP_ROOT + '.' + name)
+
+        record = self.__getRecord()
+
+        if (name in record['arrays'].keys()):
+            return OrderedDict((str(index), value) for index, value in enumerate(record['arrays'][name]))
+
+        return self.zfsDataset.getArray(ZFS_PROP_ROOT + '.' + name)
+
+    # Action: get an array of json values as a list of objects
+    #
+    # Pre:
+    # Post:
+    #
+    # Params: name - the array name without the com.tredly. prefix
+    #
+    # Return: list of objects
+    def getJsonArray(self, name):
+        return [json.loads(value) for value in self.getArray(name).values()]
+
+    # Action: set a property in the record, or in the legacy layout if other tools read it
+    #
+    # Pre:
+    # Post: property has been set. save() must be called to write the record
+    #
+    # Params: name - the property name without the com.tredly: prefix
+    #         value - the value to set it to
+    #
+    # Return: True if succeeded, False otherwise
+    def setProperty(self, name, value):
+        if (name in ContainerMeta.LEGACY_PROPERTIES):
+            return self.zfsDataset.setProperty(ZFS_PROP_ROOT + ':' + name, value)
+
+        self.__getRecord()['properties'][name] = value
+
+        return True
+
+    # Action: append a value to an array in the record, or in the legacy layout if other tools read it
+    #
+    # Pre:
+    # Post: value has been appended. save() must be called to write the record
+    #
+    # Params: name - the array name without the com.tredly. prefix
+    #         value - the value to append
+    #
+    # Return: True if succeeded, False otherwise
+    def appendArray(self, name, value):
+        if (name in ContainerMeta.LEGACY_ARRAYS):
+            return self.zfsDataset.appendArray(ZFS_PROP_ROOT + '.' + name, value)
+
+        record = self.__getRecord()
+
+        # carry over anything already in the legacy array so the record doesnt lose it
+        if (name not in record['arrays'].keys()):
+            record['arrays'][name] = list(self.zfsDataset.getArray(ZFS_PROP_ROOT + '.' + name).values())
+
+        record['arrays'][name].append(value)
+
+        return True
+
+    # Action: turn an object into json and append it to an array
+    #
+    # Pre:
+    # Post: value has been appended. save() must be called to write the record
+    #
+    # Params: name - the array name without the com.tredly. prefix
+    #         value - the object to append
+    #
+    # Return: True if succeeded, False otherwise
+    def appendJsonArray(self, name, value):
+        return self.appendArray(name, json.dumps(value, separators=(',',':')))
+
+    # Action: get the record, loading it or starting a new one if needed
+    #
+    # Pre:
+    # Post:
+    #
+    # Params:
+    #
+    # Return: dict
+    def __getRecord(self):
+        if (self.record is None):
+            if (not self.load()):
+                self.record = {'version': CONTAINER_META_VERSION, 'properties': {}, 'arrays': {}}
+
+        return self.record
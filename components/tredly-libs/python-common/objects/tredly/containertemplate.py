@@ -0,0 +1,166 @@
+# A class to manage the per release template that new containers are cloned from
+#
+# The template holds the container skeleton - the default directories and files, and the directories copied in from
+# the release. It is built once per release and snapshotted, and containers are then created with a zfs clone of that
+# snapshot so they share its blocks. Only the per container files are written after cloning. Re-fetching a release
+# recreates its dataset, so templates are named after the release dataset's guid as well as the release name, and
+# the next build after a re-fetch builds a new template from the new release.
+import os
+import fcntl
+from subprocess import Popen, PIPE
+
+from objects.zfs.zfs import ZFSDataset
+from includes.defines import *
+from includes.output import *
+
+# Action: get the guid of a release's dataset, which changes whenever the release is re-fetched
+#
+# Pre:
+# Post:
+#
+# Params: releaseName - the name of the release
+#
+# Return: string, or None if the release doesnt exist
+def getReleaseGuid(releaseName):
+    return ZFSDataset(ZFS_TREDLY_RELEASES_DATASET + "/" + releaseName).getProperty('guid')
+
+class ContainerTemplate:
+
+    # Constructor
+    def __init__(self, releaseName):
+        self.releaseName = releaseName
+        self.releaseGuid = getReleaseGuid(releaseName)
+
+        # include the version so that a changed skeleton gets a new template rather than modifying one in use, and
+        # the release's guid so that a re-fetched release does too
+        name = releaseName + "-" + str(CONTAINER_TEMPLATE_VERSION) + "-" + str(self.releaseGuid)
+        self.dataset = ZFS_TREDLY_TEMPLATES_DATASET + "/" + name
+        self.mountPoint = TREDLY_TEMPLATES_MOUNT + "/" + name
+
+    # Action: make sure the template for this release has been built and snapshotted
+    #
+    # Pre: release has been downloaded
+    # Post: the template snapshot exists
+    #
+    # Params:
+    #
+    # Return: True if the template is ready to clone, False otherwise
+    def prepare(self):
+        if (self.releaseGuid is None) or (not os.path.isdir(TREDLY_RELEASES_MOUNT + "/" + self.releaseName + "/root")):
+            e_warning("Release " + self.releaseName + " not found, cannot build container template")
+            return False
+
+        zfsTemplate = ZFSDataset(self.dataset, self.mountPoint)
+
+        if (zfsTemplate.snapshotExists(CONTAINER_TEMPLATE_SNAPSHOT)):
+            return True
+
+        os.makedirs(os.path.dirname(CONTAINER_TEMPLATE_LOCK), exist_ok=True)
+
+        # only one process may build the template
+        with open(CONTAINER_TEMPLATE_LOCK, 'w') as lockFile:
+            fcntl.flock(lockFile, fcntl.LOCK_EX)
+
+            # another process may have built it while we waited for the lock
+            if (zfsTemplate.snapshotExists(CONTAINER_TEMPLATE_SNAPSHOT)):
+                return True
+
+            e_note("Building container template for " + self.releaseName)
+
+            # remove anything left over from a build that didnt finish. nothing can be cloned from it as it has no snapshot
+            if (not zfsTemplate.destroy(True)):
+                return False
+
+            if (not zfsTemplate.create()):
+                e_error("Failed to create template dataset " + self.dataset)
+                return False
+
+            zfsTemplate.mount()
+
+            if (not self.populate(self.mountPoint)) or (not zfsTemplate.takeSnapshot(CONTAINER_TEMPLATE_SNAPSHOT)):
+                e_error("Failed")
+                zfsTemplate.destroy(True)
+                return False
+
+            e_success("Success")
+
+        return True
+
+    # Action: create a container dataset as a clone of the template
+    #
+    # Pre: prepare() has succeeded
+    # Post: dataset exists and contains the container skeleton
+    #
+    # Params: dataset - the container's dataset
+    #         mountPoint - the container's mountpoint
+    #
+    # Return: True if succeeded, False otherwise
+    def clone(self, dataset, mountPoint):
+        zfsTemplate = ZFSDataset(self.dataset, self.mountPoint)
+
+        if (not zfsTemplate.cloneSnapshot(CONTAINER_TEMPLATE_SNAPSHOT, dataset, mountPoint)):
+            return False
+
+        # make sure it is mounted
+        zfsContainer = ZFSDataset(dataset, mountPoint)
+        zfsContainer.mount()
+
+        return True
+
+    # Action: create the container skeleton within a directory
+    #
+    # Pre:
+    # Post: default directories and files have been created and the release directories copied in
+    #
+    # Params: mountPoint - the directory to create it in
+    #
+    # Return: True if succeeded, False otherwise
+    def populate(self, mountPoint):
+        success = True
+
+        # create log dir within container
+        cmd = ['mkdir', '-p', mountPoint + "/" + TREDLY_CONTAINER_LOG_DIR]
+        process = Popen(cmd,  stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        stdOut, stdErr = process.communicate()
+        if (process.returncode != 0):
+            e_error("Failed to create container log directory ")
+            success = False
+
+        # combine lists of directories to create
+        createDirs = CONTAINER_CREATE_DIRS + CONTAINER_BASEDIRS
+
+        # set up some default directories
+        for dir in createDirs:
+            process = Popen(['mkdir', '-p', mountPoint + "/root" + dir],  stdin=PIPE, stdout=PIPE, stderr=PIPE)
+            stdOut, stdErr = process.communicate()
+            rc = process.returncode
+            if (rc != 0):
+                e_error("Failed to create container directory " + dir)
+                success = False
+
+        # and touch some files
+        for file in CONTAINER_CREATE_FILES:
+            cmd = ['touch', mountPoint + "/root" + file]
+            process = Popen(cmd,  stdin=PIPE, stdout=PIPE, stderr=PIPE)
+            stdOut, stdErr = process.communicate()
+            rc = process.returncode
+            if (rc != 0):
+                e_error("Failed to create container file " + file)
+                success = False
+
+        # copy in some useful directories from the release
+        for dir in CONTAINER_COPY_DIRS:
+            cmd1 = ['find', "."]
+            findCmd = Popen(cmd1, cwd=TREDLY_RELEASES_MOUNT + "/" + self.releaseName + "/root" + dir, stdout=PIPE)
+
+            cmd2= ['cpio', '-dp', '--quiet', mountPoint + "/root" + dir]
+            cpioCmd = Popen(cmd2, cwd=TREDLY_RELEASES_MOUNT + "/" + self.releaseName + "/root" + dir, stdin=findCmd.stdout, stdout=PIPE)
+            findCmd.stdout.close()
+            stdOut, stdErr = cpioCmd.communicate()
+            findCmd.wait()
+
+            if (findCmd.returncode != 0) or (cpioCmd.returncode != 0):
+                e_error("Failed to copy container directory " + dir)
+                success = False
+
+        return success
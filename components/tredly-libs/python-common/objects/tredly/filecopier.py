@@ -0,0 +1,144 @@
+# A class to copy files and directory trees in process, with the same results as "cp -R"
+#
+# Directories are walked with os.scandir and created as they are found, and files are copied on a pool of threads.
+# Files are copied with os.copy_file_range where python and the OS support it, which lets the filesystem clone blocks
+# rather than copy them (eg OpenZFS block cloning), and otherwise with large reads and writes. Modes are preserved and
+# symbolic links are copied as links.
+import os
+import stat
+import errno
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+# bytes to copy per call
+COPY_CHUNK_SIZE = 8388608
+
+class FileCopier:
+
+    # Constructor
+    def __init__(self, workers):
+        self.workers = workers      # the number of files to copy at the same time
+        self.filesCopied = 0        # totals from the last copy()
+        self.bytesCopied = 0
+        self.errors = []            # list of error messages from the last copy()
+
+    # Action: copy a file or directory
+    #
+    # Pre: source exists
+    # Post: source has been copied to target. a source ending in / has its contents copied into target, a directory
+    #       copied onto an existing directory is copied within it
+    #
+    # Params: source - the file or directory to copy
+    #         target - where to copy it to
+    #
+    # Return: True if everything was copied, False otherwise
+    def copy(self, source, target):
+        self.filesCopied = 0
+        self.bytesCopied = 0
+        self.errors = []
+
+        contents = source.endswith('/')
+        source = source.rstrip('/') or '/'
+
+        try:
+            sourceStat = os.lstat(source)
+        except OSError as e:
+            self.errors.append(str(e))
+            return False
+
+        # copying onto an existing directory puts the source inside it
+        if (not contents) and (os.path.isdir(target)):
+            target = os.path.join(target, os.path.basename(source))
+
+        if (not stat.S_ISDIR(sourceStat.st_mode)):
+            try:
+                self.bytesCopied = self.__copyEntry(source, target, sourceStat.st_mode)
+                self.filesCopied = 1
+            except OSError as e:
+                self.errors.append(str(e))
+
+            return (len(self.errors) == 0)
+
+        # directory modes are set once their contents have been written, in case they arent writable
+        directories = []
+        futures = []
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = [(source, target, sourceStat.st_mode)]
+
+            while (len(pending) > 0):
+                sourceDir, targetDir, mode = pending.pop()
+
+                try:
+                    os.makedirs(targetDir, exist_ok=True)
+                    directories.append((targetDir, mode))
+
+                    for entry in os.scandir(sourceDir):
+                        entryTarget = os.path.join(targetDir, entry.name)
+
+                        if (entry.is_dir(follow_symlinks=False)):
+                            pending.append((entry.path, entryTarget, entry.stat(follow_symlinks=False).st_mode))
+                        else:
+                            futures.append(executor.submit(self.__copyEntry, entry.path, entryTarget, entry.stat(follow_symlinks=False).st_mode))
+                except OSError as e:
+                    self.errors.append(str(e))
+
+            for future in futures:
+                try:
+                    self.bytesCopied += future.result()
+                    self.filesCopied += 1
+                except OSError as e:
+                    self.errors.append(str(e))
+
+        # deepest first so that a read only parent doesnt stop its children being updated
+        for targetDir, mode in reversed(directories):
+            try:
+                os.chmod(targetDir, stat.S_IMODE(mode))
+            except OSError as e:
+                self.errors.append(str(e))
+
+        return (len(self.errors) == 0)
+
+    # Action: copy a single file or symbolic link
+    #
+    # Pre: the directory target is in exists
+    # Post: target is a copy of source with the same mode
+    #
+    # Params: source - the file to copy
+    #         target - the file to create
+    #         mode - the mode of source
+    #
+    # Return: the number of bytes copied
+    def __copyEntry(self, source, target, mode):
+        if (stat.S_ISLNK(mode)):
+            if (os.path.lexists(target)):
+                os.unlink(target)
+            os.symlink(os.readlink(source), target)
+            return 0
+
+        # dont block on fifos or read from devices
+        if (not stat.S_ISREG(mode)):
+            raise OSError(errno.EINVAL, "Not a regular file", source)
+
+        copied = 0
+
+        with open(source, 'rb') as sourceFile, open(target, 'wb') as targetFile:
+            if (hasattr(os, 'copy_file_range')):
+                try:
+                    while True:
+                        written = os.copy_file_range(sourceFile.fileno(), targetFile.fileno(), COPY_CHUNK_SIZE)
+                        if (written == 0):
+                            break
+                        copied += written
+                except OSError as e:
+                    # not supported between these files, so copy it ourselves if nothing has been written yet
+                    if (copied > 0) or (e.errno not in [errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP]):
+                        raise
+
+            if (copied == 0):
+                shutil.copyfileobj(sourceFile, targetFile, COPY_CHUNK_SIZE)
+                copied = targetFile.tell()
+
+        os.chmod(target, stat.S_IMODE(mode))
+
+        return copied
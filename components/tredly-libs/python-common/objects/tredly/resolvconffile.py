@@ -2,12 +2,15 @@
 import os.path
 import re
 
+from objects.config.configwriter import ConfigWriter
+
 class ResolvConfFile:
     # Constructor
     def __init__(self, filePath = '/etc/resolv.conf', search = [], servers = []):
         self.filePath = filePath
         self.search = search
         self.nameservers = servers
+        self.changed = False    # whether the last write() changed the file
     
     # Action: reads resolv.conf file, and stores parsed lines to self
     #
@@ -63,14 +66,17 @@ class ResolvConfFile:
     # Action: writes out a resolv.conf file
     #
     # Pre: this object exists
-    # Post: this object has been written to self.filePath in the resolv.conf format
+    # Post: this object has been written to self.filePath in the resolv.conf format if it changed, and self.changed set
     #
     # Params:
     #
     # Return: True if successful, False otherwise
     def write(self):
+        writer = ConfigWriter(self.filePath)
+        self.changed = False
+
         try:
-            with open(self.filePath, 'w') as resolvConf:
+            with writer as resolvConf:
                 searchLine = 'search'
                 for search in self.search:
                     # append the dns search path to the variable
@@ -83,9 +89,10 @@ class ResolvConfFile:
                 for nameserver in self.nameservers:
                     # write the line to the file
                     print('nameserver ' + nameserver, file=resolvConf)
-                
-                return True
         except IOError:
             return False
-        return False
+
+        self.changed = writer.changed
+
+        return True
     
\ No newline at end of file
@@ -0,0 +1,127 @@
+# A class to coalesce reloads of host services (nginx, unbound, layer 4 proxy)
+#
+# While reloads are deferred, each service is reloaded at most once when flush() is called, no matter how many
+# containers requested it. When not deferred, a request reloads the service immediately as before.
+# tredly-build and tredly-host defer reloads for the whole action, so an action reloads each service once at the end.
+#
+# A service can be given a check command (eg nginx -t) which must succeed before it is reloaded, so that a broken
+# config is reported and the running config stays in place.
+import threading
+from subprocess import Popen, PIPE
+from collections import OrderedDict
+
+from includes.output import *
+
+class ServiceReload:
+    # shared by every object in this process
+    deferDepth = 0
+    pending = OrderedDict()     # service name -> (command, check command)
+    lock = threading.RLock()
+
+    # Action: start deferring reloads
+    #
+    # Pre:
+    # Post: reloads requested until the matching flush() are queued
+    #
+    # Params:
+    #
+    # Return:
+    def defer(self):
+        with ServiceReload.lock:
+            ServiceReload.deferDepth += 1
+
+    # Action: request that a service be reloaded
+    #
+    # Pre:
+    # Post: the service has been reloaded, or queued if reloads are deferred
+    #
+    # Params: name - name of the service, used to coalesce requests
+    #         cmd - the command to run to reload it
+    #         checkCmd - command to validate the service's config before reloading, or None
+    #
+    # Return: True if succeeded or queued, False otherwise
+    def request(self, name, cmd, checkCmd = None):
+        with ServiceReload.lock:
+            if (ServiceReload.deferDepth > 0):
+                ServiceReload.pending[name] = (cmd, checkCmd)
+                return True
+
+        return self.reload(name, cmd, checkCmd)
+
+    # Action: stop deferring and run the queued reloads
+    #
+    # Pre: defer() has been called
+    # Post: once the outermost deferral ends, each queued service has been reloaded once
+    #
+    # Params:
+    #
+    # Return: True if all reloads succeeded, False otherwise
+    def flush(self):
+        with ServiceReload.lock:
+            ServiceReload.deferDepth = max(0, ServiceReload.deferDepth - 1)
+
+            # an outer deferral is still running so it will do the reloads
+            if (ServiceReload.deferDepth > 0):
+                return True
+
+        return self.reloadPending()
+
+    # Action: run the queued reloads now, without ending any deferral
+    #
+    # Pre:
+    # Post: each queued service has been reloaded once and the queue is empty
+    #
+    # Params:
+    #
+    # Return: True if all reloads succeeded, False otherwise
+    def reloadPending(self):
+        with ServiceReload.lock:
+            pending = ServiceReload.pending
+            ServiceReload.pending = OrderedDict()
+
+        success = True
+        for name, (cmd, checkCmd) in pending.items():
+            e_note("Reloading " + name)
+            if (self.reload(name, cmd, checkCmd)):
+                e_success("Success")
+            else:
+                e_error("Failed")
+                success = False
+
+        return success
+
+    # Action: check a service's config and reload it
+    #
+    # Pre:
+    # Post: the service has been reloaded if its config passed the check
+    #
+    # Params: name - name of the service
+    #         cmd - the command to run to reload it
+    #         checkCmd - command to validate the service's config before reloading, or None
+    #
+    # Return: True if succeeded, False otherwise
+    def reload(self, name, cmd, checkCmd = None):
+        if (checkCmd is not None):
+            process = Popen(checkCmd, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+            stdOut, stdErr = process.communicate()
+
+            if (process.returncode != 0):
+                e_error("Configuration for " + name + " failed validation, not reloading:")
+                print(stdErr.decode(encoding='UTF-8', errors='replace').rstrip())
+                return False
+
+        return self.run(cmd)
+
+    # Action: run a reload command
+    #
+    # Pre:
+    # Post:
+    #
+    # Params: cmd - the command to run
+    #
+    # Return: True if succeeded, False otherwise
+    def run(self, cmd):
+        process = Popen(cmd, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        stdOut, stdErr = process.communicate()
+
+        return (process.returncode == 0)
@@ -1,49 +1,176 @@
 # A class to retrieve data from a tredly host
 from subprocess import Popen, PIPE
 import re
+import threading
 
 from objects.tidycmd.tidycmd import *
+from objects.zfs.zfs import ZFSDataset
 
 from includes.util import *
 from includes.defines import *
 from includes.output import *
 
-class TredlyHost:
+# the properties the container index needs, so that everything else is skipped as it is read. the metadata record
+# and its chunks are left to ContainerMeta
+INDEX_PROPERTY_REGEX = re.compile('^(mountpoint$|' + re.escape(ZFS_PROP_ROOT) + '(?!:meta$|\\.meta:)[.:])')
+# a zfs array element eg com.tredly.url:3
+ARRAY_PROPERTY_REGEX = re.compile('^(' + re.escape(ZFS_PROP_ROOT) + '\\.[^:]+):\\d+$')
 
-    # Action: return a list of partition names on this host
+# An in memory index of the containers on this host, built from a single recursive zfs get
+class ContainerIndex:
+
+    # Constructor
+    def __init__(self):
+        self.generation = None           # the ZFSDataset write generation this index was built at
+        self.partitionNames = []         # list of partition names
+        self.uuidPartition = {}          # uuid -> partition name
+        self.uuidName = {}               # uuid -> container name
+        self.uuidIp4Addr = {}            # uuid -> ip4_addr property (eg bridge1|10.0.0.5/16)
+        self.nameUUID = {}               # (partition name, container name) -> uuid
+        self.groupUUIDs = {}             # (partition name, container group) -> list of uuids
+        self.arrayUUIDs = {}             # array property -> dict of value -> set of uuids
+
+    # Action: (re)build this index from ZFS
     #
     # Pre:
-    # Post:
+    # Post: this index reflects the current state of ZFS_TREDLY_PARTITIONS_DATASET
     #
     # Params:
     #
-    # Return: list of strings
-    def getPartitionNames(self):
-        # create a list to pass back
+    # Return: True if succeeded, False otherwise
+    def build(self):
+        # record the generation before reading so that writes made while we read cause a rebuild
+        generation = ZFSDataset.generation
+
         partitionNames = []
+        uuidPartition = {}
+        uuidName = {}
+        uuidIp4Addr = {}
+        uuidGroup = {}
+        arrayUUIDs = {}
+
+        partitionsPrefix = ZFS_TREDLY_PARTITIONS_DATASET + '/'
+
+        # only values set on the datasets themselves are wanted, not those inherited from the partition. containers
+        # moved from another host with zfs send -p have received rather than local properties.
+        # every dataset tredly creates has a local mountpoint so it will always appear
+        zfsPartitions = ZFSDataset(ZFS_TREDLY_PARTITIONS_DATASET)
+        properties = zfsPartitions.iterPropertiesRecursive(sources = ['local', 'received'], types = ['filesystem'], propertyFilter = INDEX_PROPERTY_REGEX)
+
+        for name, property, value in properties:
+            # ignore anything outside the partitions dataset
+            if (not name.startswith(partitionsPrefix)):
+                continue
+
+            # partition/cntr/uuid
+            datasetParts = name[len(partitionsPrefix):].split('/')
+
+            # partition datasets
+            if (len(datasetParts) == 1):
+                if (datasetParts[0] not in partitionNames):
+                    partitionNames.append(datasetParts[0])
+                continue
+
+            # only interested in container datasets from here on
+            if (len(datasetParts) != 3) or (datasetParts[1] != TREDLY_CONTAINER_DIR_NAME):
+                continue
+
+            uuid = datasetParts[2]
+
+            uuidPartition[uuid] = datasetParts[0]
+
+            if (value == '-'):
+                continue
+
+            # check for a zfs array element
+            m = ARRAY_PROPERTY_REGEX.match(property)
+            if (m is not None):
+                arrayUUIDs.setdefault(m.group(1), {}).setdefault(value, set()).add(uuid)
+            elif (property == ZFS_PROP_ROOT + ':containername'):
+                uuidName[uuid] = value
+            elif (property == ZFS_PROP_ROOT + ':containergroupname'):
+                uuidGroup[uuid] = value
+            elif (property == ZFS_PROP_ROOT + ':ip4_addr'):
+                uuidIp4Addr[uuid] = value
+
+        if (zfsPartitions.lastReturnCode != 0):
+            e_error("Failed to build container index")
+            return False
 
-        # get a list of the properties for these group members
-        cmd = ['zfs', 'list', '-H', '-o' 'name', '-r', '-d', '1', ZFS_TREDLY_PARTITIONS_DATASET]
-        process = Popen(cmd,  stdin=PIPE, stdout=PIPE, stderr=PIPE)
-        stdOut, stdErr = process.communicate()
-        if (process.returncode != 0):
-            e_error("Failed to get list of partition names")
+        # now that every container is known, form the lookups that span properties
+        nameUUID = {}
+        for uuid, containerName in uuidName.items():
+            nameUUID[(uuidPartition[uuid], containerName)] = uuid
 
-        # convert stdout to string
-        stdOut = stdOut.decode(encoding='UTF-8').rstrip();
+        groupUUIDs = {}
+        for uuid, group in uuidGroup.items():
+            groupUUIDs.setdefault((uuidPartition[uuid], group), []).append(uuid)
 
-        for line in stdOut.splitlines():
-            # strip off the dataset part
-            line = line.replace(ZFS_TREDLY_PARTITIONS_DATASET, '').strip()
+        # swap every map in together so that readers never see a half built index
+        self.partitionNames = partitionNames
+        self.uuidPartition = uuidPartition
+        self.uuidName = uuidName
+        self.uuidIp4Addr = uuidIp4Addr
+        self.nameUUID = nameUUID
+        self.groupUUIDs = groupUUIDs
+        self.arrayUUIDs = arrayUUIDs
+        self.generation = generation
 
-            # check if the line still contains data
-            if (len(line) > 0):
-                # and now strip the slash which should be at the beginning
-                line = line.lstrip('/')
+        return True
 
-                partitionNames.append(line)
+    # Action: check whether this index needs to be rebuilt
+    #
+    # Pre:
+    # Post:
+    #
+    # Params:
+    #
+    # Return: True if stale, False otherwise
+    def isStale(self):
+        return (self.generation != ZFSDataset.generation)
 
-        return partitionNames
+
+class TredlyHost:
+    # a process wide index of containers on this host, shared by all TredlyHost objects
+    index = ContainerIndex()
+    indexLock = threading.Lock()
+
+    # Action: get the container index, rebuilding it if ZFS has been written to since it was built
+    #
+    # Pre:
+    # Post:
+    #
+    # Params:
+    #
+    # Return: ContainerIndex
+    def getIndex(self):
+        with TredlyHost.indexLock:
+            if (TredlyHost.index.isStale()):
+                TredlyHost.index.build()
+
+        return TredlyHost.index
+
+    # Action: discard the container index so that the next lookup rebuilds it
+    #
+    # Pre:
+    # Post: index has been marked as stale
+    #
+    # Params:
+    #
+    # Return:
+    def invalidateIndex(self):
+        TredlyHost.index.generation = None
+
+    # Action: return a list of partition names on this host
+    #
+    # Pre:
+    # Post:
+    #
+    # Params:
+    #
+    # Return: list of strings
+    def getPartitionNames(self):
+        return list(self.getIndex().partitionNames)
 
     # Action: get a list of ip addresses of all containers in the given group/partition
     #
@@ -55,41 +182,21 @@ class TredlyHost:
     #
     # Return: list of strings (ip addresses)
     def getContainerGroupContainerIps(self, containerGroup, partitionName):
-        # form the base dataset to search in
-        dataset = ZFS_TREDLY_PARTITIONS_DATASET + "/" + partitionName + '/cntr'
-
-        # and the property
-        datasetProperty = ZFS_PROP_ROOT +':ip4_addr'
-
-        # get a list of uuids in this group
-        groupMemberUUIDs = self.getContainerGroupContainerUUIDs(containerGroup, partitionName)
+        index = self.getIndex()
 
         # create a list to pass back
         ipList = []
 
-        # loop over htem and get the data
-        for uuid in groupMemberUUIDs:
-            # get a list of the properties for these group members
-            cmd = ['zfs', 'get', '-H', '-r', '-o' 'name,value', datasetProperty, dataset + '/' + uuid]
-            process = Popen(cmd,  stdin=PIPE, stdout=PIPE, stderr=PIPE)
-            stdOut, stdErr = process.communicate()
-            if (process.returncode != 0):
-                e_error("Failed to get list of containergroup ips")
+        # loop over the group members and extract their ips
+        for uuid in self.getContainerGroupContainerUUIDs(containerGroup, partitionName):
+            if (uuid not in index.uuidIp4Addr):
+                continue
 
-            # convert stdout to string
-            stdOut = stdOut.decode(encoding='UTF-8').rstrip();
+            # extract the ip
+            m = IP4_ADDR_REGEX.match(index.uuidIp4Addr[uuid])
 
-            # extract the data if it exists
-            if (re.match("^" + dataset + '/' + uuid, stdOut)):
-                # extract the value part
-                ip4Part = stdOut.split()[1]
-
-                # extract the ip
-                regex = '^(\w+)\|([\w.]+)\/(\d+)$'
-                m = re.match(regex, ip4Part)
-
-                if (m is not None):
-                    ipList.append(m.group(2))
+            if (m is not None):
+                ipList.append(m.group(2))
 
         return ipList
 
@@ -103,36 +210,7 @@ class TredlyHost:
     #
     # Return: list of strings (uuids)
     def getContainerGroupContainerUUIDs(self, containerGroup, partitionName):
-        # form the base dataset to search in
-        dataset = ZFS_TREDLY_PARTITIONS_DATASET + "/" + partitionName
-
-        # and the property
-        datasetProperty = ZFS_PROP_ROOT +':containergroupname'
-
-        # get a list of the properties
-        cmd = ['zfs', 'get', '-H', '-r', '-o' 'name,value', datasetProperty, dataset]
-        process = Popen(cmd,  stdin=PIPE, stdout=PIPE, stderr=PIPE)
-        stdOut, stdErr = process.communicate()
-        if (process.returncode != 0):
-            e_error("Failed to get list of containergroup members")
-
-        # convert stdout to string
-        stdOut = stdOut.decode(encoding='UTF-8').rstrip();
-
-        # create a list to pass back
-        containerList = []
-
-        # loop over the results looking for our value
-        for line in iter(stdOut.splitlines()):
-            # check if it matches our containergroup
-            if (re.match("^.*\s" + containerGroup + "$", line)):
-                # extract the dataset part
-                datasetPart = line.split()[0]
-
-                # get the uuid and append to our list
-                containerList.append(datasetPart.split('/')[-1])
-
-        return containerList
+        return list(self.getIndex().groupUUIDs.get((partitionName, containerGroup), []))
 
     # Action: get a list of containers within a partition
     #
@@ -143,28 +221,11 @@ class TredlyHost:
     #
     # Return: list of strings (uuids)
     def getPartitionContainerUUIDs(self, partitionName):
-        # form the base dataset to search in
-        dataset = ZFS_TREDLY_PARTITIONS_DATASET + "/" + partitionName + "/" + TREDLY_CONTAINER_DIR_NAME
-
-        # get a list of the containers
-        cmd = ['zfs', 'list', '-H', '-r', '-o' 'name', dataset]
-        process = Popen(cmd, stdin=PIPE, stdout=PIPE, stderr=PIPE)
-        stdOut, stdErr = process.communicate()
-        if (process.returncode != 0):
-            e_error("Failed to get list of partition members")
-
-        # convert stdout to string
-        stdOut = stdOut.decode(encoding='UTF-8').rstrip()
-
-        # create a list to pass back
         containerList = []
 
-        # loop over the results looking for our value
-        for line in iter(stdOut.splitlines()):
-            # check if it matches our containergroup
-            if (re.match("^" + dataset + "/.*$", line)):
-                # get the uuid and append to our list
-                containerList.append(line.split('/')[-1])
+        for uuid, containerPartition in self.getIndex().uuidPartition.items():
+            if (containerPartition == partitionName):
+                containerList.append(uuid)
 
         return containerList
 
@@ -182,23 +243,17 @@ class TredlyHost:
         if (len(uuid) == 0):
             return False
 
-        # find the partition name if partition name was empty
-        if (partitionName is None):
-            # get the partition name
-            partitionName = self.getContainerPartition(uuid)
+        containerPartition = self.getContainerPartition(uuid)
 
-            # if None was returned then the container doesnt exist
-            if (partitionName is None):
-                return False
-
-        # get a list of containers in this partition
-        containerUUIDs = self.getPartitionContainerUUIDs(partitionName)
+        # if None was returned then the container doesnt exist
+        if (containerPartition is None):
+            return False
 
-        # check if it exists in the array
-        if (uuid in containerUUIDs):
-            return True
+        # check it is in the requested partition
+        if (partitionName is not None) and (containerPartition != partitionName):
+            return False
 
-        return False
+        return True
 
     # Action: finds the partition that the given uuid resides on
     #
@@ -209,26 +264,8 @@ class TredlyHost:
     #
     # Return: string (partition name)
     def getContainerPartition(self, uuid):
-        zfsCmd = ['zfs', 'list', '-d6', '-rH', '-o', 'name', ZFS_TREDLY_PARTITIONS_DATASET]
-        zfsResult = Popen(zfsCmd, stdout=PIPE)
-        stdOut, stdErr = zfsResult.communicate()
-
-        # convert stdout to string
-        stdOutString = stdOut.decode("utf-8").strip()
-
-        # loop over the results looking for our uuid
-        for line in stdOutString.splitlines():
-            line.strip()
-            if (line.endswith(TREDLY_CONTAINER_DIR_NAME + "/" + uuid)):
-                # found it so extract the partition name
-                partitionName = line.replace(ZFS_TREDLY_PARTITIONS_DATASET + '/', '')
-
-                partitionName = partitionName.replace('/' + TREDLY_CONTAINER_DIR_NAME + '/' + uuid, '')
-
-                return partitionName
-
         # return none if nothing found
-        return None
+        return self.getIndex().uuidPartition.get(uuid)
 
     # Action: search for all containers that have a given zfs array
     #
@@ -240,33 +277,8 @@ class TredlyHost:
     #
     # Return: set of strings (uuids). a set is used here to enforce uniqueness
     def getContainersWithArray(self, datasetProperty, arrayName):
-        # form the base dataset to search in
-        dataset = ZFS_TREDLY_PARTITIONS_DATASET
-
-        cmd =  ['zfs', 'get', '-H', '-r', '-o' 'name,value,property', 'all', dataset]
-        result = Popen(cmd, stdout=PIPE)
-        stdOut, stdErr = result.communicate()
-
-        # convert stdout to string
-        stdOutString = stdOut.decode("utf-8").strip()
-        uuids = []
-
-        # loop over the results looking for our dataset
-        for line in stdOutString.splitlines():
-            line.strip()
-
-            if (re.search(datasetProperty + ':\d+$', line)):
-                # split it up into elements
-                lineElements = line.split()
-
-                # match 2nd element to the arrayName
-                # and the 3rd element to the dataset property name
-                if (lineElements[1] == arrayName) and (re.match(datasetProperty + ':\d+$', lineElements[2])):
-                    # found it so extract the uuid from the first element and append to our array
-                    uuids.append(lineElements[0].split('/')[-1])
-
-        # return a set as we are only after unique values
-        return set(uuids)
+        # return a copy as callers modify the result
+        return set(self.getIndex().arrayUUIDs.get(datasetProperty, {}).get(arrayName, set()))
 
     # Action: find the uuid of a contaienr with containerName
     #
@@ -278,33 +290,7 @@ class TredlyHost:
     #
     # Return: string (uuid)
     def getUUIDFromContainerName(self, partitionName, containerName):
-        # form the base dataset to search in
-        dataset = ZFS_TREDLY_PARTITIONS_DATASET + "/" + partitionName + "/" + TREDLY_CONTAINER_DIR_NAME
-
-        # get a list of the containers
-        zfsCmd = ['zfs', 'get', '-H', '-r', '-o', 'name,property,value', 'all', dataset]
-        grepCmd = ['grep', '-F', ZFS_PROP_ROOT + ':containername']
-
-        zfsProcess = Popen(zfsCmd, stdin=PIPE, stdout=PIPE, stderr=PIPE)
-        grepProcess = Popen(grepCmd, stdin=zfsProcess.stdout, stdout=PIPE, stderr=PIPE)
-
-        stdOut, stdErr = grepProcess.communicate()
-
-        if (grepProcess.returncode != 0):
-            return None
-
-        # convert stdout to string
-        stdOut = stdOut.decode(encoding='UTF-8').rstrip()
-
-        # loop over the results looking for our value
-        for line in iter(stdOut.splitlines()):
-            # split up the line
-            splitLine = line.split()
-
-            # check if it matches our containergroup
-            if (splitLine[2] == containerName):
-                # get the uuid and append to our list
-                return splitLine[0].split('/')[-1]
+        return self.getIndex().nameUUID.get((partitionName, containerName))
 
     # Action: find the containername of a container with uuid
     #
@@ -316,16 +302,7 @@ class TredlyHost:
     #
     # Return: string (container name)
     def getContainerNameFromUUID(self, uuid, partitionName = None):
-        # if partition name wasnt given then get the partition name
-        if (partitionName is None):
-            partitionName = self.getContainerPartition(uuid)
-
-        # extract the container name from zfs
-        dataset = ZFS_TREDLY_PARTITIONS_DATASET + "/" + partitionName + "/" + TREDLY_CONTAINER_DIR_NAME + '/' + uuid
-
-        zfsContainer = ZFSDataset(dataset)
-
-        return zfsContainer.getProperty(ZFS_PROP_ROOT + ':containername')
+        return self.getIndex().uuidName.get(uuid)
 
     # Action: get a list of all container UUIDs on this host
     #
@@ -336,13 +313,10 @@ class TredlyHost:
     #
     # Return: list (uuids)
     def getAllContainerUUIDs(self):
-        # a list to return
+        # keep the partition ordering of the previous implementation
         uuids = []
 
-        # get a list of partitions
-        partitionNames = self.getPartitionNames()
-
-        for partition in partitionNames:
+        for partition in self.getPartitionNames():
             # add the containers in this partition to our list
             uuids = uuids + self.getPartitionContainerUUIDs(partition)
 
@@ -365,6 +339,33 @@ class TredlyHost:
         # exit code of 0 == running
         return (result.returncode == 0)
 
+    # Action: get the uuids of all running containers from a single jls call
+    #
+    # Pre:
+    # Post:
+    #
+    # Params:
+    #
+    # Return: set (uuids), or None if jls failed
+    def getRunningContainerUUIDs(self):
+        cmd = ['jls', 'name']
+        result = Popen(cmd, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+
+        stdOut, stdErr = result.communicate()
+
+        if (result.returncode != 0):
+            return None
+
+        uuids = set()
+        for line in stdOut.decode(encoding='UTF-8').splitlines():
+            name = line.strip()
+
+            # tredly jails are named trd-<uuid>
+            if (name.startswith('trd-')):
+                uuids.add(name[len('trd-'):])
+
+        return uuids
+
     # Action: initialise the zfs datasets ready for use by tredly
     #
     # Pre:
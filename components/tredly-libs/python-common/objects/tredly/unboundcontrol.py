@@ -0,0 +1,151 @@
+# A class to apply changes to unbound's local data while it is running
+#
+# Changes made to UnboundFiles are queued, and then applied with unbound-control local_data and local_data_remove so
+# that unbound keeps its cache. The files are still written, so unbound loads the same data when it restarts.
+# local_data_remove removes every record for a name, so a name that had records removed is removed and then has
+# its remaining records added again. If unbound-control isnt available, or a change fails, unbound is reloaded
+# instead so that it loads the data from the files.
+import os
+from subprocess import Popen, PIPE
+from collections import OrderedDict
+
+from objects.tredly.servicereload import ServiceReload
+from includes.defines import *
+from includes.output import *
+
+class UnboundControl:
+
+    # Constructor
+    def __init__(self, controlCmd = None, reloadCmd = None):
+        if (controlCmd is None):
+            controlCmd = UNBOUND_CONTROL
+        if (reloadCmd is None):
+            reloadCmd = ['service', 'unbound', 'reload']
+
+        self.controlCmd = controlCmd    # path to unbound-control, or a stand in for it
+        self.reloadCmd = reloadCmd      # command to reload unbound when changes cant be applied
+        self.removedNames = []          # names to remove from unbound before records are added
+        self.records = OrderedDict()    # name -> list of records to add for it
+
+    # Action: queue the changes made by an UnboundFile's last write
+    #
+    # Pre: unboundFile.write() has been called
+    # Post: the records it added and removed have been queued
+    #
+    # Params: unboundFile - the UnboundFile that was written
+    #
+    # Return:
+    def queue(self, unboundFile):
+        removedNames = []
+        for line in unboundFile.removed:
+            if (line['domainName'] not in removedNames):
+                removedNames.append(line['domainName'])
+
+        # removed names need all of their remaining records added back
+        for name in removedNames:
+            if (name not in self.removedNames):
+                self.removedNames.append(name)
+
+            self.records[name] = [line for line in unboundFile.lines if (line['domainName'] == name)]
+
+        # names removed by an earlier file still need records this file adds for them
+        for line in unboundFile.added:
+            if (line['domainName'] not in self.records.keys()):
+                self.records[line['domainName']] = []
+
+            if (line not in self.records[line['domainName']]):
+                self.records[line['domainName']].append(line)
+
+    # Action: check if any changes have been queued
+    #
+    # Pre:
+    # Post:
+    #
+    # Params:
+    #
+    # Return: True if there are changes to apply, False otherwise
+    def hasChanges(self):
+        return (len(self.removedNames) > 0) or (len(self.records) > 0)
+
+    # Action: check if unbound can be changed with unbound-control
+    #
+    # Pre:
+    # Post:
+    #
+    # Params:
+    #
+    # Return: True if unbound-control exists and unbound is answering it, False otherwise
+    def isAvailable(self):
+        if (not os.access(self.controlCmd, os.X_OK)):
+            return False
+
+        return self.__run(['status'])
+
+    # Action: apply the queued changes to unbound
+    #
+    # Pre:
+    # Post: the queue is empty
+    #
+    # Params:
+    #
+    # Return: True if all changes were applied, False if unbound needs to be reloaded instead
+    def apply(self):
+        removedNames = self.removedNames
+        records = self.records
+        self.removedNames = []
+        self.records = OrderedDict()
+
+        if (not self.isAvailable()):
+            return False
+
+        for name in removedNames:
+            if (not self.__run(['local_data_remove', name])):
+                return False
+
+        for name, lines in records.items():
+            # containers sharing a name (eg a url) each have a line for the same record
+            added = []
+
+            for line in lines:
+                record = line['domainName'] + ' ' + line['in'] + ' ' + line['recordType'] + ' ' + line['ipAddress']
+
+                if (record in added):
+                    continue
+
+                if (not self.__run(['local_data', record])):
+                    return False
+                added.append(record)
+
+        return True
+
+    # Action: apply the queued changes to unbound, reloading it if they cant be applied
+    #
+    # Pre:
+    # Post: the queue is empty and unbound has the changes, or a reload has been requested
+    #
+    # Params:
+    #
+    # Return: True if the changes were applied or unbound was reloaded, False otherwise
+    def applyOrReload(self):
+        if (self.apply()):
+            return True
+
+        return ServiceReload().request('unbound', self.reloadCmd)
+
+    # Action: run an unbound-control command
+    #
+    # Pre:
+    # Post:
+    #
+    # Params: args - list of arguments to unbound-control
+    #
+    # Return: True if succeeded, False otherwise
+    def __run(self, args):
+        try:
+            process = Popen([self.controlCmd] + args, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        except OSError:
+            return False
+
+        stdOut, stdErr = process.communicate()
+
+        return (process.returncode == 0)
@@ -3,11 +3,17 @@ import os.path
 import re
 from subprocess import Popen, PIPE
 
+from objects.config.configwriter import ConfigWriter
+
 class UnboundFile:
     # Constructor
     def __init__(self, filePath):
         self.filePath = filePath
         self.lines = []
+        self.changed = False    # whether the last write() changed the file
+        self.written = []       # the lines as they were read or last written
+        self.added = []         # lines the last write() added to the file
+        self.removed = []       # lines the last write() removed from the file
 
     # Action: reads unbound file, and stores parsed lines to self
     #
@@ -37,7 +43,10 @@ class UnboundFile:
                             m = re.match("^([\w\-]+)\:\s*\"([A-z\-0-9\.]+)\s+(\w+)\s+(\w+)\s+((?:[0-9]{1,3}\.){3}[0-9]{1,3})\"\s+\#\s+([A-z0-9]+)", line)
             
                             self.append(m.group(1), m.group(2), m.group(3), m.group(4), m.group(5), m.group(6))
-                            
+
+                # remember what is in the file so that write() can tell what changed
+                self.written = list(self.lines)
+
                 return True
             except IOError:
                 return False
@@ -113,23 +122,24 @@ class UnboundFile:
     # Action: writes an unbound file.
     #
     # Pre:
-    # Post: self.filePath has been updated with the data from self.lines
+    # Post: self.filePath has been updated with the data from self.lines if it changed, and self.changed, self.added
+    #       and self.removed set
     #
     # Params: deleteEmpty - if this object has no lines, then delete the file
     #
     # Return: True if successful, False otherwise
     def write(self, deleteEmpty = True):
-        
+        writer = ConfigWriter(self.filePath)
+        self.changed = False
+
         # if self.lines is length of 0 then delete the file
         if (len(self.lines) == 0) and (deleteEmpty):
             # delete it
-            try:
-                os.remove(self.filePath)
-            except FileNotFoundError:
-                pass
+            if (not writer.remove()):
+                return False
         else:
             try:
-                with open(self.filePath, 'w') as unbound_config:
+                with writer as unbound_config:
                     for line in self.lines:
                         # form the line
                         text = ''
@@ -144,6 +154,18 @@ class UnboundFile:
                         print(text, file=unbound_config)
             except IOError:
                 return False
-        
+
+        self.changed = writer.changed
+
+        # work out which lines were added and removed since the file was read or last written
+        self.added = list(self.lines)
+        self.removed = []
+        for line in self.written:
+            if (line in self.added):
+                self.added.remove(line)
+            else:
+                self.removed.append(line)
+        self.written = list(self.lines)
+
         return True
     
\ No newline at end of file
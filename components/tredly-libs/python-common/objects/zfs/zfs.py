@@ -3,16 +3,209 @@
 # Note that this class makes use of "ZFS Arrays". These are a non standard way of storing array data within ZFS
 # and are implemented solely for Tredly
 
-from subprocess import Popen, PIPE;
+from subprocess import Popen, PIPE, DEVNULL;
+from collections import OrderedDict
 import json
+import io
 
 from includes.output import *
 
 class ZFSDataset:
+    # incremented whenever any ZFSDataset in this process writes to ZFS, so that caches built from ZFS
+    # (eg the TredlyHost index) can tell when they need rebuilding
+    generation = 0
+
     # Constructor
-    def __init__(self, dataset, mountPoint = None):
+    #
+    # When snapshot is True, all properties of this dataset are read with a single "zfs get" the first time
+    # one is requested, and getProperty/getArray/getJsonArray are answered from that snapshot until it is
+    # refreshed or invalidated by a write through this object.
+    def __init__(self, dataset, mountPoint = None, snapshot = False):
         self.dataset = dataset
         self.mountPoint = mountPoint
+        self.snapshot = snapshot
+        self.properties = None      # dict of property name -> (value, source), None if no snapshot has been taken
+        self.batch = None           # OrderedDict of property name -> value to set, None if not batching
+        self.batchInherits = None   # list of properties to inherit when the batch is committed
+        self.batchIndexes = None    # dict of array property -> next free index within the batch
+        self.lastReturnCode = None  # exit code of the last iterPropertiesRecursive() run
+
+    # Action: start batching writes to this dataset
+    #
+    # Pre:
+    # Post: setProperty, unsetProperty, appendArray and unsetArray are collected until commitBatch() is called
+    #
+    # Params:
+    #
+    # Return:
+    def beginBatch(self):
+        # already batching so keep collecting into the current batch
+        if (self.batch is not None):
+            return
+
+        self.batch = OrderedDict()
+        self.batchInherits = []
+        self.batchIndexes = {}
+
+    # Action: discard any batched writes
+    #
+    # Pre:
+    # Post: batching has ended and nothing has been written to ZFS
+    #
+    # Params:
+    #
+    # Return:
+    def discardBatch(self):
+        self.batch = None
+        self.batchInherits = None
+        self.batchIndexes = None
+
+    # Action: write the batched changes to ZFS
+    #
+    # Pre: beginBatch() has been called
+    # Post: all batched properties have been set/inherited and batching has ended
+    #
+    # Params:
+    #
+    # Return: True if succeeded, False otherwise
+    def commitBatch(self):
+        if (self.batch is None):
+            return True
+
+        batch = self.batch
+        inherits = self.batchInherits
+        self.discardBatch()
+
+        success = True
+
+        # zfs inherit only takes one property per invocation
+        for property in inherits:
+            if (not self.unsetProperty(property)):
+                success = False
+
+        if (len(batch) == 0):
+            return success
+
+        # set all properties in one zfs transaction
+        cmd = ['zfs', 'set']
+        for property, value in batch.items():
+            cmd.append(property + '=' + value)
+        cmd.append(self.dataset)
+
+        process = Popen(cmd,  stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        stdOut, stdErr = process.communicate()
+
+        # our snapshot and anything built from zfs in this process are now stale
+        self.__changed()
+
+        if (process.returncode != 0):
+            # older versions of zfs only accept one property per "zfs set", and a single bad value fails
+            # the lot, so fall back to setting them one at a time
+            for property, value in batch.items():
+                if (not self.setProperty(property, value)):
+                    success = False
+
+        return success
+
+    # Action: start a batch when used as a context manager
+    #
+    # Pre:
+    # Post: writes are batched until the with block exits
+    #
+    # Params:
+    #
+    # Return: self
+    def __enter__(self):
+        self.beginBatch()
+        return self
+
+    # Action: commit the batch when the with block exits, or discard it if an exception was raised
+    #
+    # Pre:
+    # Post: batching has ended
+    #
+    # Params:
+    #
+    # Return: False so that exceptions are not suppressed
+    def __exit__(self, excType, excValue, traceback):
+        if (excType is None):
+            self.commitBatch()
+        else:
+            self.discardBatch()
+
+        return False
+
+    # Action: take a snapshot of all properties on this dataset
+    #
+    # Pre:
+    # Post: self.properties has been populated from a single "zfs get" and snapshot mode has been enabled
+    #
+    # Params:
+    #
+    # Return: True if succeeded, False otherwise
+    def refresh(self):
+        # -p gives exact (parsable) values, -H gives tab separated output so values may contain spaces
+        cmd = ['zfs', 'get', '-H', '-p', '-o', 'property,value,source', 'all', self.dataset]
+        process = Popen(cmd,  stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        stdOut, stdErr = process.communicate()
+
+        self.snapshot = True
+
+        if (process.returncode != 0):
+            # leave an empty snapshot so that we dont keep forking for a dataset that doesnt exist
+            self.properties = {}
+            return False
+
+        properties = {}
+
+        for line in stdOut.decode("utf-8").splitlines():
+            # split into property, value and source
+            lineParts = line.split('\t')
+            if (len(lineParts) < 3):
+                continue
+
+            properties[lineParts[0]] = (lineParts[1], lineParts[2])
+
+        self.properties = properties
+
+        return True
+
+    # Action: discard the property snapshot
+    #
+    # Pre:
+    # Post: the next read in snapshot mode will take a new snapshot
+    #
+    # Params:
+    #
+    # Return:
+    def invalidate(self):
+        self.properties = None
+
+    # Action: record that this dataset has been written to
+    #
+    # Pre:
+    # Post: the property snapshot has been discarded and the write generation incremented
+    #
+    # Params:
+    #
+    # Return:
+    def __changed(self):
+        self.invalidate()
+        ZFSDataset.generation += 1
+
+    # Action: get the property snapshot, taking it if it hasnt been taken yet
+    #
+    # Pre: snapshot mode is enabled
+    # Post:
+    #
+    # Params:
+    #
+    # Return: dict of property name -> (value, source)
+    def __getSnapshot(self):
+        if (self.properties is None):
+            self.refresh()
+
+        return self.properties
 
     # Action: check if ZFS dataset exists
     #
@@ -51,6 +244,9 @@ class ZFSDataset:
         stdOut, stdErr = process.communicate()
         rc = process.returncode
 
+        # our snapshot and anything built from zfs in this process are now stale
+        self.__changed()
+
         # check exit code from zfs create
         if (rc != 0):
             # failed so return
@@ -79,6 +275,9 @@ class ZFSDataset:
         process = Popen(cmd, stdin=PIPE, stdout=PIPE, stderr=PIPE)
         stdOut, stdErr = process.communicate()
 
+        # our snapshot and anything built from zfs in this process are now stale
+        self.__changed()
+
         # check exit code from zfs destroy
         if (process.returncode != 0):
             e_error("Failed to destroy dataset " + self.dataset)
@@ -158,6 +357,19 @@ class ZFSDataset:
     #
     # Return: value from ZFS, unless value == - then return None, or None if command failed
     def getProperty(self, property):
+        # answer from the snapshot if we have one
+        if (self.snapshot):
+            try:
+                value = self.__getSnapshot()[property][0]
+            except KeyError:
+                return None
+
+            # if a dash was returned then return None as it is the same thing
+            if (value == '-'):
+                return None
+
+            return value
+
         cmd = ['zfs', 'get', '-H', '-o', 'value', property, self.dataset]
         process = Popen(cmd,  stdin=PIPE, stdout=PIPE, stderr=PIPE)
         stdOut, stdErr = process.communicate()
@@ -207,6 +419,57 @@ class ZFSDataset:
             # command failed
             return None
 
+    # Action: stream properties from this dataset and its children
+    #
+    # Pre:
+    # Post: self.lastReturnCode holds the exit code of zfs once the generator has been exhausted
+    #
+    # Params: properties - list of property names to request from zfs, or None for all
+    #         sources - list of sources to request (eg ['local']), or None for all
+    #         types - list of dataset types to request (eg ['filesystem']), or None for all
+    #         depth - maximum depth to recurse, or None for no limit
+    #         propertyFilter - compiled regex, only properties it matches are yielded
+    #
+    # Return: generator of (dataset, property, value) tuples
+    def iterPropertiesRecursive(self, properties = None, sources = None, types = None, depth = None, propertyFilter = None):
+        # push as much filtering down to zfs as we can
+        cmd = ['zfs', 'get', '-H', '-p', '-r', '-o', 'name,property,value']
+        if (depth is not None):
+            cmd.extend(['-d', str(depth)])
+        if (types is not None):
+            cmd.extend(['-t', ','.join(types)])
+        if (sources is not None):
+            cmd.extend(['-s', ','.join(sources)])
+        if (properties is not None):
+            cmd.append(','.join(properties))
+        else:
+            cmd.append('all')
+        cmd.append(self.dataset)
+
+        self.lastReturnCode = None
+
+        # stderr is discarded so that it cant fill up and block zfs while we read stdout
+        process = Popen(cmd, stdin=DEVNULL, stdout=PIPE, stderr=DEVNULL)
+        stdOut = io.TextIOWrapper(process.stdout, encoding='utf-8')
+
+        try:
+            # read one line at a time rather than holding the whole output in memory
+            for line in stdOut:
+                lineParts = line.rstrip('\n').split('\t', 2)
+                if (len(lineParts) < 3):
+                    continue
+
+                if (propertyFilter is not None) and (propertyFilter.match(lineParts[1]) is None):
+                    continue
+
+                yield (lineParts[0], lineParts[1], lineParts[2])
+        finally:
+            # the caller may have stopped early so make sure zfs doesnt linger
+            if (process.poll() is None):
+                process.kill()
+            stdOut.close()
+            self.lastReturnCode = process.wait()
+
     # Action: get a property from a zfs dataset
     #
     # Pre:
@@ -220,11 +483,21 @@ class ZFSDataset:
         if (value is None):
             value = '-'
 
+        # batching so collect it for later
+        if (self.batch is not None):
+            if (property in self.batchInherits):
+                self.batchInherits.remove(property)
+            self.batch[property] = value
+            return True
+
         cmd = ['zfs', 'set', property + '=' + value, self.dataset]
         process = Popen(cmd,  stdin=PIPE, stdout=PIPE, stderr=PIPE)
         stdOut, stdErr = process.communicate()
         rc = process.returncode
 
+        # our snapshot and anything built from zfs in this process are now stale
+        self.__changed()
+
         # check the exit code
         if (rc == 0):
             # executed successfully
@@ -243,10 +516,20 @@ class ZFSDataset:
     #
     # Return: True if success, False otherwise
     def unsetProperty(self, property):
+        # batching so collect it for later
+        if (self.batch is not None):
+            self.batch.pop(property, None)
+            if (property not in self.batchInherits):
+                self.batchInherits.append(property)
+            return True
+
         # remove the item
         cmd = ['zfs', 'inherit', '-r', property, self.dataset]
         result = Popen(cmd, stdout=PIPE)
         stdOut, stdErr = result.communicate()
+
+        # our snapshot and anything built from zfs in this process are now stale
+        self.__changed()
         # check return code
         if (result.returncode != 0):
             e_error("An error occurred when deleting property + " + property + " from ZFS")
@@ -264,6 +547,32 @@ class ZFSDataset:
     #
     # Return: True if succeeded, False otherwise
     def appendArray(self, property, value):
+        # batching so work out the index locally, only looking up the existing array the first time
+        if (self.batch is not None):
+            if (property not in self.batchIndexes):
+                array = self.getArray(property)
+
+                if (len(array) > 0):
+                    self.batchIndexes[property] = max(int(key) for key in array.keys()) + 1
+                else:
+                    self.batchIndexes[property] = 0
+
+            index = self.batchIndexes[property]
+            self.batchIndexes[property] += 1
+
+            return self.setProperty(property + ':' + str(index), value)
+
+        # in snapshot mode we already know the indexes in use
+        if (self.snapshot):
+            array = self.getArray(property)
+
+            if (len(array) > 0):
+                index = max(int(key) for key in array.keys()) + 1
+            else:
+                index = 0
+
+            return self.setProperty(property + ':' + str(index), value)
+
         # the following commands are piped together
         zfsCmd = ['zfs', 'get', '-H', '-o', 'property,value', 'all', self.dataset]
         grepCmd = ['grep', '-F', property]
@@ -306,6 +615,19 @@ class ZFSDataset:
     #
     # Return: dict of zfs values
     def getArray(self, property):
+        # answer from the snapshot if we have one
+        if (self.snapshot):
+            prefix = property + ':'
+            items = []
+
+            for name, (value, source) in self.__getSnapshot().items():
+                # only match numbered elements of this exact array
+                if (name.startswith(prefix)) and (name[len(prefix):].isdigit()):
+                    items.append((name[len(prefix):], value))
+
+            # keep the same numeric ordering as the sort in the pipeline below
+            return OrderedDict(sorted(items, key=lambda item: int(item[0])))
+
         # the following commands are piped together
         zfsCmd = ['zfs', 'get', '-H', '-o', 'property,value', 'all', self.dataset]
         grepCmd = ['grep', '^' + property + ':']
@@ -380,6 +702,19 @@ class ZFSDataset:
     def unsetArray(self, property):
         array = self.getArray(property)
 
+        # batching so collect it for later
+        if (self.batch is not None):
+            for key in array.keys():
+                self.unsetProperty(property + ':' + key)
+
+            # drop anything appended to this array earlier in the batch
+            for index in range(self.batchIndexes.get(property, 0)):
+                self.batch.pop(property + ':' + str(index), None)
+
+            self.batchIndexes[property] = 0
+
+            return True
+
         # loop over the results, deleting everything
         for key,value in array.items():
             # remove the item
@@ -389,8 +724,12 @@ class ZFSDataset:
             # check return code
             if (result.returncode != 0):
                 e_error("An error occurred when deleting from ZFS")
+                self.__changed()
                 return False
 
+        # our snapshot and anything built from zfs in this process are now stale
+        self.__changed()
+
         return True
 
     # Action: takes a snapshot of this dataset
@@ -407,6 +746,88 @@ class ZFSDataset:
         stdOut, stdErr = process.communicate()
         return (process.returncode == 0)
 
+    # Action: check if a snapshot of this dataset exists
+    #
+    # Pre:
+    # Post:
+    #
+    # Params: snapshotName - the name of the snapshot
+    #
+    # Return: True if it exists, False otherwise
+    def snapshotExists(self, snapshotName):
+        cmd = ['zfs', 'list', '-t', 'snapshot', self.dataset + '@' + snapshotName]
+        process = Popen(cmd,  stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        stdOut, stdErr = process.communicate()
+        return (process.returncode == 0)
+
+    # Action: create a new dataset as a clone of a snapshot of this dataset
+    #
+    # Pre: snapshot exists
+    # Post: dataset has been created, sharing its blocks with the snapshot
+    #
+    # Params: snapshotName - the name of the snapshot to clone
+    #         dataset - the dataset to create
+    #         mountPoint - where to mount the new dataset
+    #
+    # Return: True if success False otherwise
+    def cloneSnapshot(self, snapshotName, dataset, mountPoint):
+        cmd = ['zfs', 'clone', '-p', '-o', 'mountpoint=' + mountPoint, self.dataset + '@' + snapshotName, dataset]
+        process = Popen(cmd,  stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        stdOut, stdErr = process.communicate()
+
+        # anything built from zfs in this process is now stale
+        self.__changed()
+
+        return (process.returncode == 0)
+
+    # Action: destroy a snapshot of this dataset
+    #
+    # Pre:
+    # Post: snapshot no longer exists, unless it has clones
+    #
+    # Params: snapshotName - the name of the snapshot
+    #
+    # Return: True if success False otherwise
+    def destroySnapshot(self, snapshotName):
+        cmd = ['zfs', 'destroy', self.dataset + '@' + snapshotName]
+        process = Popen(cmd,  stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        stdOut, stdErr = process.communicate()
+
+        # anything built from zfs in this process is now stale
+        self.__changed()
+
+        return (process.returncode == 0)
+
+    # Action: copy a snapshot of this dataset to another dataset with zfs send/receive
+    #
+    # Pre: snapshot exists
+    # Post: target dataset has a snapshot of the same name. it is not mounted
+    #
+    # Params: snapshotName - the name of the snapshot to send
+    #         targetDataset - the dataset to receive into. must not exist for a full send
+    #         fromSnapshot - full name of the snapshot to send an incremental stream from, which must be the most
+    #                        recent snapshot of targetDataset. None for a full send
+    #
+    # Return: True if success False otherwise
+    def sendSnapshot(self, snapshotName, targetDataset, fromSnapshot = None):
+        sendCmd = ['zfs', 'send']
+        if (fromSnapshot is not None):
+            sendCmd.extend(['-i', fromSnapshot])
+        sendCmd.append(self.dataset + '@' + snapshotName)
+
+        recvCmd = ['zfs', 'receive', '-u', targetDataset]
+
+        sendProcess = Popen(sendCmd, stdin=DEVNULL, stdout=PIPE, stderr=DEVNULL)
+        recvProcess = Popen(recvCmd, stdin=sendProcess.stdout, stdout=PIPE, stderr=PIPE)
+        sendProcess.stdout.close()
+        stdOut, stdErr = recvProcess.communicate()
+        sendProcess.wait()
+
+        # anything built from zfs in this process is now stale
+        self.__changed()
+
+        return (sendProcess.returncode == 0) and (recvProcess.returncode == 0)
+
     # Action: saves a snapshot to a given filename
     #
     # Pre: dataset exists, snapshot exists
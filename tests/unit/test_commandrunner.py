@@ -0,0 +1,96 @@
+# Tests CommandRunner's logging, output capture and timeouts
+import os.path
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+
+scriptDirectory = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, scriptDirectory + "/../../components/tredly-libs/python-common")
+
+# now that pathing is set up, import some tredly modules
+from objects.tredly.commandrunner import CommandRunner, CMD_TAIL_LINES
+
+class TestCommandRunner(unittest.TestCase):
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.logPath = os.path.join(self.tempDir, 'container.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def readLog(self):
+        with open(self.logPath) as log:
+            return log.read()
+
+    def test_success(self):
+        runner = CommandRunner(self.logPath)
+        result = runner.run(['sh', '-c', 'echo out; echo err >&2'], 'say hello')
+
+        self.assertEqual(result['returnCode'], 0)
+        self.assertFalse(result['timedOut'])
+        self.assertEqual(result['command'], 'say hello')
+        self.assertEqual(list(runner.tail), ['out', 'err'])
+        self.assertEqual(runner.results, [result])
+
+        log = self.readLog().splitlines()
+        self.assertTrue(log[0].startswith('==> ') and log[0].endswith(' say hello'))
+        self.assertEqual(log[1:3], ['out', 'err'])
+        self.assertTrue(log[3].startswith('<== exit status 0 after '))
+
+    def test_failure(self):
+        result = CommandRunner(self.logPath).run(['sh', '-c', 'exit 3'])
+
+        self.assertEqual(result['returnCode'], 3)
+        self.assertIn('<== exit status 3 after ', self.readLog())
+
+    def test_missing_command(self):
+        runner = CommandRunner(self.logPath)
+        result = runner.run([os.path.join(self.tempDir, 'missing')], 'missing')
+
+        self.assertEqual(result['returnCode'], 127)
+        self.assertFalse(result['timedOut'])
+        self.assertEqual(runner.results, [result])
+        self.assertIn('<== exit status 127 after ', self.readLog())
+
+    def test_output_without_newline(self):
+        runner = CommandRunner(self.logPath)
+        runner.run(['printf', 'no newline'])
+
+        self.assertEqual(list(runner.tail), ['no newline'])
+        self.assertIn('no newline\n<== ', self.readLog())
+
+    def test_tail_is_bounded(self):
+        runner = CommandRunner()
+        runner.run(['sh', '-c', 'i=0; while [ $i -lt ' + str(CMD_TAIL_LINES * 2) + ' ]; do echo $i; i=$((i + 1)); done'])
+
+        self.assertEqual(len(runner.tail), CMD_TAIL_LINES)
+        self.assertEqual(runner.tail[-1], str(CMD_TAIL_LINES * 2 - 1))
+
+    def test_no_timeout_by_default(self):
+        result = CommandRunner().run(['sleep', '1'])
+
+        self.assertEqual(result['returnCode'], 0)
+        self.assertFalse(result['timedOut'])
+
+    def test_timeout(self):
+        startTime = time.time()
+        result = CommandRunner(self.logPath, 1).run(['sh', '-c', 'sleep 30'])
+
+        self.assertTrue(result['timedOut'])
+        self.assertNotEqual(result['returnCode'], 0)
+        self.assertLess(time.time() - startTime, 10)
+        self.assertIn('<== timed out after ', self.readLog())
+
+    def test_daemon_holding_pipe(self):
+        # a daemon started by the command keeps stdout open after the command exits
+        startTime = time.time()
+        result = CommandRunner().run(['sh', '-c', 'sleep 30 & echo started'])
+
+        self.assertEqual(result['returnCode'], 0)
+        self.assertLess(time.time() - startTime, 10)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+# Tests ConfigWriter's atomic, change only writes
+import os.path
+import sys
+import stat
+import shutil
+import tempfile
+import unittest
+
+scriptDirectory = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, scriptDirectory + "/../../components/tredly-libs/python-common")
+
+# now that pathing is set up, import some tredly modules
+from objects.config.configwriter import ConfigWriter
+
+class TestConfigWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.filePath = os.path.join(self.tempDir, 'unbound.conf')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def write(self, content, mode = None):
+        writer = ConfigWriter(self.filePath, mode)
+        with writer as f:
+            f.write(content)
+
+        return writer
+
+    def read(self):
+        with open(self.filePath) as f:
+            return f.read()
+
+    def test_new_file(self):
+        self.assertTrue(self.write('a\n').changed)
+        self.assertEqual(self.read(), 'a\n')
+
+    def test_unchanged_file_is_left_alone(self):
+        self.write('a\n')
+        inode = os.stat(self.filePath).st_ino
+
+        self.assertFalse(self.write('a\n').changed)
+        self.assertEqual(os.stat(self.filePath).st_ino, inode)
+
+    def test_changed_file_is_replaced(self):
+        self.write('a\n')
+
+        # same size, different content
+        self.assertTrue(self.write('b\n').changed)
+        self.assertEqual(self.read(), 'b\n')
+
+        self.assertTrue(self.write('longer\n').changed)
+        self.assertEqual(self.read(), 'longer\n')
+
+    def test_no_temporary_files_left(self):
+        self.write('a\n')
+        self.write('a\n')
+        self.write('b\n')
+
+        self.assertEqual(os.listdir(self.tempDir), ['unbound.conf'])
+
+    def test_exception_leaves_file_alone(self):
+        self.write('a\n')
+
+        with self.assertRaises(RuntimeError):
+            with ConfigWriter(self.filePath) as f:
+                f.write('partial')
+                raise RuntimeError()
+
+        self.assertEqual(self.read(), 'a\n')
+        self.assertEqual(os.listdir(self.tempDir), ['unbound.conf'])
+
+    def test_mode(self):
+        self.write('a\n', 0o600)
+        self.assertEqual(stat.S_IMODE(os.stat(self.filePath).st_mode), 0o600)
+
+        # the existing file's mode is kept when none is given
+        self.write('b\n')
+        self.assertEqual(stat.S_IMODE(os.stat(self.filePath).st_mode), 0o600)
+
+    def test_new_file_mode_follows_umask(self):
+        oldUmask = os.umask(0o027)
+
+        try:
+            self.write('a\n')
+        finally:
+            os.umask(oldUmask)
+
+        self.assertEqual(stat.S_IMODE(os.stat(self.filePath).st_mode), 0o640)
+
+    def test_remove(self):
+        self.write('a\n')
+
+        writer = ConfigWriter(self.filePath)
+        self.assertTrue(writer.remove())
+        self.assertTrue(writer.changed)
+        self.assertFalse(os.path.exists(self.filePath))
+
+        # removing a file that doesnt exist isnt a change
+        self.assertTrue(writer.remove())
+        self.assertFalse(writer.changed)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+# Tests the TredlyHost container index against a stand in for zfs
+import os.path
+import sys
+import shutil
+import tempfile
+import unittest
+
+scriptDirectory = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, scriptDirectory + "/../../components/tredly-libs/python-common")
+
+# now that pathing is set up, import some tredly modules
+from objects.tredly.tredlyhost import TredlyHost
+
+PARTITION = 'zroot/tredly/ptn/default'
+
+class TestContainerIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.getOutputPath = os.path.join(self.tempDir, 'zfs-get')
+
+        self.oldPath = os.environ['PATH']
+        os.environ['PATH'] = scriptDirectory + '/bin:' + self.oldPath
+        os.environ['ZFS_GET_OUTPUT'] = self.getOutputPath
+
+        self.tredlyHost = TredlyHost()
+
+    def tearDown(self):
+        os.environ['PATH'] = self.oldPath
+        os.environ.pop('ZFS_GET_OUTPUT', None)
+
+        # dont leave an index built from the stand in behind for other tests
+        self.tredlyHost.invalidateIndex()
+
+        shutil.rmtree(self.tempDir)
+
+    # write the properties the stand in zfs returns, as (dataset, property, value, source)
+    def writeProperties(self, properties):
+        with open(self.getOutputPath, 'w') as getOutput:
+            for property in properties:
+                getOutput.write('\t'.join(property) + '\n')
+
+        self.tredlyHost.invalidateIndex()
+
+    def containerProperties(self, uuid, name, source):
+        dataset = PARTITION + '/cntr/' + uuid
+
+        return [
+            (dataset, 'mountpoint', '/tredly/ptn/default/cntr/' + uuid, source),
+            (dataset, 'com.tredly:containername', name, source),
+            (dataset, 'com.tredly:containergroupname', 'web', source),
+            (dataset, 'com.tredly.url:0', 'www.example.com', source),
+        ]
+
+    def test_local_container(self):
+        self.writeProperties([(PARTITION, 'mountpoint', '/tredly/ptn/default', 'local')] +
+            self.containerProperties('uuid1', 'web1', 'local'))
+
+        self.assertTrue(self.tredlyHost.containerExists('uuid1', 'default'))
+        self.assertEqual(self.tredlyHost.getUUIDFromContainerName('default', 'web1'), 'uuid1')
+        self.assertEqual(self.tredlyHost.getContainersWithArray('com.tredly.url', 'www.example.com'), {'uuid1'})
+
+    def test_received_container(self):
+        # a container moved from another host with zfs send -p
+        self.writeProperties([(PARTITION, 'mountpoint', '/tredly/ptn/default', 'local')] +
+            self.containerProperties('uuid1', 'web1', 'local') +
+            self.containerProperties('uuid2', 'web2', 'received'))
+
+        self.assertTrue(self.tredlyHost.containerExists('uuid2'))
+        self.assertEqual(self.tredlyHost.getContainerPartition('uuid2'), 'default')
+        self.assertEqual(self.tredlyHost.getUUIDFromContainerName('default', 'web2'), 'uuid2')
+        self.assertEqual(sorted(self.tredlyHost.getAllContainerUUIDs()), ['uuid1', 'uuid2'])
+        self.assertEqual(sorted(self.tredlyHost.getContainerGroupContainerUUIDs('web', 'default')), ['uuid1', 'uuid2'])
+        self.assertEqual(self.tredlyHost.getContainersWithArray('com.tredly.url', 'www.example.com'), {'uuid1', 'uuid2'})
+
+    def test_inherited_properties_are_ignored(self):
+        dataset = PARTITION + '/cntr/uuid1'
+
+        self.writeProperties([
+            (PARTITION, 'mountpoint', '/tredly/ptn/default', 'local'),
+            (PARTITION, 'com.tredly:containergroupname', 'web', 'local'),
+            (dataset, 'mountpoint', '/tredly/ptn/default/cntr/uuid1', 'local'),
+            (dataset, 'com.tredly:containergroupname', 'web', 'inherited from ' + PARTITION),
+        ])
+
+        self.assertTrue(self.tredlyHost.containerExists('uuid1'))
+        self.assertEqual(self.tredlyHost.getContainerGroupContainerUUIDs('web', 'default'), [])
+
+    def test_metadata_record_is_not_indexed(self):
+        dataset = PARTITION + '/cntr/uuid1'
+
+        self.writeProperties([(PARTITION, 'mountpoint', '/tredly/ptn/default', 'local')] +
+            self.containerProperties('uuid1', 'web1', 'local') + [
+            (dataset, 'com.tredly:meta', '{"version":1,"chunks":1}', 'local'),
+            (dataset, 'com.tredly.meta:0', '{"version":1}', 'local'),
+        ])
+
+        self.assertTrue(self.tredlyHost.containerExists('uuid1'))
+        self.assertEqual(self.tredlyHost.getContainersWithArray('com.tredly.meta', '{"version":1}'), set())
+
+if __name__ == '__main__':
+    unittest.main()
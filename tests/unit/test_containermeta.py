@@ -0,0 +1,110 @@
+# Tests that ContainerMeta stores each property in either the record or the legacy layout, against a stand in for zfs
+import os.path
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+scriptDirectory = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, scriptDirectory + "/../../components/tredly-libs/python-common")
+
+# now that pathing is set up, import some tredly modules
+from objects.zfs.zfs import ZFSDataset
+from objects.tredly.containermeta import ContainerMeta
+
+DATASET = "zroot/tredly/ptn/default/cntr/abcd1234"
+
+class TestContainerMeta(unittest.TestCase):
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.getOutputPath = os.path.join(self.tempDir, 'zfs-get')
+        self.logPath = os.path.join(self.tempDir, 'zfs.log')
+
+        self.oldPath = os.environ['PATH']
+        os.environ['PATH'] = scriptDirectory + '/bin:' + self.oldPath
+        os.environ['ZFS_GET_OUTPUT'] = self.getOutputPath
+        os.environ['ZFS_LOG'] = self.logPath
+
+        self.writeProperties({})
+
+    def tearDown(self):
+        os.environ['PATH'] = self.oldPath
+        os.environ.pop('ZFS_GET_OUTPUT', None)
+        os.environ.pop('ZFS_LOG', None)
+
+        shutil.rmtree(self.tempDir)
+
+    # write the properties the stand in zfs returns for the container, as the snapshot asks for them
+    def writeProperties(self, properties):
+        with open(self.getOutputPath, 'w') as getOutput:
+            for property, value in properties.items():
+                getOutput.write(property + '\t' + value + '\tlocal\n')
+
+    # the properties set by each zfs set the stand in was asked to run
+    def setProperties(self):
+        properties = {}
+
+        with open(self.logPath) as log:
+            for line in log:
+                words = line.split()
+
+                if (words[0] == 'set'):
+                    for word in words[1:-1]:
+                        property, value = word.split('=', 1)
+                        properties[property] = value
+
+        return properties
+
+    def test_save_writes_each_property_once(self):
+        zfsContainer = ZFSDataset(DATASET, None, True)
+        zfsContainer.beginBatch()
+
+        meta = ContainerMeta(zfsContainer)
+        meta.setProperty('containername', 'web1')
+        meta.setProperty('securelevel', '2')
+        meta.appendArray('url', 'www.example.com/')
+        meta.appendArray('dns', '10.0.0.1')
+        meta.save()
+
+        self.assertTrue(zfsContainer.commitBatch())
+
+        properties = self.setProperties()
+        record = json.loads(properties.pop('com.tredly:meta'))
+
+        # the bash tools and the host index read these, so they are only in the legacy layout
+        self.assertEqual(properties, {
+            'com.tredly:containername': 'web1',
+            'com.tredly.url:0': 'www.example.com/'
+        })
+        self.assertEqual(record['properties'], {'securelevel': '2'})
+        self.assertEqual(record['arrays'], {'dns': ['10.0.0.1']})
+
+    def test_legacy_properties_ignore_old_records(self):
+        # a record written when every property was kept in both places, since renamed by bash
+        record = {'version': 1, 'properties': {'containername': 'old', 'securelevel': '2'}, 'arrays': {'url': ['old.example.com/']}}
+
+        self.writeProperties({
+            'com.tredly:meta': json.dumps(record),
+            'com.tredly:containername': 'new',
+            'com.tredly.url:0': 'new.example.com/'
+        })
+
+        meta = ContainerMeta(ZFSDataset(DATASET, None, True))
+
+        self.assertEqual(meta.getProperty('containername'), 'new')
+        self.assertEqual(list(meta.getArray('url').values()), ['new.example.com/'])
+        self.assertEqual(meta.getProperty('securelevel'), '2')
+
+    def test_falls_back_without_record(self):
+        self.writeProperties({'com.tredly:securelevel': '3', 'com.tredly.dns:0': '10.0.0.1'})
+
+        meta = ContainerMeta(ZFSDataset(DATASET, None, True))
+
+        self.assertEqual(meta.getProperty('securelevel'), '3')
+        self.assertEqual(list(meta.getArray('dns').values()), ['10.0.0.1'])
+        self.assertIsNone(meta.getProperty('domainname'))
+
+if __name__ == '__main__':
+    unittest.main()
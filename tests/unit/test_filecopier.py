@@ -0,0 +1,100 @@
+# Tests that FileCopier copies files and trees like cp -R
+import os.path
+import sys
+import stat
+import shutil
+import tempfile
+import unittest
+
+scriptDirectory = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, scriptDirectory + "/../../components/tredly-libs/python-common")
+
+# now that pathing is set up, import some tredly modules
+from objects.tredly.filecopier import FileCopier
+
+class TestFileCopier(unittest.TestCase):
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.source = os.path.join(self.tempDir, 'src')
+        self.target = os.path.join(self.tempDir, 'dst')
+
+        # src/a.txt, src/sub/b.sh, src/sub/deeper/c, src/link -> a.txt
+        os.makedirs(os.path.join(self.source, 'sub', 'deeper'))
+        self.writeFile('a.txt', 'a' * 100000)
+        self.writeFile('sub/b.sh', '#!/bin/sh\n', 0o755)
+        self.writeFile('sub/deeper/c', '')
+        os.symlink('a.txt', os.path.join(self.source, 'link'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def writeFile(self, path, content, mode = 0o644):
+        path = os.path.join(self.source, path)
+        with open(path, 'w') as f:
+            f.write(content)
+        os.chmod(path, mode)
+
+    def assertCopied(self, target):
+        with open(os.path.join(target, 'a.txt')) as f:
+            self.assertEqual(f.read(), 'a' * 100000)
+
+        self.assertEqual(stat.S_IMODE(os.stat(os.path.join(target, 'sub', 'b.sh')).st_mode), 0o755)
+        self.assertEqual(os.path.getsize(os.path.join(target, 'sub', 'deeper', 'c')), 0)
+        self.assertEqual(os.readlink(os.path.join(target, 'link')), 'a.txt')
+
+    def test_copy_tree(self):
+        copier = FileCopier(4)
+
+        self.assertTrue(copier.copy(self.source, self.target))
+        self.assertCopied(self.target)
+        self.assertEqual(copier.filesCopied, 4)
+        self.assertEqual(copier.bytesCopied, 100000 + len('#!/bin/sh\n'))
+
+    def test_copy_into_existing_directory(self):
+        os.makedirs(self.target)
+
+        self.assertTrue(FileCopier(4).copy(self.source, self.target))
+        self.assertCopied(os.path.join(self.target, 'src'))
+
+    def test_copy_contents(self):
+        os.makedirs(self.target)
+
+        self.assertTrue(FileCopier(4).copy(self.source + '/', self.target))
+        self.assertCopied(self.target)
+
+    def test_copy_file(self):
+        target = os.path.join(self.tempDir, 'b.sh')
+        copier = FileCopier(1)
+
+        self.assertTrue(copier.copy(os.path.join(self.source, 'sub', 'b.sh'), target))
+        self.assertEqual(copier.filesCopied, 1)
+        self.assertEqual(stat.S_IMODE(os.stat(target).st_mode), 0o755)
+
+    def test_copy_over_existing_files(self):
+        FileCopier(4).copy(self.source, self.target)
+        self.writeFile('a.txt', 'changed')
+
+        self.assertTrue(FileCopier(4).copy(self.source + '/', self.target))
+        with open(os.path.join(self.target, 'a.txt')) as f:
+            self.assertEqual(f.read(), 'changed')
+
+    def test_missing_source(self):
+        copier = FileCopier(4)
+
+        self.assertFalse(copier.copy(os.path.join(self.tempDir, 'missing'), self.target))
+        self.assertEqual(len(copier.errors), 1)
+
+    def test_read_only_directory(self):
+        os.chmod(os.path.join(self.source, 'sub'), 0o555)
+
+        try:
+            self.assertTrue(FileCopier(4).copy(self.source, self.target))
+            self.assertEqual(stat.S_IMODE(os.stat(os.path.join(self.target, 'sub')).st_mode), 0o555)
+        finally:
+            os.chmod(os.path.join(self.source, 'sub'), 0o755)
+            if (os.path.isdir(os.path.join(self.target, 'sub'))):
+                os.chmod(os.path.join(self.target, 'sub'), 0o755)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+# Tests IP4Allocator against a stand in for zfs
+import os.path
+import sys
+import shutil
+import tempfile
+import unittest
+
+scriptDirectory = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, scriptDirectory + "/../../components/tredly-libs/python-common")
+
+# now that pathing is set up, import some tredly modules
+from objects.ip4 import ip4allocator
+from objects.ip4.ip4allocator import IP4Allocator
+
+class TestIP4Allocator(unittest.TestCase):
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.getOutputPath = os.path.join(self.tempDir, 'zfs-get')
+        self.logPath = os.path.join(self.tempDir, 'zfs.log')
+        self.registered = []
+
+        self.oldPath = os.environ['PATH']
+        os.environ['PATH'] = scriptDirectory + '/bin:' + self.oldPath
+        os.environ['ZFS_GET_OUTPUT'] = self.getOutputPath
+        os.environ['ZFS_LOG'] = self.logPath
+
+        self.oldReservationDir = ip4allocator.IP4_RESERVATION_DIR
+        ip4allocator.IP4_RESERVATION_DIR = os.path.join(self.tempDir, 'reservations')
+
+        self.writeRegistered()
+
+    def tearDown(self):
+        os.environ['PATH'] = self.oldPath
+        os.environ.pop('ZFS_GET_OUTPUT', None)
+        os.environ.pop('ZFS_LOG', None)
+        ip4allocator.IP4_RESERVATION_DIR = self.oldReservationDir
+
+        shutil.rmtree(self.tempDir)
+
+    # register addresses in the stand in zfs, as containers do once they have started
+    def writeRegistered(self, *ip4s):
+        self.registered.extend(ip4s)
+
+        with open(self.getOutputPath, 'w') as getOutput:
+            for index, ip4 in enumerate(self.registered):
+                getOutput.write('zroot/tredly/ptn/default/cntr/uuid' + str(index) + '\tcom.tredly:ip4_addr\tbridge1|' + ip4 + '/29\n')
+
+    # the number of zfs commands run so far
+    def zfsCalls(self):
+        if (not os.path.exists(self.logPath)):
+            return 0
+
+        with open(self.logPath) as log:
+            return len(log.readlines())
+
+    def test_skips_used_addresses(self):
+        self.writeRegistered('10.0.0.1', '10.0.0.2', '10.0.0.4', '10.0.0.5')
+
+        allocator = IP4Allocator('10.0.0.0', 29)
+        self.assertTrue(allocator.build('10.0.0.6'))
+
+        self.assertEqual(allocator.allocate(), '10.0.0.3')
+        self.assertIsNone(allocator.allocate())
+
+    def test_skips_received_addresses(self):
+        # a container moved from another host with zfs send -p has a received rather than local ip4_addr
+        self.writeRegistered('10.0.0.1', '10.0.0.2', '10.0.0.3', '10.0.0.4', '10.0.0.5')
+        with open(self.getOutputPath, 'a') as getOutput:
+            getOutput.write('zroot/tredly/ptn/default/cntr/moved\tcom.tredly:ip4_addr\tbridge1|10.0.0.6/29\treceived\n')
+
+        allocator = IP4Allocator('10.0.0.0', 29)
+        self.assertTrue(allocator.build())
+
+        self.assertIsNone(allocator.allocate())
+
+    def test_never_hands_out_network_or_broadcast(self):
+        allocator = IP4Allocator('10.0.0.0', 29)
+        self.assertTrue(allocator.build())
+
+        allocated = set()
+        ip4 = allocator.allocate()
+        while (ip4 is not None):
+            allocated.add(ip4)
+            ip4 = allocator.allocate()
+
+        self.assertEqual(allocated, set('10.0.0.' + str(i) for i in range(1, 7)))
+
+    def test_reserves_addresses(self):
+        allocator = IP4Allocator('10.0.0.0', 29)
+        self.assertTrue(allocator.build())
+
+        ip4 = allocator.allocate()
+        self.assertTrue(os.path.isfile(os.path.join(ip4allocator.IP4_RESERVATION_DIR, ip4)))
+
+        ip4allocator.releaseIP4(ip4)
+        self.assertFalse(os.path.exists(os.path.join(ip4allocator.IP4_RESERVATION_DIR, ip4)))
+
+    def test_addresses_registered_after_build(self):
+        self.writeRegistered('10.0.0.2')
+
+        allocator = IP4Allocator('10.0.0.0', 29)
+        self.assertTrue(allocator.build())
+
+        # another process registers every address but one after the bitmap was built
+        self.writeRegistered('10.0.0.1', '10.0.0.3', '10.0.0.4', '10.0.0.6')
+        zfsCalls = self.zfsCalls()
+
+        self.assertEqual(allocator.allocate(), '10.0.0.5')
+        self.assertIsNone(allocator.allocate())
+
+        # zfs is only read once however many candidates collide
+        self.assertEqual(self.zfsCalls() - zfsCalls, 1)
+
+        # the addresses that were passed over arent left reserved
+        reservations = [name for name in os.listdir(ip4allocator.IP4_RESERVATION_DIR) if (not name.startswith('.'))]
+        self.assertEqual(reservations, ['10.0.0.5'])
+
+if __name__ == '__main__':
+    unittest.main()
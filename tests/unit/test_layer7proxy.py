@@ -0,0 +1,53 @@
+# Tests how the layer 7 proxy combines the geo whitelists of the containers serving a location
+import os.path
+import sys
+import unittest
+
+scriptDirectory = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, scriptDirectory + "/../../components/tredly-libs/python-common")
+
+# now that pathing is set up, import some tredly modules
+from objects.nginx.layer7proxy import Layer7Proxy
+from objects.nginx.nginxblock import NginxBlock
+
+class TestLocationAccess(unittest.TestCase):
+
+    def setUp(self):
+        self.layer7Proxy = Layer7Proxy()
+        self.servername = NginxBlock(None, None, '/usr/local/etc/nginx/server_name/http-www_example_com')
+        self.locationVariable = self.layer7Proxy.getLocationAccessVariable(self.servername, '/')
+
+        # the location and its check, as registerUrls leaves them
+        self.servername.addBlock('server')
+        self.servername.server[0].addBlock('location', '/')
+        self.servername.server[0].location['/'].addBlock('if', '(' + self.locationVariable + ' = 0)')
+
+    def test_clients_of_any_container_are_allowed(self):
+        # one map per location, allowing a client if any container serving it does
+        self.layer7Proxy.addLocationAccess(self.servername, '/', '$tredly_a')
+        self.layer7Proxy.addLocationAccess(self.servername, '/', '$tredly_b')
+        self.layer7Proxy.addLocationAccess(self.servername, '/', '$tredly_b')
+
+        self.assertEqual(list(self.servername.blocks['map'].keys()), ['"$tredly_a$tredly_b" ' + self.locationVariable])
+        self.assertIn('~1 1;', self.servername.toString())
+
+    def test_remove(self):
+        self.layer7Proxy.addLocationAccess(self.servername, '/', '$tredly_a')
+        self.layer7Proxy.addLocationAccess(self.servername, '/', '$tredly_b')
+
+        self.layer7Proxy.removeLocationAccess(self.servername, '/', '$tredly_a')
+        self.assertEqual(list(self.servername.blocks['map'].keys()), ['"$tredly_b" ' + self.locationVariable])
+
+        # the check goes with the last container
+        self.layer7Proxy.removeLocationAccess(self.servername, '/', '$tredly_b')
+        self.assertEqual(len(self.servername.blocks['map']), 0)
+        self.assertEqual(len(self.servername.server[0].location['/'].blocks['if']), 0)
+
+    def test_locations_have_their_own_variable(self):
+        otherVariable = self.layer7Proxy.getLocationAccessVariable(self.servername, '/api/')
+
+        self.assertNotEqual(otherVariable, self.locationVariable)
+        self.assertRegex(otherVariable, '^\\$[A-Za-z0-9_]+$')
+
+if __name__ == '__main__':
+    unittest.main()
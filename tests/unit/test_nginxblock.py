@@ -0,0 +1,199 @@
+# Tests the nginx config parser and NginxBlock's reading and writing of config files
+import os.path
+import sys
+import shutil
+import tempfile
+import unittest
+
+scriptDirectory = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, scriptDirectory + "/../../components/tredly-libs/python-common")
+
+# now that pathing is set up, import some tredly modules
+from objects.nginx.nginxparser import NginxParser, NginxComment, NginxSyntaxError
+from objects.nginx.nginxblock import NginxBlock
+from objects.nginx.layer7proxy import Layer7Proxy
+
+# a server_name file as NginxBlock writes it
+SERVERNAME_FILE = '''# servername file
+server {
+    add_header X-Test "a b;c" always;
+    http2;
+    return 301 'https://$host$request_uri';
+    server_name www.example.com;
+    location / {
+        # proxy to the upstream
+        proxy_set_header Host $host;
+        if ($tredly_abc = 0) {
+            return 403;
+        }
+    }
+}
+'''
+
+class TestNginxParser(unittest.TestCase):
+
+    def test_quoted_words(self):
+        root = NginxParser().parse('add_header X-Test "a b;c {d}" always;\nreturn 301 \'https://$host\';')
+
+        self.assertEqual(root.children[0].args, ['X-Test', '"a b;c {d}"', 'always'])
+        self.assertEqual(root.children[1].args, ['301', "'https://$host'"])
+
+    def test_escaped_quotes(self):
+        root = NginxParser().parse('set $a "say \\"hi\\"";')
+
+        self.assertEqual(root.children[0].args, ['$a', '"say \\"hi\\""'])
+
+    def test_variables_in_braces(self):
+        root = NginxParser().parse('set $b ${a}x;')
+
+        self.assertEqual(root.children[0].args, ['$b', '${a}x'])
+
+    def test_comments(self):
+        root = NginxParser().parse('# first\nserver { # inside\n    listen 80; # after\n}')
+
+        self.assertIsInstance(root.children[0], NginxComment)
+        self.assertEqual(root.children[0].text, '# first')
+
+        server = root.children[1]
+        self.assertEqual([child.text for child in server.children if isinstance(child, NginxComment)], ['# inside', '# after'])
+
+    def test_hash_within_word(self):
+        root = NginxParser().parse('return 200 a#b;')
+
+        self.assertEqual(root.children[0].args, ['200', 'a#b'])
+
+    def test_valueless_directive(self):
+        root = NginxParser().parse('ip_hash;')
+
+        self.assertEqual(root.children[0].name, 'ip_hash')
+        self.assertIsNone(root.children[0].value())
+        self.assertIsNone(root.children[0].children)
+
+    def test_nested_blocks(self):
+        root = NginxParser().parse('server { location / { if ($a = 0) { return 403; } } }')
+
+        ifBlock = root.children[0].children[0].children[0]
+        self.assertEqual(ifBlock.name, 'if')
+        self.assertEqual(ifBlock.value(), '($a = 0)')
+        self.assertEqual(ifBlock.children[0].value(), '403')
+
+    def test_line_numbers(self):
+        root = NginxParser().parse('\n\nserver {\n    listen 80;\n}')
+
+        self.assertEqual(root.children[0].line, 3)
+        self.assertEqual(root.children[0].children[0].line, 4)
+
+    def test_syntax_errors(self):
+        for string in ['listen 80', 'server {', '}', 'listen 80 }', '{ listen 80; }', 'return "unterminated;']:
+            with self.assertRaises(NginxSyntaxError, msg=string):
+                NginxParser().parse(string)
+
+
+class TestNginxBlock(unittest.TestCase):
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.filePath = os.path.join(self.tempDir, 'https-www.example.com')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def test_round_trip(self):
+        block = NginxBlock()
+
+        self.assertTrue(block.parse(SERVERNAME_FILE))
+        self.assertEqual(block.toString(), SERVERNAME_FILE)
+
+    def test_order_is_kept(self):
+        string = ('server {\n'
+            '    server_name www.example.com;\n'
+            '    # locations\n'
+            '    location /b {\n'
+            '        return 403;\n'
+            '    }\n'
+            '    location /a {\n'
+            '        return 404;\n'
+            '    }\n'
+            '    # listen after the locations\n'
+            '    listen 443 ssl;\n'
+            '}\n')
+
+        block = NginxBlock()
+
+        self.assertTrue(block.parse(string))
+        self.assertEqual(block.toString(), string)
+
+    def test_added_attrs_go_last(self):
+        block = NginxBlock()
+
+        self.assertTrue(block.parse('keepalive 16;\nserver 10.0.0.2:80;\n'))
+        block.addAttr('server', '10.0.0.1:80')
+        block.attrs['keepalive_timeout'][0] = '60s'
+        block.addAttr('least_conn')
+
+        self.assertEqual(block.toString(), 'least_conn;\nkeepalive 16;\nserver 10.0.0.2:80;\nserver 10.0.0.1:80;\nkeepalive_timeout 60s;\n')
+
+    def test_valueless_directive_round_trip(self):
+        block = NginxBlock()
+
+        self.assertTrue(block.parse('upstream www {\n    keepalive 16;\n    server 10.0.0.1:80;\n    least_conn;\n}\n'))
+        self.assertEqual(block.toString(), 'upstream www {\n    least_conn;\n    keepalive 16;\n    server 10.0.0.1:80;\n}\n')
+
+    def test_load_and_save(self):
+        with open(self.filePath, 'w') as f:
+            f.write(SERVERNAME_FILE)
+
+        block = NginxBlock(None, None, self.filePath)
+        self.assertTrue(block.loadFile())
+
+        # saving what was loaded doesnt change the file
+        self.assertTrue(block.saveFile())
+        self.assertFalse(block.changed)
+
+        block.blocks['server'][0].addAttr('listen', '443 ssl')
+        self.assertTrue(block.saveFile())
+        self.assertTrue(block.changed)
+
+        reloaded = NginxBlock(None, None, self.filePath)
+        self.assertTrue(reloaded.loadFile())
+        self.assertEqual(reloaded.blocks['server'][0].attrs['listen'][0], '443 ssl')
+
+    def test_missing_file_loads_empty(self):
+        block = NginxBlock(None, None, self.filePath)
+
+        self.assertTrue(block.loadFile())
+        self.assertTrue(block.isEmpty())
+
+    def test_empty_file_is_removed(self):
+        with open(self.filePath, 'w') as f:
+            f.write('listen 80;\n')
+
+        block = NginxBlock(None, None, self.filePath)
+        self.assertTrue(block.loadFile())
+
+        block.delAttrByRegex('listen', '.*')
+        self.assertTrue(block.saveFile())
+        self.assertTrue(block.changed)
+        self.assertFalse(os.path.exists(self.filePath))
+
+    def test_invalid_file_fails_to_load(self):
+        with open(self.filePath, 'w') as f:
+            f.write('server {\n    listen 80;\n')
+
+        block = NginxBlock(None, None, self.filePath)
+        self.assertFalse(block.loadFile())
+
+    def test_invalid_file_is_left_alone(self):
+        invalid = 'allow 10.0.0.1\n'
+        with open(self.filePath, 'w') as f:
+            f.write(invalid)
+
+        layer7Proxy = Layer7Proxy()
+        self.assertFalse(layer7Proxy.registerAccessFile(self.filePath, ['10.0.0.2']))
+        self.assertFalse(layer7Proxy.changed)
+
+        with open(self.filePath) as f:
+            self.assertEqual(f.read(), invalid)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+# Tests UnboundControl against a stand in for unbound-control
+import os.path
+import sys
+import shutil
+import tempfile
+import unittest
+
+scriptDirectory = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, scriptDirectory + "/../../components/tredly-libs/python-common")
+
+# now that pathing is set up, import some tredly modules
+from objects.tredly.unboundfile import UnboundFile
+from objects.tredly.unboundcontrol import UnboundControl
+
+UNBOUND_CONTROL_STANDIN = scriptDirectory + "/bin/unbound-control"
+
+class TestUnboundControl(unittest.TestCase):
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.filePath = os.path.join(self.tempDir, 'example.com')
+        self.logPath = os.path.join(self.tempDir, 'unbound-control.log')
+        self.reloadedPath = os.path.join(self.tempDir, 'reloaded')
+
+        os.environ['UNBOUND_CONTROL_LOG'] = self.logPath
+        os.environ.pop('UNBOUND_CONTROL_DOWN', None)
+        os.environ.pop('UNBOUND_CONTROL_FAIL', None)
+
+    def tearDown(self):
+        for name in ['UNBOUND_CONTROL_LOG', 'UNBOUND_CONTROL_DOWN', 'UNBOUND_CONTROL_FAIL']:
+            os.environ.pop(name, None)
+
+        shutil.rmtree(self.tempDir)
+
+    # an UnboundControl using the stand in, whose reload touches a file so the test can see it ran
+    def newControl(self):
+        return UnboundControl(UNBOUND_CONTROL_STANDIN, ['touch', self.reloadedPath])
+
+    # read the unbound file, make changes to it with changeFunc and then write it out
+    def changeFile(self, changeFunc):
+        unboundFile = UnboundFile(self.filePath)
+        unboundFile.read()
+        changeFunc(unboundFile)
+        self.assertTrue(unboundFile.write())
+
+        return unboundFile
+
+    # the commands the stand in has been run with
+    def commands(self):
+        if (not os.path.exists(self.logPath)):
+            return []
+
+        with open(self.logPath) as log:
+            return [line.rstrip('\n') for line in log]
+
+    def test_nothing_queued(self):
+        control = self.newControl()
+        self.assertFalse(control.hasChanges())
+
+    def test_add(self):
+        control = self.newControl()
+        control.queue(self.changeFile(lambda f: f.append('local-data', 'www.example.com', 'IN', 'A', '10.0.0.1', 'uuidA')))
+
+        self.assertTrue(control.hasChanges())
+        self.assertTrue(control.apply())
+        self.assertFalse(control.hasChanges())
+        self.assertEqual(self.commands(), ['status', 'local_data www.example.com IN A 10.0.0.1'])
+
+    def test_shared_record_added_once(self):
+        control = self.newControl()
+        control.queue(self.changeFile(lambda f: f.append('local-data', 'www.example.com', 'IN', 'A', '10.0.0.1', 'uuidA')))
+        control.queue(self.changeFile(lambda f: f.append('local-data', 'www.example.com', 'IN', 'A', '10.0.0.1', 'uuidB')))
+
+        self.assertTrue(control.apply())
+        self.assertEqual(self.commands(), ['status', 'local_data www.example.com IN A 10.0.0.1'])
+
+    def test_remove_keeps_other_records(self):
+        def addRecords(unboundFile):
+            unboundFile.append('local-data', 'www.example.com', 'IN', 'A', '10.0.0.1', 'uuidA')
+            unboundFile.append('local-data', 'www.example.com', 'IN', 'A', '10.0.0.2', 'uuidB')
+        self.changeFile(addRecords)
+
+        control = self.newControl()
+        control.queue(self.changeFile(lambda f: f.removeElementsByUUID('uuidA')))
+
+        self.assertTrue(control.apply())
+        self.assertEqual(self.commands(), ['status', 'local_data_remove www.example.com', 'local_data www.example.com IN A 10.0.0.2'])
+
+    def test_remove_then_add(self):
+        self.changeFile(lambda f: f.append('local-data', 'www.example.com', 'IN', 'A', '10.0.0.1', 'uuidA'))
+
+        # a container stops and another starts with the same name in one queue
+        control = self.newControl()
+        control.queue(self.changeFile(lambda f: f.removeElementsByUUID('uuidA')))
+        control.queue(self.changeFile(lambda f: f.append('local-data', 'www.example.com', 'IN', 'A', '10.0.0.3', 'uuidC')))
+
+        self.assertTrue(control.apply())
+        self.assertEqual(self.commands(), ['status', 'local_data_remove www.example.com', 'local_data www.example.com IN A 10.0.0.3'])
+
+    def test_remove_last_record(self):
+        self.changeFile(lambda f: f.append('local-data', 'www.example.com', 'IN', 'A', '10.0.0.1', 'uuidA'))
+
+        control = self.newControl()
+        control.queue(self.changeFile(lambda f: f.removeElementsByUUID('uuidA')))
+
+        self.assertFalse(os.path.exists(self.filePath))
+        self.assertTrue(control.apply())
+        self.assertEqual(self.commands(), ['status', 'local_data_remove www.example.com'])
+
+    def test_unbound_down_reloads(self):
+        os.environ['UNBOUND_CONTROL_DOWN'] = 'yes'
+
+        control = self.newControl()
+        control.queue(self.changeFile(lambda f: f.append('local-data', 'www.example.com', 'IN', 'A', '10.0.0.1', 'uuidA')))
+
+        self.assertTrue(control.applyOrReload())
+        self.assertEqual(self.commands(), ['status'])
+        self.assertTrue(os.path.exists(self.reloadedPath))
+
+    def test_failed_change_reloads(self):
+        os.environ['UNBOUND_CONTROL_FAIL'] = 'local_data'
+
+        control = self.newControl()
+        control.queue(self.changeFile(lambda f: f.append('local-data', 'www.example.com', 'IN', 'A', '10.0.0.1', 'uuidA')))
+
+        self.assertTrue(control.applyOrReload())
+        self.assertTrue(os.path.exists(self.reloadedPath))
+
+    def test_applied_changes_dont_reload(self):
+        control = self.newControl()
+        control.queue(self.changeFile(lambda f: f.append('local-data', 'www.example.com', 'IN', 'A', '10.0.0.1', 'uuidA')))
+
+        self.assertTrue(control.applyOrReload())
+        self.assertFalse(os.path.exists(self.reloadedPath))
+
+    def test_missing_unbound_control(self):
+        control = UnboundControl(os.path.join(self.tempDir, 'missing'))
+
+        self.assertFalse(control.isAvailable())
+
+if __name__ == '__main__':
+    unittest.main()